@@ -3,6 +3,10 @@ ASGI config for WholeSale project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve it with an ASGI server (e.g. ``uvicorn WholeSale.asgi:application``)
+to let the async chat endpoint (``core:chat_api_async``) hold many
+in-flight model calls per process; sync views keep running in threads.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 """
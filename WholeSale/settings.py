@@ -181,6 +181,7 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     # Allauth
     'allauth.account.middleware.AccountMiddleware',
+    'core.middleware.sales_rollup_middleware',
 ]
 
 ROOT_URLCONF = 'WholeSale.urls'
@@ -255,6 +256,33 @@ if os.getenv('USE_MYSQL', '').lower() == 'true':
         print('Warning: MySQLdb not installed. Using SQLite. Install mysqlclient if you need MySQL support.')
 
 
+# Cache
+# Per-process local memory unless CACHE_BACKEND/CACHE_LOCATION point it at a
+# shared backend; it only holds what each process can rebuild on its own.
+# State every process must see lives in file-based caches shared by the
+# processes of one host:
+# - "notifications": payment and chat change notifications (NOTIFICATIONS_CACHE)
+# - "shared": chat rate-limit windows and operational counters
+#   (CHAT_RATE_LIMIT_CACHE, METRICS_CACHE)
+# add/incr are atomic on Redis and Memcached but not on the file cache, so on
+# several hosts, or where exact limits matter, point those settings at a Redis
+# or Memcached alias. manage.py check --deploy rejects process-local ones.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    },
+    'notifications': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('NOTIFICATIONS_CACHE_LOCATION', os.path.join(BASE_DIR, '.cache', 'notifications')),
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('SHARED_CACHE_LOCATION', os.path.join(BASE_DIR, '.cache', 'shared')),
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -313,9 +341,108 @@ OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
 if not OPENAI_API_KEY:
     print("Warning: OPENAI_API_KEY not found in environment variables. Chat functionality will be disabled.")
 
+# Cached product context for the AI assistant; catalog edits invalidate it
+# immediately through signals, the TTL only bounds bulk updates that bypass them
+CHAT_CONTEXT_CACHE_TTL = int(os.environ.get('CHAT_CONTEXT_CACHE_TTL', 60 * 60))
+# Send only the knowledge base chunks relevant to each question (BM25, see
+# core/kb_index.py) instead of the whole knowledge base
+CHAT_KB_RETRIEVAL = os.getenv('CHAT_KB_RETRIEVAL', 'True').lower() == 'true'
+CHAT_KB_TOP_K = int(os.environ.get('CHAT_KB_TOP_K', 5))
+CHAT_KB_TOKEN_BUDGET = int(os.environ.get('CHAT_KB_TOKEN_BUDGET', 600))
+CHAT_KB_CHUNK_TOKENS = int(os.environ.get('CHAT_KB_CHUNK_TOKENS', 120))
+# Answers to repeated opening questions, keyed by catalog version and the
+# normalized question (0 disables). CHAT_ANSWER_SIMILARITY > 0 also reuses the
+# answer of a near-identical question (TF-IDF cosine similarity, e.g. 0.9)
+CHAT_ANSWER_CACHE_TTL = int(os.environ.get('CHAT_ANSWER_CACHE_TTL', 60 * 60 * 24))
+CHAT_ANSWER_SIMILARITY = float(os.environ.get('CHAT_ANSWER_SIMILARITY', 0))
+# Outbound LLM admission control (core/llm_gate.py): completions in flight per
+# process, how many requests may queue for a slot and for how long (seconds)
+# before a 429, and per-user and per-IP rate limits counted in
+# CHAT_RATE_LIMIT_CACHE (must be shared by all processes)
+CHAT_LLM_MAX_CONCURRENT = int(os.environ.get('CHAT_LLM_MAX_CONCURRENT', 8))
+CHAT_LLM_MAX_QUEUE = int(os.environ.get('CHAT_LLM_MAX_QUEUE', 16))
+CHAT_LLM_MAX_WAIT = float(os.environ.get('CHAT_LLM_MAX_WAIT', 5))
+CHAT_USER_RATE_PER_MINUTE = int(os.environ.get('CHAT_USER_RATE_PER_MINUTE', 20))
+CHAT_IP_RATE_PER_MINUTE = int(os.environ.get('CHAT_IP_RATE_PER_MINUTE', 10))
+CHAT_RATE_LIMIT_BURST = int(os.environ.get('CHAT_RATE_LIMIT_BURST', 5))
+CHAT_TRUST_X_FORWARDED_FOR = os.getenv('CHAT_TRUST_X_FORWARDED_FOR', 'False').lower() == 'true'
+CHAT_RATE_LIMIT_CACHE = os.environ.get('CHAT_RATE_LIMIT_CACHE', 'shared')
+# Cache holding core/metrics.py counters, read by the *_stats commands
+METRICS_CACHE = os.environ.get('METRICS_CACHE', 'shared')
+# Buyer-seller chat push (server-sent events): how long one stream stays open
+# before the browser reconnects, and which cache carries change notifications
+# between processes (core/notifications.py). It must be shared: the payment
+# worker, callback processor and reconciler publish from their own processes.
+# Point it at 'default' only when that is Redis or Memcached
+CHAT_STREAM_MAX_SECONDS = int(os.environ.get('CHAT_STREAM_MAX_SECONDS', 300))
+# Under ASGI chat pages always stream. Under WSGI an open stream holds a worker
+# thread, so pages poll every few seconds unless this is turned on
+CHAT_SSE_ENABLED = os.getenv('CHAT_SSE_ENABLED', 'False').lower() == 'true'
+NOTIFICATIONS_CACHE = os.environ.get('NOTIFICATIONS_CACHE', 'notifications')
+# Most messages one chat fetch or stream event returns; clients page on with
+# the returned cursor
+CHAT_MESSAGES_PAGE_SIZE = int(os.environ.get('CHAT_MESSAGES_PAGE_SIZE', 100))
+# Messages per page of chat history (initial render and each scroll-back)
+CHAT_HISTORY_PAGE_SIZE = int(os.environ.get('CHAT_HISTORY_PAGE_SIZE', 50))
+# Cold archive (core/chat_archive.py, archive_chat_messages command): messages
+# older than CHAT_ARCHIVE_AFTER_DAYS in inactive chats or threads quiet for
+# CHAT_ARCHIVE_QUIET_DAYS move into compressed batches of CHAT_ARCHIVE_BATCH_SIZE
+CHAT_ARCHIVE_AFTER_DAYS = int(os.environ.get('CHAT_ARCHIVE_AFTER_DAYS', 180))
+CHAT_ARCHIVE_QUIET_DAYS = int(os.environ.get('CHAT_ARCHIVE_QUIET_DAYS', 30))
+CHAT_ARCHIVE_BATCH_SIZE = int(os.environ.get('CHAT_ARCHIVE_BATCH_SIZE', 500))
+
+# Logging: console (and LOG_FILE if set) behind a background queue listener
+# (LOG_QUEUE, see core/log.py); DEBUG records are sampled 1 in
+# LOG_DEBUG_SAMPLE_EVERY per call site
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FILE = os.environ.get('LOG_FILE', '')
+LOG_QUEUE = os.getenv('LOG_QUEUE', 'True').lower() == 'true'
+LOG_DEBUG_SAMPLE_EVERY = int(os.environ.get('LOG_DEBUG_SAMPLE_EVERY', 1))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'verbose': {'format': '%(asctime)s %(levelname)s %(name)s: %(message)s'},
+    },
+    'filters': {
+        'sample_debug': {'()': 'core.log.SamplingFilter', 'every': LOG_DEBUG_SAMPLE_EVERY},
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'verbose',
+            'filters': ['sample_debug'],
+        },
+    },
+    'root': {
+        'handlers': ['console'],
+        'level': LOG_LEVEL,
+    },
+    'loggers': {
+        # Route Django's own records through the root (queued) handlers
+        'django': {'handlers': [], 'level': 'INFO', 'propagate': True},
+        # One INFO line per outbound request is too chatty
+        'httpx': {'level': 'WARNING'},
+    },
+}
+if LOG_FILE:
+    LOGGING['handlers']['file'] = {
+        'class': 'logging.handlers.WatchedFileHandler',
+        'filename': LOG_FILE,
+        'formatter': 'verbose',
+        'filters': ['sample_debug'],
+    }
+    LOGGING['root']['handlers'].append('file')
+
 # GAVA API Settings
 GAVA_CLIENT_ID = os.environ.get('GAVA_CLIENT_ID', '')
 GAVA_CLIENT_SECRET = os.environ.get('GAVA_CLIENT_SECRET', '')
+# PIN check results are cached; failed lookups for a shorter time
+GAVA_PIN_CACHE_TTL = int(os.environ.get('GAVA_PIN_CACHE_TTL', 60 * 60 * 24))
+GAVA_PIN_NEGATIVE_CACHE_TTL = int(os.environ.get('GAVA_PIN_NEGATIVE_CACHE_TTL', 60 * 10))
+# Upper bound on requests per second sent to KRA from one process
+GAVA_RATE_LIMIT_PER_SECOND = float(os.environ.get('GAVA_RATE_LIMIT_PER_SECOND', 5))
 
 # M-Pesa API Settings
 MPESA_CONSUMER_KEY = os.environ.get('MPESA_CONSUMER_KEY', '')
@@ -323,6 +450,12 @@ MPESA_CONSUMER_SECRET = os.environ.get('MPESA_CONSUMER_SECRET', '')
 MPESA_BUSINESS_SHORTCODE = os.environ.get('MPESA_BUSINESS_SHORTCODE', '')
 MPESA_PASSKEY = os.environ.get('MPESA_PASSKEY', '')
 MPESA_CALLBACK_URL = os.environ.get('MPESA_CALLBACK_URL', 'https://arhythmically-unciliated-danna.ngrok-free.dev/api/mpesa-callback/')
+# Daraja API root; point at a local stand-in server for testing
+MPESA_BASE_URL = os.environ.get('MPESA_BASE_URL', 'https://api.safaricom.co.ke')
+
+# STK push job queue (processed by `manage.py run_payment_worker`)
+MPESA_JOB_MAX_ATTEMPTS = int(os.environ.get('MPESA_JOB_MAX_ATTEMPTS', '3'))
+MPESA_JOB_STALE_AFTER_SECONDS = int(os.environ.get('MPESA_JOB_STALE_AFTER_SECONDS', '300'))
 
 # Log M-Pesa configuration status
 if not MPESA_CONSUMER_KEY:
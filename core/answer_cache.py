@@ -0,0 +1,171 @@
+"""
+Cache of assistant answers to repeated product questions.
+
+Buyers ask the same few things about a product (MOQ, price at a quantity,
+shipping time). Answers are cached per product/variation and catalog
+version, so any catalog edit that changes the chat context also retires the
+cached answers, under a normalized form of the question: casefolded,
+stopwords dropped, numbers canonicalized (``1,000``, ``1k`` and ``1000.00``
+are the same key). Unlike KB retrieval, the key keeps question words and
+direction words, so "when does it ship" and "where does it ship", or
+"shipping to Mombasa" and "shipping from Mombasa", get different answers.
+
+With ``CHAT_ANSWER_SIMILARITY`` set, a question that misses the exact key
+may reuse the answer to the most similar earlier question of the same
+context when the TF-IDF cosine similarity reaches the threshold and both
+mention the same numbers and question words. Only first turns (no chat history) are cached.
+"""
+import hashlib
+import re
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from . import metrics
+from .kb_index import STOPWORDS, tokenize
+
+# Candidates kept per context for similarity lookups
+MAX_SIMILARITY_CANDIDATES = 200
+
+_NUMBER_RE = re.compile(r"(?<![\w.])(\d[\d,]*(?:\.\d+)?)(k)?\b", re.IGNORECASE)
+_CANONICAL_NUMBER_RE = re.compile(r"^\d+(?:p\d+)?$")
+
+# Words that change what is being asked, kept although retrieval drops them
+QUESTION_WORDS = frozenset('how what when where which who why to from'.split())
+QUESTION_STOPWORDS = STOPWORDS - QUESTION_WORDS
+
+NUMBER_WORDS = {
+    'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6, 'seven': 7,
+    'eight': 8, 'nine': 9, 'ten': 10, 'eleven': 11, 'twelve': 12, 'twenty': 20,
+    'fifty': 50, 'hundred': 100, 'thousand': 1000, 'dozen': 12,
+}
+
+
+def _canonical_number(match):
+    value = float(match.group(1).replace(',', ''))
+    if match.group(2):
+        value *= 1000
+    text = str(int(value)) if value == int(value) else f"{value:.6f}".rstrip('0')
+    # "1.5" would be split by the tokenizer; keep it as one token
+    return f" {text.replace('.', 'p')} "
+
+
+def _stem(token):
+    # Light plural folding: "units" == "unit", "boxes" == "box"
+    if len(token) > 4 and token.endswith('es') and token[-3] in 'sxz':
+        return token[:-2]
+    if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+        return token[:-1]
+    return token
+
+
+def normalize_question(text):
+    """Canonical token list for a question."""
+    text = _NUMBER_RE.sub(_canonical_number, str(text).casefold())
+    tokens = []
+    for token in tokenize(text, QUESTION_STOPWORDS):
+        tokens.append(str(NUMBER_WORDS[token]) if token in NUMBER_WORDS else _stem(token))
+    return tokens
+
+
+def _anchors(tokens):
+    # Numbers and question words must match exactly for a similar question to reuse an answer
+    return frozenset(t for t in tokens if t in QUESTION_WORDS or _CANONICAL_NUMBER_RE.match(t))
+
+
+def _ttl():
+    return getattr(settings, 'CHAT_ANSWER_CACHE_TTL', 60 * 60 * 24)
+
+
+def _context_prefix(snapshot):
+    return f"chat-answer:{snapshot['product_id']}:{snapshot['variation_id'] or 0}:{snapshot['version']}"
+
+
+def _answer_key(snapshot, tokens):
+    digest = hashlib.sha1(' '.join(tokens).encode()).hexdigest()
+    return f"{_context_prefix(snapshot)}:{digest}"
+
+
+def _candidates_key(snapshot):
+    return f"{_context_prefix(snapshot)}:questions"
+
+
+def _cosine_scores(query_tokens, candidate_tokens):
+    """TF-IDF cosine similarity of the query against each candidate question."""
+    docs = [query_tokens] + candidate_tokens
+    vocabulary = {}
+    for tokens in docs:
+        for token in tokens:
+            vocabulary.setdefault(token, len(vocabulary))
+    tf = np.zeros((len(docs), len(vocabulary)), dtype=np.float32)
+    for row, tokens in enumerate(docs):
+        for token in tokens:
+            tf[row, vocabulary[token]] += 1
+    df = (tf > 0).sum(axis=0)
+    vectors = tf * (np.log((1 + len(docs)) / (1 + df)) + 1)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-9)
+    return vectors[1:] @ vectors[0]
+
+
+def lookup(snapshot, question):
+    """Return a cached answer for ``question`` in this context, or None."""
+    if not _ttl():
+        return None
+    tokens = normalize_question(question)
+    if not tokens:
+        return None
+
+    answer = cache.get(_answer_key(snapshot, tokens))
+    if answer is not None:
+        metrics.incr('chat.answer_cache.hit')
+        return answer
+
+    threshold = getattr(settings, 'CHAT_ANSWER_SIMILARITY', 0)
+    if threshold:
+        candidates = [
+            (other, key) for other, key in cache.get(_candidates_key(snapshot), [])
+            if _anchors(other) == _anchors(tokens)
+        ]
+        if candidates:
+            scores = _cosine_scores(tokens, [other for other, _ in candidates])
+            best = int(np.argmax(scores))
+            if scores[best] >= threshold:
+                answer = cache.get(candidates[best][1])
+                if answer is not None:
+                    metrics.incr('chat.answer_cache.similar_hit')
+                    return answer
+
+    metrics.incr('chat.answer_cache.miss')
+    return None
+
+
+def store(snapshot, question, answer):
+    """Cache ``answer`` for ``question`` in this context."""
+    tokens = normalize_question(question)
+    if not _ttl() or not tokens or not answer:
+        return
+    key = _answer_key(snapshot, tokens)
+    cache.set(key, answer, _ttl())
+    if getattr(settings, 'CHAT_ANSWER_SIMILARITY', 0):
+        candidates = [c for c in cache.get(_candidates_key(snapshot), []) if c[1] != key]
+        candidates.append((tokens, key))
+        cache.set(_candidates_key(snapshot), candidates[-MAX_SIMILARITY_CANDIDATES:], _ttl())
+
+
+def stats():
+    """Hit/miss counters and the overall hit rate."""
+    hits = metrics.get('chat.answer_cache.hit')
+    similar = metrics.get('chat.answer_cache.similar_hit')
+    misses = metrics.get('chat.answer_cache.miss')
+    total = hits + similar + misses
+    return {
+        'hits': hits,
+        'similar_hits': similar,
+        'misses': misses,
+        'hit_rate': (hits + similar) / total if total else 0.0,
+    }
+
+
+def reset_stats():
+    metrics.reset('chat.answer_cache.hit', 'chat.answer_cache.similar_hit', 'chat.answer_cache.miss')
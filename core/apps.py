@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from django.conf import settings
+
+        from . import checks, signals  # noqa: F401
+
+        if getattr(settings, 'LOG_QUEUE', True):
+            from .log import install_queue_handler
+            install_queue_handler()
@@ -0,0 +1,184 @@
+"""
+Cold storage for old chat messages.
+
+``archive_messages`` moves messages older than ``CHAT_ARCHIVE_AFTER_DAYS`` out
+of the hot ``BuyerSellerMessage`` and ``ChatMessage`` tables into
+``ArchivedMessageBatch`` rows: one zlib-compressed JSON list of up to
+``batch_size`` consecutive messages per row. Only buyer-seller chats that are
+inactive or have been quiet for ``CHAT_ARCHIVE_QUIET_DAYS``, and product group
+chats quiet for as long, are archived, and the newest message of every thread
+stays hot so inbox previews and delta cursors keep working.
+
+``archived_messages`` reads a buyer-seller chat's history back as unsaved
+``BuyerSellerMessage`` instances, and ``archived_group_messages`` does the same
+for a product group chat as ``ChatMessage`` instances, so views can page past
+the hot window without knowing where a message is stored.
+"""
+import json
+import logging
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Max, Prefetch, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from home.models import (
+    ArchivedMessageBatch, BuyerSellerChat, BuyerSellerMessage, ChatMessage, Product, ProductImage,
+)
+
+logger = logging.getLogger(__name__)
+
+# Fields kept per archived message, by hot model
+_FIELDS = {
+    BuyerSellerMessage: ('id', 'sender_id', 'product_id', 'message', 'is_read', 'created_at'),
+    ChatMessage: ('id', 'user_id', 'reply_for', 'message', 'created_at'),
+}
+
+
+def _pack(rows):
+    return zlib.compress(json.dumps(rows, cls=DjangoJSONEncoder, separators=(',', ':')).encode('utf-8'))
+
+
+def _unpack(payload):
+    rows = json.loads(zlib.decompress(bytes(payload)).decode('utf-8'))
+    for row in rows:
+        row['created_at'] = parse_datetime(row['created_at'])
+    return rows
+
+
+def _archive_thread(messages, owner, batch_size, dry_run):
+    """Move ``messages`` (one thread, oldest first) into batches; returns (messages, batches)."""
+    fields = _FIELDS[messages.model]
+    archived = batches = 0
+    while True:
+        rows = list(messages.values(*fields)[:batch_size])
+        if not rows:
+            return archived, batches
+        archived += len(rows)
+        batches += 1
+        if dry_run:
+            if len(rows) < batch_size:
+                return archived, batches
+            messages = messages.filter(id__gt=rows[-1]['id'])
+            continue
+        with transaction.atomic():
+            ArchivedMessageBatch.objects.create(
+                first_message_id=rows[0]['id'],
+                last_message_id=rows[-1]['id'],
+                first_created_at=rows[0]['created_at'],
+                last_created_at=rows[-1]['created_at'],
+                message_count=len(rows),
+                payload=_pack(rows),
+                **owner
+            )
+            messages.model.objects.filter(id__in=[row['id'] for row in rows]).delete()
+
+
+def archive_messages(older_than_days=None, quiet_days=None, batch_size=None, dry_run=False):
+    """Archive old messages of inactive or quiet threads; returns totals per kind."""
+    older_than_days = older_than_days if older_than_days is not None else settings.CHAT_ARCHIVE_AFTER_DAYS
+    quiet_days = quiet_days if quiet_days is not None else settings.CHAT_ARCHIVE_QUIET_DAYS
+    batch_size = batch_size or settings.CHAT_ARCHIVE_BATCH_SIZE
+    now = timezone.now()
+    cutoff = now - timedelta(days=older_than_days)
+    quiet_cutoff = now - timedelta(days=quiet_days)
+    totals = {'chats': 0, 'chat_messages': 0, 'products': 0, 'group_messages': 0, 'batches': 0}
+
+    chats = BuyerSellerChat.objects.filter(
+        Q(is_active=False) | Q(updated_at__lt=quiet_cutoff),
+        messages__created_at__lt=cutoff,
+    ).distinct().values_list('id', 'last_message_id')
+    for chat_id, last_message_id in chats.iterator():
+        messages = BuyerSellerMessage.objects.filter(chat_id=chat_id, created_at__lt=cutoff)
+        newest = last_message_id or BuyerSellerMessage.objects.filter(chat_id=chat_id).aggregate(n=Max('id'))['n']
+        archived, batches = _archive_thread(
+            messages.exclude(id=newest).order_by('id'), {'chat_id': chat_id}, batch_size, dry_run)
+        if archived:
+            totals['chats'] += 1
+            totals['chat_messages'] += archived
+            totals['batches'] += batches
+            logger.info("Archived %s messages of buyer-seller chat %s in %s batches", archived, chat_id, batches)
+
+    rooms = ChatMessage.objects.filter(product__isnull=False).values('product').annotate(
+        newest=Max('id'), last_at=Max('created_at')).filter(last_at__lt=quiet_cutoff)
+    for room in rooms.iterator():
+        messages = ChatMessage.objects.filter(product_id=room['product'], created_at__lt=cutoff)
+        archived, batches = _archive_thread(
+            messages.exclude(id=room['newest']).order_by('id'), {'product_id': room['product']}, batch_size, dry_run)
+        if archived:
+            totals['products'] += 1
+            totals['group_messages'] += archived
+            totals['batches'] += batches
+            logger.info("Archived %s group chat messages of product %s in %s batches", archived, room['product'], batches)
+    return totals
+
+
+def archived_messages(chat, before_id, limit):
+    """
+    Up to ``limit`` archived messages of ``chat`` older than ``before_id``
+    (all when None), oldest first, and whether older ones remain.
+
+    Returns unsaved BuyerSellerMessage instances with ``sender`` and
+    ``product`` (plus its ``chat_images`` thumbnails) loaded in bulk.
+    Messages whose sender no longer exists are skipped, as in the hot table.
+    """
+    batches = ArchivedMessageBatch.objects.filter(chat=chat).order_by('-last_message_id')
+    if before_id is not None:
+        batches = batches.filter(first_message_id__lt=before_id)
+    rows = []
+    for batch in batches.only('payload').iterator(chunk_size=4):
+        rows = [row for row in _unpack(batch.payload) if before_id is None or row['id'] < before_id] + rows
+        if len(rows) > limit:
+            break
+    has_more = len(rows) > limit
+    rows = rows[-limit:] if limit else []
+
+    users = get_user_model().objects.in_bulk({row['sender_id'] for row in rows})
+    products = Product.objects.prefetch_related(
+        Prefetch('images', queryset=ProductImage.objects.order_by('id'), to_attr='chat_images')
+    ).in_bulk({row['product_id'] for row in rows if row['product_id']})
+    messages = []
+    for row in rows:
+        sender = users.get(row['sender_id'])
+        if sender is None:
+            continue
+        message = BuyerSellerMessage(
+            id=row['id'], chat=chat, sender=sender, message=row['message'],
+            is_read=row['is_read'], created_at=row['created_at'],
+        )
+        message.product = products.get(row['product_id'])
+        messages.append(message)
+    return messages, has_more
+
+
+def archived_group_messages(product_id, after_id, limit):
+    """
+    Up to ``limit`` archived group chat messages of product ``product_id``
+    newer than ``after_id``, oldest first.
+
+    Returns unsaved ChatMessage instances with ``user`` loaded. Messages whose
+    author no longer exists are skipped, as in the hot table.
+    """
+    batches = ArchivedMessageBatch.objects.filter(
+        product_id=product_id, last_message_id__gt=after_id
+    ).order_by('last_message_id')
+    rows = []
+    for batch in batches.only('payload').iterator(chunk_size=4):
+        rows += [row for row in _unpack(batch.payload) if row['id'] > after_id]
+        if len(rows) >= limit:
+            break
+
+    users = get_user_model().objects.in_bulk({row['user_id'] for row in rows})
+    messages = [
+        ChatMessage(
+            id=row['id'], product_id=product_id, user=users[row['user_id']], reply_for=row['reply_for'],
+            message=row['message'], created_at=row['created_at'],
+        )
+        for row in rows if row['user_id'] in users
+    ]
+    return messages[:limit]
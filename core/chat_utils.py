@@ -1,23 +1,36 @@
+import asyncio
+import logging
 import os
-from openai import OpenAI
+import weakref
+from asgiref.sync import sync_to_async
+from openai import AsyncOpenAI, OpenAI
 from django.conf import settings
 from django.core.cache import cache
+from django.db.models import Q
 from django.utils import timezone
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Replies sent instead of a model answer; never worth caching
+CHAT_NOT_CONFIGURED_MESSAGE = "I'm sorry, the AI chat service is not configured. Please contact support."
+CHAT_UNAVAILABLE_MESSAGE = "I'm sorry, I'm having trouble connecting to the chat service. Please try again later."
+
 # Initialize OpenAI client
 try:
     api_key = os.getenv('OPENAI_API_KEY')
     if not api_key:
-        print("Warning: OPENAI_API_KEY not found in environment variables. Chat functionality will be disabled.")
+        logger.warning("OPENAI_API_KEY not found in environment variables. Chat functionality will be disabled.")
         client = None
     else:
-        client = OpenAI(api_key=api_key)
+        # OPENAI_BASE_URL points the client at a compatible server, e.g.
+        # `manage.py openai_stub_server` for local testing
+        client = OpenAI(api_key=api_key, base_url=os.getenv('OPENAI_BASE_URL') or None)
 except Exception as e:
-    print(f"Error initializing OpenAI client: {str(e)}")
+    logger.error("Error initializing OpenAI client: %s", e)
     client = None
 
 def get_chat_response(messages, model="gpt-3.5-turbo", temperature=0.7, max_tokens=500):
@@ -34,7 +47,7 @@ def get_chat_response(messages, model="gpt-3.5-turbo", temperature=0.7, max_toke
         str: Generated response from the model
     """
     if not client:
-        return "I'm sorry, the AI chat service is not configured. Please contact support."
+        return CHAT_NOT_CONFIGURED_MESSAGE
     
     try:
         response = client.chat.completions.create(
@@ -45,19 +58,116 @@ def get_chat_response(messages, model="gpt-3.5-turbo", temperature=0.7, max_toke
         )
         return response.choices[0].message.content.strip()
     except Exception as e:
-        print(f"Error in get_chat_response: {str(e)}")
-        return "I'm sorry, I'm having trouble connecting to the chat service. Please try again later."
+        logger.warning("Error in get_chat_response: %s", e)
+        return CHAT_UNAVAILABLE_MESSAGE
+
+def stream_chat_response(messages, model="gpt-3.5-turbo", temperature=0.7, max_tokens=500):
+    """
+    Stream a chat completion, yielding text deltas as they arrive.
+
+    Same arguments as get_chat_response. Errors are raised to the caller,
+    which has usually already started its response and reports them in-band.
+    """
+    if not client:
+        yield CHAT_NOT_CONFIGURED_MESSAGE
+        return
+
+    stream = client.chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        stream=True,
+    )
+    try:
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+    finally:
+        stream.close()
+
+# One AsyncOpenAI client per event loop: its connection pool is bound to the
+# loop it was created on, and under WSGI each async view gets a fresh loop.
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    """Return the AsyncOpenAI client for the running event loop (None if not configured)."""
+    if not client:
+        return None
+    loop = asyncio.get_running_loop()
+    async_client = _async_clients.get(loop)
+    if async_client is None:
+        async_client = AsyncOpenAI(api_key=api_key, base_url=os.getenv('OPENAI_BASE_URL') or None)
+        _async_clients[loop] = async_client
+    return async_client
+
+
+async def aget_chat_response(messages, model="gpt-3.5-turbo", temperature=0.7, max_tokens=500):
+    """Async counterpart of get_chat_response; awaits the completion without holding a thread."""
+    async_client = get_async_client()
+    if not async_client:
+        return CHAT_NOT_CONFIGURED_MESSAGE
+
+    try:
+        response = await async_client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+        )
+        return response.choices[0].message.content.strip()
+    except Exception as e:
+        logger.warning("Error in aget_chat_response: %s", e)
+        return CHAT_UNAVAILABLE_MESSAGE
+
+
+async def astream_chat_response(messages, model="gpt-3.5-turbo", temperature=0.7, max_tokens=500):
+    """Async counterpart of stream_chat_response."""
+    async_client = get_async_client()
+    if not async_client:
+        yield CHAT_NOT_CONFIGURED_MESSAGE
+        return
+
+    stream = await async_client.chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        stream=True,
+    )
+    try:
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+    finally:
+        await stream.close()
 
 def generate_product_context(product, variation=None):
     """Generate comprehensive context about the product and its variations for the AI"""
-    from home.models import ProductImage, ProductAttribute  # Import models here to avoid circular imports
-    
+    from django.db.models import Prefetch
+    from home.models import Product, ProductVariation  # Import models here to avoid circular imports
+
+    # Load everything the context needs in a fixed number of queries
+    product = Product.objects.select_related('business').prefetch_related(
+        'categories',
+        'images',
+        'kb',
+        Prefetch('variations', queryset=ProductVariation.objects.prefetch_related('price_tiers', 'kb')),
+    ).get(pk=product.pk)
+
     # Get categories with details
     categories = [{
         'id': cat.id,
         'name': cat.name,
         'description': getattr(cat, 'description', '')
-    } for cat in product.categories.all()] if product.categories.exists() else []
+    } for cat in product.categories.all()]
 
     # Get product images
     product_images = [{
@@ -69,7 +179,7 @@ def generate_product_context(product, variation=None):
 
     # Get all variations for this product with related data
     variations = []
-    for var in product.variations.all().select_related('product'):
+    for var in product.variations.all():
         # Parse the name field to extract attribute information
         attributes = []
         try:
@@ -87,7 +197,7 @@ def generate_product_context(product, variation=None):
                     'value': var.name.strip()
                 })
         except Exception as e:
-            debug_print(f"Error parsing variation name '{var.name}': {str(e)}")
+            logger.debug("Error parsing variation name %r: %s", var.name, e)
             attributes.append({
                 'name': 'Variant',
                 'value': var.name.strip() if var.name else 'Unnamed Variant'
@@ -111,22 +221,22 @@ def generate_product_context(product, variation=None):
         
         # Add KB data for this variation if it exists
         try:
-            kb_entry = var.kb.first()
+            kb_entry = min(var.kb.all(), key=lambda kb: kb.pk, default=None)
             if kb_entry and kb_entry.content:
                 variation_data['kb_data'] = kb_entry.content
         except Exception as e:
-            print(f"Error fetching KB data for variation {var.id}: {str(e)}")
+            logger.warning("Error fetching KB data for variation %s: %s", var.id, e)
             
         variations.append(variation_data)
 
     # Get product KB data
     product_kb = None
     try:
-        kb_entry = product.kb.first()
+        kb_entry = min(product.kb.all(), key=lambda kb: kb.pk, default=None)
         if kb_entry and kb_entry.content:
             product_kb = kb_entry.content
     except Exception as e:
-        print(f"Error fetching product KB data: {str(e)}")
+        logger.warning("Error fetching product KB data: %s", e)
 
     # Build the complete context
     context = {
@@ -142,9 +252,9 @@ def generate_product_context(product, variation=None):
             'kb_data': product_kb,
             # Add business info if available
             'business': {
-                'id': product.business.id if hasattr(product, 'business') and product.business else None,
-                'name': product.business.name if hasattr(product, 'business') and product.business else 'No Business',
-            } if hasattr(product, 'business') else {}
+                'id': product.business.id if product.business else None,
+                'name': product.business.name if product.business else 'No Business',
+            }
         },
         'variations': variations,
         'current_variation_id': variation.id if variation else None,
@@ -153,8 +263,165 @@ def generate_product_context(product, variation=None):
     
     return context
 
-def get_system_prompt(context):
-    """Generate a comprehensive system prompt with detailed product context"""
+# ==============================
+# Cached context snapshots
+# ==============================
+# A snapshot (serialized context plus system prompt) is stored per
+# (product, variation) under the product's catalog version: the newest
+# updated_at and row count across the product, its variations, price tiers,
+# knowledge base entries, images and categories. The version itself is cached
+# under a pointer key that core.signals deletes whenever any of those rows
+# change, so a repeat chat turn reads two cache keys and touches no catalog
+# tables.
+
+def _version_pointer_key(product_id):
+    return f"chat-context:version:{product_id}"
+
+
+def _variation_product_key(variation_id):
+    return f"chat-context:variation-product:{variation_id}"
+
+
+def _snapshot_key(product_id, variation_id, version):
+    return f"chat-context:snapshot:{product_id}:{variation_id or 0}:{version}"
+
+
+def _cache_ttl():
+    return getattr(settings, 'CHAT_CONTEXT_CACHE_TTL', 60 * 60)
+
+
+def catalog_version(product_id):
+    """Fingerprint of everything generate_product_context reads for a product."""
+    from django.db.models import Count, Max, OuterRef, Subquery, Value
+    from django.db.models.functions import Coalesce
+    from home.models import PriceTier, Product, ProductCategory, ProductImage, ProductKB, ProductVariation
+
+    related = {
+        'variations': ProductVariation.objects.filter(product=OuterRef('pk')),
+        'tiers': PriceTier.objects.filter(variation__product=OuterRef('pk')),
+        'kb': ProductKB.objects.filter(Q(product=OuterRef('pk')) | Q(variation__product=OuterRef('pk'))),
+        'images': ProductImage.objects.filter(product=OuterRef('pk')),
+        'categories': ProductCategory.objects.filter(products=OuterRef('pk')),
+    }
+    # Newest updated_at and row count per relation (counts catch deletions)
+    annotations = {}
+    for name, queryset in related.items():
+        grouped = queryset.order_by().annotate(_group=Value(1)).values('_group')
+        annotations[f'{name}_updated'] = Subquery(grouped.annotate(m=Max('updated_at')).values('m')[:1])
+        annotations[f'{name}_count'] = Coalesce(Subquery(grouped.annotate(c=Count('pk')).values('c')[:1]), 0)
+
+    row = Product.objects.filter(pk=product_id).annotate(**annotations).values(
+        'updated_at', 'business__updated_at', *annotations
+    ).first()
+    if row is None:
+        return None
+    return "|".join(
+        value.isoformat() if hasattr(value, 'isoformat') else str(value)
+        for value in row.values()
+    )
+
+
+def get_chat_context(product_id=None, variation_id=None):
+    """
+    Return the cached snapshot for a product (or one of its variations).
+
+    The snapshot is a dict with ``context``, ``system_prompt`` and the ids and
+    names of the product and variation. Raises ``Product.DoesNotExist`` /
+    ``ProductVariation.DoesNotExist`` for unknown ids.
+    """
+    from home.models import Product, ProductVariation
+
+    # Normalise ids before they become cache keys (raises ValueError if invalid)
+    product_id = int(product_id) if product_id else None
+    variation_id = int(variation_id) if variation_id else None
+
+    if variation_id:
+        product_id = cache.get(_variation_product_key(variation_id))
+        if product_id is None:
+            product_id = ProductVariation.objects.values_list('product_id', flat=True).get(pk=variation_id)
+            cache.set(_variation_product_key(variation_id), product_id, _cache_ttl())
+
+    version = cache.get(_version_pointer_key(product_id))
+    if version is not None:
+        snapshot = cache.get(_snapshot_key(product_id, variation_id, version))
+        if snapshot is not None:
+            return snapshot
+
+    version = catalog_version(product_id)
+    if version is None:
+        raise Product.DoesNotExist(f"Product {product_id} does not exist")
+    cache.set(_version_pointer_key(product_id), version, _cache_ttl())
+
+    key = _snapshot_key(product_id, variation_id, version)
+    snapshot = cache.get(key)
+    if snapshot is None:
+        product = Product.objects.get(pk=product_id)
+        variation = ProductVariation.objects.get(pk=variation_id, product_id=product_id) if variation_id else None
+        context = generate_product_context(product, variation)
+        snapshot = {
+            'context': context,
+            'system_prompt': get_system_prompt(context),
+            'product_id': product.id,
+            'product_name': product.name,
+            'variation_id': variation.id if variation else None,
+            'variation_name': variation.name if variation else None,
+            'version': version,
+        }
+        cache.set(key, snapshot, _cache_ttl())
+    return snapshot
+
+
+async def aget_chat_context(product_id=None, variation_id=None):
+    """
+    Async counterpart of get_chat_context.
+
+    Cache hits are served through the cache's async API; a miss (or an
+    unknown variation) builds the snapshot with the ORM in a worker thread.
+    """
+    cached_product_id = int(product_id) if product_id else None
+    cached_variation_id = int(variation_id) if variation_id else None
+
+    if cached_variation_id:
+        cached_product_id = await cache.aget(_variation_product_key(cached_variation_id))
+    if cached_product_id is not None:
+        version = await cache.aget(_version_pointer_key(cached_product_id))
+        if version is not None:
+            snapshot = await cache.aget(_snapshot_key(cached_product_id, cached_variation_id, version))
+            if snapshot is not None:
+                return snapshot
+
+    return await sync_to_async(get_chat_context)(product_id=product_id, variation_id=variation_id)
+
+
+def invalidate_chat_context(product_id):
+    """Force the next chat turn for this product to re-check its catalog version."""
+    if product_id:
+        cache.delete(_version_pointer_key(product_id))
+
+
+def build_system_prompt(snapshot, query):
+    """
+    System prompt for one chat turn.
+
+    With CHAT_KB_RETRIEVAL on, the knowledge base sections are replaced by
+    the chunks most relevant to ``query`` (see core.kb_index); otherwise the
+    snapshot's full prompt is used.
+    """
+    if not getattr(settings, 'CHAT_KB_RETRIEVAL', True):
+        return snapshot['system_prompt']
+
+    from .kb_index import format_excerpts, retrieve
+
+    chunks = retrieve('product', snapshot['product_id'], query)
+    return get_system_prompt(snapshot['context'], knowledge=format_excerpts(chunks))
+
+
+def get_system_prompt(context, knowledge=None):
+    """Generate a comprehensive system prompt with detailed product context
+
+    ``knowledge`` replaces the full knowledge base dump with pre-selected
+    excerpts (an empty string when nothing relevant was found).
+    """
     product = context['product']
     variations = context.get('variations', [])
     current_variation_id = context.get('current_variation_id')
@@ -189,7 +456,12 @@ def get_system_prompt(context):
     
     # Format product KB data if available
     kb_info = ""
-    if product.get('kb_data'):
+    if knowledge is not None:
+        kb_info = (
+            "\nRELEVANT KNOWLEDGE BASE EXCERPTS:\n" + knowledge if knowledge
+            else "\nKNOWLEDGE BASE: no entries match this question."
+        )
+    elif product.get('kb_data'):
         kb_info = "\nPRODUCT KNOWLEDGE BASE:\n"
         if isinstance(product['kb_data'], dict):
             kb_info += '\n'.join([f"- {k}: {v}" for k, v in product['kb_data'].items()])
@@ -198,7 +470,7 @@ def get_system_prompt(context):
     
     # Format variation KB data
     variation_kb_info = ""
-    for var in variations:
+    for var in (variations if knowledge is None else []):
         if var.get('kb_data'):
             variation_kb_info += f"\nKNOWLEDGE BASE FOR VARIATION '{var['name']}':\n"
             if isinstance(var['kb_data'], dict):
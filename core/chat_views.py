@@ -1,134 +1,274 @@
 import json
-import traceback
-import sys
-import json
-from django.http import JsonResponse
+import logging
+import math
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
-from django.contrib.auth.decorators import login_required
-from django.core.cache import cache
-from django.conf import settings
-
-# Debug print function
-def debug_print(*args, **kwargs):
-    """Print debug information with file and line number"""
-    import inspect
-    frame = inspect.currentframe().f_back
-    print(f"\n[DEBUG] {frame.f_code.co_filename}:{frame.f_lineno} - ", end="")
-    print(*args, **{**{'file': sys.stderr}, **kwargs})
-
-# Import models and utilities with error handling
-try:
-    from home.models import Product, ProductVariation
-except Exception as e:
-    debug_print(f"Error importing models: {str(e)}")
-    raise
-
-try:
-    from .chat_utils import get_chat_response, generate_product_context, get_system_prompt
-except Exception as e:
-    debug_print(f"Error importing chat utilities: {str(e)}")
-    debug_print("Traceback:", traceback.format_exc())
-    raise
+
+from home.models import Product, ProductVariation
+
+from . import answer_cache, llm_gate
+from .chat_utils import (
+    CHAT_NOT_CONFIGURED_MESSAGE, CHAT_UNAVAILABLE_MESSAGE,
+    aget_chat_context, aget_chat_response, astream_chat_response, build_system_prompt,
+    get_chat_context, get_chat_response, stream_chat_response,
+)
+
+logger = logging.getLogger(__name__)
+
+def _retrieval_query(chat_history, user_message):
+    """The question plus the previous user turn, so follow-ups keep their topic."""
+    previous = [msg.get('text', '') for msg in (chat_history or [])[-5:] if msg.get('is_user')]
+    return ' '.join(previous[-1:] + [user_message])
+
+
+def _build_messages(system_prompt, chat_history, user_message):
+    """System prompt, the last few turns of history, then the new user message."""
+    # Prepare messages for the API
+    messages = [
+        {"role": "system", "content": system_prompt}
+    ]
+    logger.debug("System prompt length: %d characters", len(system_prompt))
+    
+    # Add chat history if available
+    if chat_history:
+        logger.debug("Adding %d messages from chat history", len(chat_history))
+        for msg in chat_history[-5:]:  # Limit history to last 5 messages
+            role = "user" if msg.get('is_user') else "assistant"
+            messages.append({"role": role, "content": msg.get('text', '')})
+    
+    # Add current user message
+    messages.append({"role": "user", "content": user_message})
+    logger.debug("Total messages to send: %d", len(messages))
+    return messages
+
+
+def _response_context(snapshot):
+    return {
+        'product_id': snapshot['product_id'],
+        'product_name': snapshot['product_name'],
+        'variation_id': snapshot['variation_id'],
+        'variation_name': snapshot['variation_name']
+    }
+
+
+def _wants_stream(request, data):
+    return bool(data.get('stream')) or 'text/event-stream' in request.headers.get('Accept', '')
+
+
+def _sse_response(events):
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _answer_saver(snapshot, user_message, chat_history):
+    """Callback that caches a fresh answer, or None when this turn is not cacheable.
+
+    Only opening questions are cached: with history the answer depends on
+    the earlier turns, not just the question.
+    """
+    if chat_history:
+        return None
+
+    def save(answer):
+        if answer and answer not in (CHAT_NOT_CONFIGURED_MESSAGE, CHAT_UNAVAILABLE_MESSAGE):
+            answer_cache.store(snapshot, user_message, answer)
+    return save
+
+
+def _cached_answer_response(request, data, answer, response_context):
+    """Serve a cached answer in the format the client asked for."""
+    if _wants_stream(request, data):
+        # Already complete, so a plain response carrying the whole event stream
+        response = HttpResponse(''.join([
+            _sse_event('context', response_context),
+            _sse_event('token', {'text': answer}),
+            _sse_event('done', {'response': answer, 'cached': True}),
+        ]), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        return response
+    return JsonResponse({'response': answer, 'context': response_context, 'cached': True})
+
+
+def _too_many_requests(message, retry_after):
+    retry_after = max(1, math.ceil(retry_after))
+    response = JsonResponse({'error': message, 'retry_after': retry_after}, status=429)
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def _throttled_response(retry_after):
+    return _too_many_requests("You're sending messages too quickly. Please wait a moment and try again.",
+                              retry_after)
+
+
+def _busy_response(rejection):
+    return _too_many_requests("The assistant is busy right now. Please try again in a moment.",
+                              rejection.retry_after)
+
+
+class _GatedStream:
+    """Hold the LLM gate slot taken by the view until the stream is done.
+
+    The slot is given back when the stream finishes or when the response is
+    closed, whichever comes first, so a response that is never iterated
+    (client gone, middleware replaced it) does not keep it.
+    """
+
+    def __init__(self, events):
+        self._events = events
+        self._released = False
+
+    def close(self):
+        # StreamingHttpResponse registers this as a closer of the response
+        if not self._released:
+            self._released = True
+            llm_gate.gate.release()
+
+
+class _SyncGatedStream(_GatedStream):
+    def __iter__(self):
+        try:
+            yield from self._events
+        finally:
+            self.close()
+
+
+class _AsyncGatedStream(_GatedStream):
+    async def __aiter__(self):
+        try:
+            async for event in self._events:
+                yield event
+        finally:
+            self.close()
+
+
+def _stream_chat(messages, snapshot_context, on_complete=None):
+    """Relay completion deltas as server-sent events.
+
+    Emits ``context`` first, a ``token`` event per delta, then ``done`` with
+    the full response (or ``error`` if the completion fails midway).
+    """
+    yield _sse_event('context', snapshot_context)
+    parts = []
+    try:
+        for delta in stream_chat_response(messages):
+            parts.append(delta)
+            yield _sse_event('token', {'text': delta})
+    except Exception as e:
+        logger.warning("Error streaming chat response: %s", e)
+        yield _sse_event('error', {'error': CHAT_UNAVAILABLE_MESSAGE})
+        return
+    response = ''.join(parts).strip()
+    if on_complete:
+        on_complete(response)
+    yield _sse_event('done', {'response': response})
+
+
+async def _astream_chat(messages, snapshot_context, on_complete=None):
+    """Async counterpart of _stream_chat, consumed directly by the ASGI handler."""
+    yield _sse_event('context', snapshot_context)
+    parts = []
+    try:
+        async for delta in astream_chat_response(messages):
+            parts.append(delta)
+            yield _sse_event('token', {'text': delta})
+    except Exception as e:
+        logger.warning("Error streaming chat response: %s", e)
+        yield _sse_event('error', {'error': CHAT_UNAVAILABLE_MESSAGE})
+        return
+    response = ''.join(parts).strip()
+    if on_complete:
+        await sync_to_async(on_complete)(response)
+    yield _sse_event('done', {'response': response})
+
 
 @csrf_exempt
 @require_http_methods(["POST"])
 def chat_api(request):
     """API endpoint for chat functionality"""
-    debug_print("Chat API endpoint called")
     
     try:
-        debug_print("Request body:", request.body)
         data = json.loads(request.body)
-        debug_print("Parsed data:", data)
         
         user_message = data.get('message', '').strip()
         product_id = data.get('product_id')
         variation_id = data.get('variation_id')
         chat_history = data.get('chat_history', [])
         
-        debug_print(f"Message: {user_message}, Product ID: {product_id}, Variation ID: {variation_id}")
+        logger.debug("Chat message for product %s, variation %s: %d chars",
+                     product_id, variation_id, len(user_message))
         
         if not user_message:
-            debug_print("Error: No message provided")
             return JsonResponse({'error': 'Message is required'}, status=400)
             
-        # Get variation (and product through variation)
+        if not variation_id and not product_id:
+            return JsonResponse({'error': 'Either product_id or variation_id is required'}, status=400)
+
+        # Get the cached context snapshot (product and variation details plus system prompt)
         try:
-            debug_print("Attempting to fetch product/variation...")
-            if variation_id:
-                debug_print(f"Fetching variation with ID: {variation_id}")
-                variation = ProductVariation.objects.get(id=variation_id)
-                product = variation.product
-                debug_print(f"Found variation: {variation.name}, Product: {product.name}")
-            elif product_id:
-                debug_print(f"Fetching product with ID: {product_id}")
-                product = Product.objects.get(id=product_id)
-                variation = None
-                debug_print(f"Found product: {product.name}")
-            else:
-                debug_print("Error: Neither product_id nor variation_id provided")
-                return JsonResponse({'error': 'Either product_id or variation_id is required'}, status=400)
-                
+            snapshot = get_chat_context(product_id=product_id, variation_id=variation_id)
         except Product.DoesNotExist:
-            debug_print(f"Product not found with ID: {product_id}")
             return JsonResponse({'error': 'Product not found'}, status=404)
         except ProductVariation.DoesNotExist:
-            debug_print(f"Variation not found with ID: {variation_id}")
             return JsonResponse({'error': 'Variation not found'}, status=404)
         except ValueError as ve:
-            debug_print(f"ValueError: {str(ve)}")
             return JsonResponse({'error': 'Invalid ID format'}, status=400)
         except Exception as e:
-            debug_print(f"Unexpected error fetching product/variation: {str(e)}")
-            debug_print("Traceback:", traceback.format_exc())
+            logger.exception("Unexpected error fetching product/variation")
             return JsonResponse({'error': 'Error retrieving product information'}, status=500)
         
         try:
-            # Generate context and system prompt
-            debug_print("Generating product context...")
-            context = generate_product_context(product, variation)
-            debug_print("Context generated successfully")
-            
-            debug_print("Generating system prompt...")
-            system_prompt = get_system_prompt(context)
-            debug_print("System prompt generated successfully")
-            
-            # Prepare messages for the API
-            messages = [
-                {"role": "system", "content": system_prompt}
-            ]
-            debug_print(f"System prompt length: {len(system_prompt)} characters")
-            
-            # Add chat history if available
-            if chat_history:
-                debug_print(f"Adding {len(chat_history)} messages from chat history")
-                for msg in chat_history[-5:]:  # Limit history to last 5 messages
-                    role = "user" if msg.get('is_user') else "assistant"
-                    messages.append({"role": role, "content": msg.get('text', '')})
-            
-            # Add current user message
-            messages.append({"role": "user", "content": user_message})
-            debug_print(f"Total messages to send: {len(messages)}")
+            response_context = _response_context(snapshot)
+
+            # Repeated opening questions are answered from the answer cache
+            save_answer = _answer_saver(snapshot, user_message, chat_history)
+            if save_answer:
+                cached = answer_cache.lookup(snapshot, user_message)
+                if cached is not None:
+                    logger.debug("Answer cache hit")
+                    return _cached_answer_response(request, data, cached, response_context)
+
+            system_prompt = build_system_prompt(snapshot, _retrieval_query(chat_history, user_message))
+            messages = _build_messages(system_prompt, chat_history, user_message)
+
+            # Admission control before the model call: per-user/IP rate, then
+            # the process-wide concurrency gate
+            allowed, retry_after = llm_gate.allow_request(request)
+            if not allowed:
+                return _throttled_response(retry_after)
+            try:
+                llm_gate.gate.acquire()
+            except llm_gate.GateRejected as rejection:
+                logger.info("LLM gate rejected request: %s", rejection.reason)
+                return _busy_response(rejection)
+
+            # Streaming mode: relay tokens as server-sent events as they arrive
+            if _wants_stream(request, data):
+                return _sse_response(_SyncGatedStream(_stream_chat(messages, response_context, on_complete=save_answer)))
             
             # Get response from OpenAI
-            debug_print("Sending request to OpenAI...")
-            response = get_chat_response(messages)
-            debug_print("Received response from OpenAI")
+            try:
+                response = get_chat_response(messages)
+            finally:
+                llm_gate.gate.release()
+            if save_answer:
+                save_answer(response)
             
             return JsonResponse({
                 'response': response,
-                'context': {
-                    'product_id': product.id,
-                    'product_name': product.name,
-                    'variation_id': variation.id if variation else None,
-                    'variation_name': variation.name if variation else None
-                }
+                'context': response_context
             })
             
         except Exception as e:
-            debug_print(f"Error in chat processing: {str(e)}")
-            debug_print("Traceback:", traceback.format_exc())
+            logger.exception("Error in chat processing")
             return JsonResponse(
                 {
                     'error': 'An error occurred while processing your request',
@@ -139,15 +279,99 @@ def chat_api(request):
             )
             
     except json.JSONDecodeError as je:
-        debug_print(f"JSON decode error: {str(je)}")
         return JsonResponse(
             {'error': 'Invalid JSON in request body'}, 
             status=400
         )
     except Exception as e:
-        debug_print(f"Unexpected error in chat_api: {str(e)}")
-        debug_print("Traceback:", traceback.format_exc())
+        logger.exception("Unexpected error in chat_api")
         return JsonResponse(
             {'error': 'An unexpected error occurred'}, 
             status=500
         )
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+async def chat_api_async(request):
+    """
+    Async variant of chat_api for ASGI deployments (WholeSale/asgi.py).
+
+    Same request and response format, including streaming. The completion
+    is awaited with AsyncOpenAI, so a slow model call no longer pins a worker
+    thread; under WSGI the view still works but gains nothing.
+    """
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError as je:
+        return JsonResponse({'error': 'Invalid JSON in request body'}, status=400)
+
+    user_message = data.get('message', '').strip()
+    product_id = data.get('product_id')
+    variation_id = data.get('variation_id')
+    chat_history = data.get('chat_history', [])
+
+    if not user_message:
+        return JsonResponse({'error': 'Message is required'}, status=400)
+    if not variation_id and not product_id:
+        return JsonResponse({'error': 'Either product_id or variation_id is required'}, status=400)
+
+    try:
+        snapshot = await aget_chat_context(product_id=product_id, variation_id=variation_id)
+    except Product.DoesNotExist:
+        return JsonResponse({'error': 'Product not found'}, status=404)
+    except ProductVariation.DoesNotExist:
+        return JsonResponse({'error': 'Variation not found'}, status=404)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid ID format'}, status=400)
+    except Exception as e:
+        logger.exception("Unexpected error fetching product/variation")
+        return JsonResponse({'error': 'Error retrieving product information'}, status=500)
+
+    try:
+        response_context = _response_context(snapshot)
+
+        save_answer = _answer_saver(snapshot, user_message, chat_history)
+        if save_answer:
+            cached = await sync_to_async(answer_cache.lookup)(snapshot, user_message)
+            if cached is not None:
+                return _cached_answer_response(request, data, cached, response_context)
+
+        system_prompt = await sync_to_async(build_system_prompt)(
+            snapshot, _retrieval_query(chat_history, user_message)
+        )
+        messages = _build_messages(system_prompt, chat_history, user_message)
+
+        # request.user may hit the session store, so the rate check runs in a thread
+        allowed, retry_after = await sync_to_async(llm_gate.allow_request)(request)
+        if not allowed:
+            return _throttled_response(retry_after)
+        try:
+            await llm_gate.gate.aacquire()
+        except llm_gate.GateRejected as rejection:
+            logger.info("LLM gate rejected request: %s", rejection.reason)
+            return _busy_response(rejection)
+
+        if _wants_stream(request, data):
+            return _sse_response(_AsyncGatedStream(_astream_chat(messages, response_context, on_complete=save_answer)))
+
+        try:
+            response = await aget_chat_response(messages)
+        finally:
+            llm_gate.gate.release()
+        if save_answer:
+            await sync_to_async(save_answer)(response)
+        return JsonResponse({
+            'response': response,
+            'context': response_context
+        })
+    except Exception as e:
+        logger.exception("Error in chat processing")
+        return JsonResponse(
+            {
+                'error': 'An error occurred while processing your request',
+                'details': str(e),
+                'type': type(e).__name__
+            },
+            status=500
+        )
@@ -0,0 +1,41 @@
+"""
+System checks for the caches core shares between processes.
+
+Notifications, chat rate limits and operational counters are written by one
+process and read by others (web workers, payment and callback workers,
+management commands). A process-local cache silently breaks them, so
+``manage.py check --deploy`` rejects one.
+"""
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+PROCESS_LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+SHARED_CACHE_SETTINGS = (
+    ('NOTIFICATIONS_CACHE', 'payment and chat notifications'),
+    ('CHAT_RATE_LIMIT_CACHE', 'chat rate limits'),
+    ('METRICS_CACHE', 'operational counters'),
+)
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_caches(app_configs, **kwargs):
+    errors = []
+    for name, purpose in SHARED_CACHE_SETTINGS:
+        alias = getattr(settings, name, 'default')
+        backend = settings.CACHES.get(alias, {}).get('BACKEND')
+        if backend is None:
+            errors.append(Error(
+                f"{name} names the cache '{alias}', which is not in CACHES.",
+                id='core.E001',
+            ))
+        elif backend in PROCESS_LOCAL_BACKENDS:
+            errors.append(Error(
+                f"{name} uses the process-local cache '{alias}', so {purpose} are not shared between processes.",
+                hint="Use the file-based 'shared' or 'notifications' alias, or a Redis or Memcached cache.",
+                id='core.E002',
+            ))
+    return errors
@@ -0,0 +1,311 @@
+"""
+In-process stand-in for the Safaricom Daraja API.
+
+Implements the endpoints ``MPesaService`` uses (OAuth, STK push, STK push
+query, pull transactions) with configurable latency and failure rates, and
+delivers STK callbacks to the request's ``CallBackURL`` (or an override) after
+a delay. Point ``MPESA_BASE_URL`` at it to exercise checkout end to end
+without Safaricom; ``manage.py daraja_simulator`` runs it from the command line.
+"""
+import base64
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytz
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Daraja's answer to an STK query for a prompt the customer has not acted on
+STILL_PROCESSING = {
+    'errorCode': '500.001.1001',
+    'errorMessage': 'The transaction is being processed',
+}
+
+# Daraja timestamps and Pull API windows are in Nairobi time
+NAIROBI = pytz.timezone("Africa/Nairobi")
+
+RESULT_DESCRIPTIONS = {
+    0: 'The service request is processed successfully.',
+    1: 'The balance is insufficient for the transaction.',
+    1032: 'Request cancelled by user',
+    1037: 'DS timeout user cannot be reached',
+}
+
+
+class SimulatorConfig:
+    """Tunable behaviour of the simulator; all rates are probabilities in [0, 1]."""
+
+    def __init__(self, latency_ms=0, jitter_ms=0, failure_rate=0.0, callback_delay=2.0,
+                 success_rate=0.9, callback_drop_rate=0.0, callback_url=None,
+                 pull_page_size=100, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+        self.callback_delay = callback_delay
+        self.success_rate = success_rate
+        self.callback_drop_rate = callback_drop_rate
+        self.callback_url = callback_url
+        self.pull_page_size = pull_page_size
+        self.random = random.Random(seed)
+
+
+class DarajaSimulator:
+    """State shared by the request handler threads."""
+
+    def __init__(self, config=None):
+        self.config = config or SimulatorConfig()
+        self.lock = threading.Lock()
+        self.tokens = set()
+        # CheckoutRequestID -> {'result_code': int | None, 'amount', 'phone', 'reference', ...}
+        self.stk_requests = {}
+        self.transactions = []
+        self.stats = Counter()
+        self.callback_latencies = []
+
+    # -- behaviour helpers ---------------------------------------------------
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def sleep_latency(self):
+        config = self.config
+        if config.latency_ms or config.jitter_ms:
+            delay = config.latency_ms + config.random.uniform(-config.jitter_ms, config.jitter_ms)
+            time.sleep(max(0, delay) / 1000)
+
+    def should_fail(self):
+        return self.config.failure_rate and self.config.random.random() < self.config.failure_rate
+
+    def pick_result_code(self):
+        if self.config.random.random() < self.config.success_rate:
+            return 0
+        return self.config.random.choice([1, 1032, 1037])
+
+    # -- endpoint implementations ---------------------------------------------
+
+    def issue_token(self):
+        token = uuid.uuid4().hex
+        with self.lock:
+            self.tokens.add(token)
+        return {'access_token': token, 'expires_in': '3599'}
+
+    def is_authorized(self, header):
+        token = (header or '').replace('Bearer ', '', 1).strip()
+        with self.lock:
+            return token in self.tokens
+
+    def stk_push(self, payload):
+        missing = [
+            field for field in ('BusinessShortCode', 'Password', 'Timestamp', 'Amount', 'PhoneNumber', 'CallBackURL')
+            if not payload.get(field)
+        ]
+        if missing:
+            return 400, {'errorCode': '400.002.02', 'errorMessage': f"Bad Request - Invalid {missing[0]}"}
+
+        checkout_request_id = f"ws_CO_{datetime.now():%d%m%Y%H%M%S}{uuid.uuid4().hex[:8]}"
+        merchant_request_id = f"{uuid.uuid4().int % 100000}-{uuid.uuid4().int % 10000000}-1"
+        with self.lock:
+            self.stk_requests[checkout_request_id] = {
+                'merchant_request_id': merchant_request_id,
+                'amount': payload['Amount'],
+                'phone': str(payload['PhoneNumber']),
+                'reference': payload.get('AccountReference', ''),
+                'callback_url': self.config.callback_url or payload['CallBackURL'],
+                'result_code': None,
+                'created': time.monotonic(),
+            }
+
+        timer = threading.Timer(self.config.callback_delay, self.complete_stk_push, args=(checkout_request_id,))
+        timer.daemon = True
+        timer.start()
+        return 200, {
+            'MerchantRequestID': merchant_request_id,
+            'CheckoutRequestID': checkout_request_id,
+            'ResponseCode': '0',
+            'ResponseDescription': 'Success. Request accepted for processing',
+            'CustomerMessage': 'Success. Request accepted for processing',
+        }
+
+    def complete_stk_push(self, checkout_request_id):
+        """Decide the outcome of a push (the customer 'acts') and send the callback."""
+        result_code = self.pick_result_code()
+        with self.lock:
+            stk = self.stk_requests[checkout_request_id]
+            stk['result_code'] = result_code
+
+        callback = {
+            'Body': {
+                'stkCallback': {
+                    'MerchantRequestID': stk['merchant_request_id'],
+                    'CheckoutRequestID': checkout_request_id,
+                    'ResultCode': result_code,
+                    'ResultDesc': RESULT_DESCRIPTIONS[result_code],
+                }
+            }
+        }
+        if result_code == 0:
+            receipt = f"SIM{uuid.uuid4().hex[:7].upper()}"
+            now = datetime.now(NAIROBI).replace(tzinfo=None)
+            callback['Body']['stkCallback']['CallbackMetadata'] = {
+                'Item': [
+                    {'Name': 'Amount', 'Value': stk['amount']},
+                    {'Name': 'MpesaReceiptNumber', 'Value': receipt},
+                    {'Name': 'TransactionDate', 'Value': int(now.strftime('%Y%m%d%H%M%S'))},
+                    {'Name': 'PhoneNumber', 'Value': int(stk['phone']) if stk['phone'].isdigit() else stk['phone']},
+                ]
+            }
+            with self.lock:
+                self.transactions.append({
+                    'transactionId': receipt,
+                    'trxDate': now.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'msisdn': stk['phone'],
+                    'sender': 'UNKNOWN',
+                    'transactiontype': 'c2b-pay-bill-debit',
+                    'billreference': stk['reference'],
+                    'amount': str(stk['amount']),
+                    'organizationname': 'Simulator',
+                })
+
+        self.count(f'result_{result_code}')
+        if self.config.callback_drop_rate and self.config.random.random() < self.config.callback_drop_rate:
+            self.count('callbacks_dropped')
+            return
+
+        try:
+            response = requests.post(stk['callback_url'], json=callback, timeout=30)
+            self.count('callbacks_sent' if response.status_code < 400 else 'callbacks_rejected')
+        except requests.exceptions.RequestException as e:
+            logger.warning("Callback for %s to %s failed: %s", checkout_request_id, stk['callback_url'], e)
+            self.count('callbacks_failed')
+        with self.lock:
+            self.callback_latencies.append(time.monotonic() - stk['created'])
+
+    def stk_query(self, payload):
+        with self.lock:
+            stk = self.stk_requests.get(payload.get('CheckoutRequestID'))
+        if stk is None:
+            return 400, {'errorCode': '400.002.02', 'errorMessage': 'Bad Request - Invalid CheckoutRequestID'}
+        if stk['result_code'] is None:
+            return 500, STILL_PROCESSING
+        return 200, {
+            'ResponseCode': '0',
+            'ResponseDescription': 'The service request has been accepted successsfully',
+            'MerchantRequestID': stk['merchant_request_id'],
+            'CheckoutRequestID': payload['CheckoutRequestID'],
+            'ResultCode': str(stk['result_code']),
+            'ResultDesc': RESULT_DESCRIPTIONS[stk['result_code']],
+        }
+
+    def pull_transactions(self, payload):
+        try:
+            start = datetime.strptime(payload['StartDate'], '%Y-%m-%d %H:%M:%S')
+            end = datetime.strptime(payload['EndDate'], '%Y-%m-%d %H:%M:%S')
+            offset = int(payload.get('OffSetValue') or 0)
+        except (KeyError, ValueError):
+            return 400, {'errorCode': '400.002.02', 'errorMessage': 'Bad Request - Invalid date range'}
+
+        with self.lock:
+            in_window = [
+                trx for trx in self.transactions
+                if start <= datetime.strptime(trx['trxDate'], '%Y-%m-%dT%H:%M:%S') <= end
+            ]
+        page = in_window[offset:offset + self.config.pull_page_size]
+        return 200, {
+            'ResponseRefID': uuid.uuid4().hex,
+            'ResponseCode': '1000',
+            'ResponseMessage': 'Success',
+            'Response': [page] if page else [],
+        }
+
+    def summary(self):
+        with self.lock:
+            latencies = sorted(self.callback_latencies)
+            summary = dict(self.stats)
+        if latencies:
+            summary['callback_p50'] = latencies[len(latencies) // 2]
+            summary['callback_p99'] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        return summary
+
+
+class _Handler(BaseHTTPRequestHandler):
+    simulator = None  # set per server class by make_server()
+
+    def log_message(self, format, *args):
+        logger.debug("daraja-sim %s", format % args)
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            return json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return None
+
+    def _prelude(self, endpoint):
+        sim = self.simulator
+        sim.count(endpoint)
+        sim.sleep_latency()
+        if sim.should_fail():
+            sim.count(f'{endpoint}_failed')
+            self._send(503, {'errorCode': '503.001.01', 'errorMessage': 'Service temporarily unavailable'})
+            return False
+        return True
+
+    def do_GET(self):
+        if not self.path.startswith('/oauth/v1/generate'):
+            return self._send(404, {'errorMessage': 'Not found'})
+        if not self._prelude('oauth'):
+            return
+        auth = self.headers.get('Authorization', '')
+        try:
+            key, _, secret = base64.b64decode(auth.replace('Basic ', '', 1)).decode().partition(':')
+        except ValueError:
+            key = secret = ''
+        if not key or not secret:
+            return self._send(400, {'errorCode': '400.008.01', 'errorMessage': 'Invalid Authentication passed'})
+        self._send(200, self.simulator.issue_token())
+
+    def do_POST(self):
+        routes = {
+            '/mpesa/stkpush/v1/processrequest': ('stk_push', self.simulator.stk_push),
+            '/mpesa/stkpushquery/v1/query': ('stk_query', self.simulator.stk_query),
+            '/pulltransactions/v1/query': ('pull', self.simulator.pull_transactions),
+        }
+        route = routes.get(self.path.rstrip('/'))
+        if route is None:
+            return self._send(404, {'errorMessage': 'Not found'})
+        endpoint, handler = route
+        if not self._prelude(endpoint):
+            return
+        if not self.simulator.is_authorized(self.headers.get('Authorization')):
+            return self._send(401, {'errorCode': '404.001.03', 'errorMessage': 'Invalid Access Token'})
+        payload = self._read_json()
+        if payload is None:
+            return self._send(400, {'errorCode': '400.002.02', 'errorMessage': 'Bad Request - Invalid JSON'})
+        status, body = handler(payload)
+        self._send(status, body)
+
+
+def make_server(host='127.0.0.1', port=0, config=None):
+    """Return ``(server, simulator)``; call ``server.serve_forever()`` to run it."""
+    simulator = DarajaSimulator(config)
+    handler = type('DarajaSimulatorHandler', (_Handler,), {'simulator': simulator})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server, simulator
@@ -0,0 +1,207 @@
+"""
+Local BM25 retrieval over the JSON knowledge bases.
+
+``ProductKB`` (product and variation rows) and ``AgentAIKnowledgeBase``
+content is flattened into ``path: value`` lines, grouped into small chunks
+and scored with BM25 held in a NumPy weight matrix. The chat prompt then
+carries only the chunks relevant to the question, within a token budget,
+instead of every knowledge base entry.
+
+One index is kept per scope (a product with its variations, or an agent) in
+the cache. Saves rebuild it through ``core.signals``; a cache miss builds it
+on demand.
+"""
+import logging
+import math
+import re
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"[^\W_]+", re.UNICODE)
+
+STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from has have how i in is it its
+me my of on or please tell that the this to was what when where which who why
+will with you your
+""".split())
+
+
+def tokenize(text, stopwords=STOPWORDS):
+    """Lowercased word tokens without stopwords."""
+    return [t for t in _TOKEN_RE.findall(str(text).casefold()) if t not in stopwords]
+
+
+def estimate_tokens(text):
+    """Rough model token count (about four characters per token)."""
+    return max(1, math.ceil(len(text) / 4))
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def flatten_json(value, path=''):
+    """Yield ``path: value`` lines for every leaf of a JSON document."""
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from flatten_json(item, f"{path} > {key}" if path else str(key))
+    elif isinstance(value, list):
+        if all(not isinstance(item, (dict, list)) for item in value):
+            yield f"{path}: {', '.join(str(item) for item in value)}" if path else ', '.join(map(str, value))
+        else:
+            for item in value:
+                yield from flatten_json(item, path)
+    elif value not in (None, ''):
+        yield f"{path}: {value}" if path else str(value)
+
+
+def chunk_json(content, source, chunk_tokens=None):
+    """Split one knowledge base document into chunks of roughly ``chunk_tokens``."""
+    chunk_tokens = chunk_tokens or _setting('CHAT_KB_CHUNK_TOKENS', 120)
+    chunks, lines, size = [], [], 0
+
+    def flush():
+        nonlocal lines, size
+        if lines:
+            chunks.append({'source': source, 'text': '\n'.join(lines)})
+        lines, size = [], 0
+
+    for line in flatten_json(content):
+        line_tokens = estimate_tokens(line)
+        if line_tokens > chunk_tokens:
+            # A single long value: split it on word boundaries
+            flush()
+            words, piece = line.split(), []
+            for word in words:
+                piece.append(word)
+                if estimate_tokens(' '.join(piece)) >= chunk_tokens:
+                    lines = [' '.join(piece)]
+                    flush()
+                    piece = []
+            if piece:
+                lines, size = [' '.join(piece)], estimate_tokens(' '.join(piece))
+            continue
+        if size + line_tokens > chunk_tokens:
+            flush()
+        lines.append(line)
+        size += line_tokens
+    flush()
+    return chunks
+
+
+class KBIndex:
+    """BM25 index over a list of ``{'source', 'text'}`` chunks."""
+
+    def __init__(self, chunks):
+        self.chunks = [dict(chunk, tokens=estimate_tokens(chunk['text'])) for chunk in chunks]
+        docs = [tokenize(f"{chunk['source']} {chunk['text']}") for chunk in self.chunks]
+
+        self.vocabulary = {}
+        for terms in docs:
+            for term in terms:
+                self.vocabulary.setdefault(term, len(self.vocabulary))
+
+        tf = np.zeros((len(docs), len(self.vocabulary)), dtype=np.float32)
+        for row, terms in enumerate(docs):
+            for term in terms:
+                tf[row, self.vocabulary[term]] += 1
+
+        if len(docs):
+            doc_len = tf.sum(axis=1, keepdims=True)
+            avg_len = max(float(doc_len.mean()), 1.0)
+            df = (tf > 0).sum(axis=0)
+            idf = np.log1p((len(docs) - df + 0.5) / (df + 0.5)).astype(np.float32)
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_len / avg_len)
+            # Precomputed per-term BM25 contributions; a query is a column sum
+            self.weights = idf * tf * (BM25_K1 + 1) / (tf + norm)
+        else:
+            self.weights = tf
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def search(self, query, top_k=None, token_budget=None):
+        """Best-scoring chunks for ``query``, at most ``top_k`` and within ``token_budget``."""
+        top_k = top_k or _setting('CHAT_KB_TOP_K', 5)
+        token_budget = token_budget or _setting('CHAT_KB_TOKEN_BUDGET', 600)
+
+        columns = sorted({self.vocabulary[t] for t in tokenize(query) if t in self.vocabulary})
+        if not columns:
+            return []
+        scores = self.weights[:, columns].sum(axis=1)
+
+        results, used = [], 0
+        for row in np.argsort(-scores, kind='stable'):
+            if scores[row] <= 0 or len(results) >= top_k:
+                break
+            chunk = self.chunks[row]
+            if used + chunk['tokens'] > token_budget:
+                continue
+            used += chunk['tokens']
+            results.append(dict(chunk, score=float(scores[row])))
+        return results
+
+
+def product_kb_chunks(product_id):
+    from django.db.models import Q
+
+    from home.models import ProductKB
+
+    chunks = []
+    rows = (ProductKB.objects.filter(Q(product_id=product_id) | Q(variation__product_id=product_id))
+            .select_related('variation').order_by('pk'))
+    for kb in rows:
+        source = f"Variation '{kb.variation.name}'" if kb.variation_id else 'Product'
+        chunks.extend(chunk_json(kb.content, source))
+    return chunks
+
+
+def agent_kb_chunks(agent_id):
+    from home.models import AgentAIKnowledgeBase
+
+    kb = AgentAIKnowledgeBase.objects.filter(agent_id=agent_id).first()
+    return chunk_json(kb.content, 'Agent') if kb else []
+
+
+_SCOPES = {
+    'product': product_kb_chunks,
+    'agent': agent_kb_chunks,
+}
+
+
+def _index_key(scope, object_id):
+    return f"kb-index:{scope}:{object_id}"
+
+
+def rebuild_index(scope, object_id):
+    """Rebuild and cache the index for one product or agent."""
+    index = KBIndex(_SCOPES[scope](object_id))
+    cache.set(_index_key(scope, object_id), index, _setting('CHAT_CONTEXT_CACHE_TTL', 60 * 60))
+    logger.debug("Rebuilt %s KB index for %s: %d chunks", scope, object_id, len(index))
+    return index
+
+
+def get_index(scope, object_id):
+    index = cache.get(_index_key(scope, object_id))
+    if index is None:
+        index = rebuild_index(scope, object_id)
+    return index
+
+
+def retrieve(scope, object_id, query, top_k=None, token_budget=None):
+    """Top chunks of a product's or agent's knowledge base for ``query``."""
+    if not object_id:
+        return []
+    return get_index(scope, int(object_id)).search(query, top_k=top_k, token_budget=token_budget)
+
+
+def format_excerpts(chunks):
+    """Render retrieved chunks for the system prompt."""
+    return '\n\n'.join(f"[{chunk['source']}]\n{chunk['text']}" for chunk in chunks)
@@ -0,0 +1,214 @@
+"""
+Admission control for outbound LLM calls.
+
+Two layers protect the chat endpoints:
+
+* ``LLMGate`` caps the completions in flight in this process. Callers beyond
+  the cap wait in a bounded queue for up to ``CHAT_LLM_MAX_WAIT`` seconds;
+  when the queue is full, or the wait runs out, the request is rejected at
+  once with a 429 instead of tying up a worker. The limit is per process, so
+  the site-wide ceiling is the limit times the number of workers.
+* ``allow_request`` applies rate limits per client IP and, for signed-in
+  users, per user as well. They are counted in ``CHAT_RATE_LIMIT_CACHE`` (the
+  file-based ``shared`` alias unless set) so every process shares one limit.
+
+Queue depth, wait time, rejections and throttles are recorded through
+``core.metrics``.
+"""
+import asyncio
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics
+
+
+class GateRejected(Exception):
+    """The gate is saturated; ``retry_after`` is a hint in seconds."""
+
+    def __init__(self, reason, retry_after=1):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class LLMGate:
+    """Counting semaphore with a bounded wait queue, usable from threads and coroutines."""
+
+    # Coroutines poll for a free slot instead of blocking the event loop
+    ASYNC_POLL_SECONDS = 0.02
+
+    def __init__(self, max_concurrent, max_queue, max_wait):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self.waiting = 0
+        self._condition = threading.Condition()
+
+    def _try_take(self):
+        # Caller holds the condition's lock
+        if self.in_flight < self.max_concurrent:
+            self.in_flight += 1
+            return True
+        return False
+
+    def _enqueue(self):
+        # Caller holds the condition's lock; returns the new depth, or None when full
+        if self.waiting >= self.max_queue:
+            return None
+        self.waiting += 1
+        return self.waiting
+
+    def _dequeue(self):
+        with self._condition:
+            self.waiting -= 1
+            return self.waiting
+
+    @staticmethod
+    def _record_enqueued(depth):
+        if depth is None:
+            metrics.incr('chat.gate.rejected_queue_full')
+        else:
+            metrics.gauge('chat.gate.queue_depth', depth)
+
+    @staticmethod
+    def _record_dequeued(depth, waited, acquired):
+        metrics.gauge('chat.gate.queue_depth', depth)
+        metrics.observe('chat.gate.wait_seconds', waited)
+        if not acquired:
+            metrics.incr('chat.gate.rejected_timeout')
+
+    # Metrics go to the cache, which may be slow I/O: they are written outside
+    # the lock, and coroutines hand them to the default executor
+
+    def acquire(self):
+        """Take a slot, waiting up to ``max_wait``; raises GateRejected."""
+        with self._condition:
+            if self._try_take():
+                return
+            depth = self._enqueue()
+        self._record_enqueued(depth)
+        if depth is None:
+            raise GateRejected('queue_full')
+        started = time.monotonic()
+        acquired = False
+        try:
+            with self._condition:
+                acquired = self._condition.wait_for(self._try_take, timeout=self.max_wait)
+        finally:
+            self._record_dequeued(self._dequeue(), time.monotonic() - started, acquired)
+        if not acquired:
+            raise GateRejected('timeout')
+
+    async def aacquire(self):
+        """Async counterpart of ``acquire``; a cancelled waiter leaves the queue."""
+        loop = asyncio.get_running_loop()
+        with self._condition:
+            if self._try_take():
+                return
+            depth = self._enqueue()
+        loop.run_in_executor(None, self._record_enqueued, depth)
+        if depth is None:
+            raise GateRejected('queue_full')
+        started = time.monotonic()
+        deadline = started + self.max_wait
+        acquired = False
+        try:
+            while True:
+                with self._condition:
+                    acquired = self._try_take()
+                if acquired or time.monotonic() >= deadline:
+                    break
+                await asyncio.sleep(self.ASYNC_POLL_SECONDS)
+        finally:
+            loop.run_in_executor(None, self._record_dequeued, self._dequeue(), time.monotonic() - started, acquired)
+        if not acquired:
+            raise GateRejected('timeout')
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+
+gate = LLMGate(
+    max_concurrent=getattr(settings, 'CHAT_LLM_MAX_CONCURRENT', 8),
+    max_queue=getattr(settings, 'CHAT_LLM_MAX_QUEUE', 16),
+    max_wait=getattr(settings, 'CHAT_LLM_MAX_WAIT', 5),
+)
+
+
+def client_ip(request):
+    if getattr(settings, 'CHAT_TRUST_X_FORWARDED_FOR', False):
+        forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '')
+        if forwarded:
+            return forwarded.split(',')[0].strip()
+    return request.META.get('REMOTE_ADDR', 'unknown')
+
+
+def _rate_cache():
+    return caches[getattr(settings, 'CHAT_RATE_LIMIT_CACHE', 'default')]
+
+
+def take_token(key, rate_per_minute, burst):
+    """
+    Count one request against ``key`` in the rate-limit cache.
+
+    Requests are counted in fixed windows that admit ``burst`` requests each,
+    sized so the average is ``rate_per_minute``. The count uses ``add`` and
+    ``incr``, which Redis and Memcached apply atomically; the file-based
+    cache does not, so concurrent requests may slightly overshoot there.
+
+    Returns ``(allowed, retry_after_seconds)``.
+    """
+    if not rate_per_minute:
+        return True, 0
+    burst = max(1, burst)
+    window = burst * 60.0 / rate_per_minute
+    now = time.time()
+    slot = int(now // window)
+    cache = _rate_cache()
+    cache_key = f"llm-rate:{key}:{slot}"
+    timeout = int(window) + 60
+    if cache.add(cache_key, 1, timeout):
+        count = 1
+    else:
+        try:
+            count = cache.incr(cache_key)
+        except ValueError:
+            # Expired between add and incr
+            cache.set(cache_key, 1, timeout)
+            count = 1
+    if count > burst:
+        return False, (slot + 1) * window - now
+    return True, 0
+
+
+def allow_request(request):
+    """Per-IP and, when signed in, per-user rate limit; returns ``(allowed, retry_after_seconds)``."""
+    burst = getattr(settings, 'CHAT_RATE_LIMIT_BURST', 5)
+    limits = [(f"ip:{client_ip(request)}", getattr(settings, 'CHAT_IP_RATE_PER_MINUTE', 10))]
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        limits.insert(0, (f"user:{user.pk}", getattr(settings, 'CHAT_USER_RATE_PER_MINUTE', 20)))
+    for key, rate_per_minute in limits:
+        allowed, retry_after = take_token(key, rate_per_minute, burst)
+        if not allowed:
+            metrics.incr('chat.gate.throttled')
+            return False, retry_after
+    return True, 0
+
+
+def stats():
+    """Gate and throttle counters for operators."""
+    return {
+        'queue_depth': metrics.get('chat.gate.queue_depth'),
+        'queue_depth_max': metrics.get('chat.gate.queue_depth.max'),
+        'wait_seconds': metrics.summary('chat.gate.wait_seconds'),
+        'rejected_queue_full': metrics.get('chat.gate.rejected_queue_full'),
+        'rejected_timeout': metrics.get('chat.gate.rejected_timeout'),
+        'throttled': metrics.get('chat.gate.throttled'),
+    }
@@ -0,0 +1,94 @@
+"""
+Logging helpers for hot paths.
+
+* ``lazy(func)`` defers an expensive log argument (a query, a large repr)
+  until a handler actually formats the record, so it costs nothing when the
+  level is disabled: ``logger.debug("images: %s", lazy(product.images.exists))``.
+  Wrap whole debug blocks in ``if logger.isEnabledFor(logging.DEBUG):``.
+* ``SamplingFilter`` lets through only every Nth DEBUG record per call site,
+  for events that fire on every request.
+* ``install_queue_handler`` moves the root logger's handlers behind a
+  ``QueueHandler``/``QueueListener`` pair, so console and file I/O happen on
+  a background thread instead of the request thread. ``CoreConfig.ready``
+  calls it when ``LOG_QUEUE`` is on.
+"""
+import atexit
+import logging
+import queue
+import threading
+from collections import Counter
+from logging.handlers import QueueHandler, QueueListener
+
+
+class lazy:
+    """Log argument evaluated only when the message is formatted."""
+
+    __slots__ = ('func',)
+
+    def __init__(self, func):
+        self.func = func
+
+    def __str__(self):
+        return str(self.func())
+
+    def __repr__(self):
+        return repr(self.func())
+
+
+class SamplingFilter(logging.Filter):
+    """Pass one in ``every`` DEBUG records per (logger, message template).
+
+    Records above DEBUG always pass.
+    """
+
+    def __init__(self, every=10, name=''):
+        super().__init__(name)
+        self.every = max(1, int(every))
+        self._seen = Counter()
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.every == 1:
+            return True
+        key = (record.name, record.msg if isinstance(record.msg, str) else id(record.msg))
+        with self._lock:
+            count = self._seen[key]
+            self._seen[key] = count + 1
+        return count % self.every == 0
+
+
+_listener = None
+
+
+def install_queue_handler(logger=None):
+    """Serve ``logger``'s (default: root) handlers from a background thread.
+
+    Idempotent. ``SamplingFilter``s on the handlers move to the queue handler
+    so dropped records are never formatted; other filters stay where they are.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    logger = logger or logging.getLogger()
+    handlers = [h for h in logger.handlers if not isinstance(h, QueueHandler)]
+    if not handlers:
+        return None
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    # Records no handler wants are dropped before they are formatted
+    queue_handler.setLevel(min(h.level for h in handlers))
+    for handler in handlers:
+        for log_filter in list(handler.filters):
+            if isinstance(log_filter, SamplingFilter):
+                handler.removeFilter(log_filter)
+                if log_filter not in queue_handler.filters:
+                    queue_handler.addFilter(log_filter)
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    for handler in handlers:
+        logger.removeHandler(handler)
+    logger.addHandler(queue_handler)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return _listener
@@ -0,0 +1,126 @@
+"""
+Inverted-index search over buyer-seller chat messages.
+
+Each message is split into terms (``kb_index.tokenize``) and stored as one
+``MessageSearchPosting`` row per distinct term. Postings are written when a
+message is created (``core.signals``) and can be rebuilt in bulk with the
+rebuild_message_search command. A search looks the query terms up among the
+postings of the requesting user's own chats, ranks messages in SQL by how
+many query terms they contain and then by summed tf-idf, and returns a
+highlighted snippet around the first hit.
+
+Plain tables and indexes, so it works the same on SQLite and MySQL.
+"""
+import math
+import re
+from collections import Counter
+
+from django.db.models import Case, Count, F, FloatField, Q, Sum, Value, When
+from django.utils.html import escape
+
+from home.models import BuyerSellerChat, BuyerSellerMessage, MessageSearchPosting
+
+from .kb_index import tokenize
+
+MAX_TERM_LENGTH = 64
+SNIPPET_CHARS = 160
+
+_WORD_RE = re.compile(r"[^\W_]+", re.UNICODE)
+
+
+def message_terms(text):
+    """Term frequencies of ``text`` as stored in the index."""
+    return Counter(token[:MAX_TERM_LENGTH] for token in tokenize(text))
+
+
+def _postings(message):
+    return [
+        MessageSearchPosting(term=term, message_id=message.pk, chat_id=message.chat_id, count=min(count, 32767))
+        for term, count in message_terms(message.message).items()
+    ]
+
+
+def index_message(message, replace=False):
+    """Write postings for ``message``; ``replace`` drops its old ones first."""
+    if replace:
+        MessageSearchPosting.objects.filter(message_id=message.pk).delete()
+    MessageSearchPosting.objects.bulk_create(_postings(message))
+
+
+def rebuild(batch_size=1000):
+    """Re-index every message from scratch; returns (messages, postings)."""
+    MessageSearchPosting.objects.all().delete()
+    messages = postings = 0
+    pending = []
+    for message in BuyerSellerMessage.objects.only('id', 'chat_id', 'message').order_by('id').iterator(chunk_size=batch_size):
+        messages += 1
+        pending.extend(_postings(message))
+        if len(pending) >= batch_size:
+            MessageSearchPosting.objects.bulk_create(pending, batch_size=batch_size)
+            postings += len(pending)
+            pending = []
+    MessageSearchPosting.objects.bulk_create(pending, batch_size=batch_size)
+    return messages, postings + len(pending)
+
+
+def snippet(text, terms, width=SNIPPET_CHARS):
+    """HTML-escaped excerpt of ``text`` around the first query term, hits in <mark>."""
+    matches = [m for m in _WORD_RE.finditer(text) if m.group().casefold()[:MAX_TERM_LENGTH] in terms]
+    start = max(0, matches[0].start() - width // 3) if matches else 0
+    end = min(len(text), start + width)
+    parts = []
+    position = start
+    for match in matches:
+        if match.start() < start or match.end() > end:
+            continue
+        parts.append(escape(text[position:match.start()]))
+        parts.append(f"<mark>{escape(match.group())}</mark>")
+        position = match.end()
+    parts.append(escape(text[position:end]))
+    return ('…' if start else '') + ''.join(parts) + ('…' if end < len(text) else '')
+
+
+def search(user, query, limit=20):
+    """
+    Ranked hits for ``query`` in ``user``'s chats, best first.
+
+    Each hit carries the chat and message ids, sender, timestamp, the number
+    of query terms matched, a tf-idf score and an HTML snippet.
+    """
+    terms = set(message_terms(query))
+    if not terms:
+        return []
+    chats = BuyerSellerChat.objects.filter(Q(buyer=user) | Q(seller=user)).values('id')
+    postings = MessageSearchPosting.objects.filter(term__in=terms, chat__in=chats)
+
+    # idf over the user's own messages; terms absent from them cannot match
+    document_frequency = dict(postings.order_by().values_list('term').annotate(df=Count('id')))
+    if not document_frequency:
+        return []
+    total = BuyerSellerMessage.objects.filter(chat__in=chats).count()
+    weights = [When(term=term, then=Value(math.log(1 + total / df))) for term, df in document_frequency.items()]
+    ranked = list(
+        postings.order_by().values('message').annotate(
+            matched=Count('id'),
+            score=Sum(F('count') * Case(*weights, output_field=FloatField()), output_field=FloatField()),
+        ).order_by('-matched', '-score', '-message')[:limit]
+    )
+
+    messages = BuyerSellerMessage.objects.select_related('sender').in_bulk([row['message'] for row in ranked])
+    hits = []
+    for row in ranked:
+        message = messages.get(row['message'])
+        if message is None:
+            continue
+        sender = message.sender
+        hits.append({
+            'chat_id': message.chat_id,
+            'message_id': message.id,
+            'sender': (sender.get_full_name() or sender.email) if sender else 'Unknown User',
+            'is_own': message.sender_id == user.pk,
+            'created_at': message.created_at.strftime('%b %d, %Y %I:%M %p'),
+            'matched_terms': row['matched'],
+            'score': round(row['score'], 4),
+            'snippet': snippet(message.message, terms),
+        })
+    return hits
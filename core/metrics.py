@@ -0,0 +1,94 @@
+"""
+Minimal cache-backed counters and timing summaries.
+
+Values live in the ``METRICS_CACHE`` cache (the file-based ``shared`` alias
+unless set), so web workers, background workers and management commands all
+see the same numbers. They are approximate operational numbers for admin
+pages and management commands rather than a monitoring system: the file cache
+does not make ``incr`` atomic, Redis and Memcached do.
+"""
+from django.conf import settings
+from django.core.cache import caches
+
+from .checks import PROCESS_LOCAL_BACKENDS
+
+METRIC_TIMEOUT = 60 * 60 * 24 * 7
+
+
+def cache_alias():
+    return getattr(settings, 'METRICS_CACHE', 'default')
+
+
+def source_warning():
+    """
+    A warning for stats commands when the counters live in a process-local
+    cache (they would only see their own process), else None.
+    """
+    if settings.CACHES.get(cache_alias(), {}).get('BACKEND') not in PROCESS_LOCAL_BACKENDS:
+        return None
+    return (f"METRICS_CACHE '{cache_alias()}' is process-local, so these counts cover only this "
+            f"command, not the web or worker processes. Point it at a shared cache.")
+
+
+def _cache():
+    return caches[cache_alias()]
+
+
+def _key(name):
+    return f"metrics:{name}"
+
+
+def incr(name, amount=1):
+    """Add ``amount`` to the counter ``name``."""
+    cache = _cache()
+    key = _key(name)
+    if cache.add(key, amount, METRIC_TIMEOUT):
+        return amount
+    try:
+        return cache.incr(key, amount)
+    except ValueError:
+        cache.set(key, amount, METRIC_TIMEOUT)
+        return amount
+
+
+def get(name, default=0):
+    return _cache().get(_key(name), default)
+
+
+def observe(name, value):
+    """Record one observation (e.g. a lag in seconds): count, total and max."""
+    incr(f"{name}.count")
+    # Totals are kept in milliseconds so the cache only ever stores integers
+    incr(f"{name}.total_ms", int(value * 1000))
+    cache = _cache()
+    max_key = _key(f"{name}.max_ms")
+    if int(value * 1000) > cache.get(max_key, 0):
+        cache.set(max_key, int(value * 1000), METRIC_TIMEOUT)
+
+
+def gauge(name, value):
+    """Set the current value of ``name`` and keep its high-water mark in ``name.max``."""
+    cache = _cache()
+    cache.set(_key(name), value, METRIC_TIMEOUT)
+    max_key = _key(f"{name}.max")
+    if value > cache.get(max_key, 0):
+        cache.set(max_key, value, METRIC_TIMEOUT)
+
+
+def summary(name):
+    """Return ``{'count', 'mean', 'max'}`` (seconds) for an observed metric."""
+    count = get(f"{name}.count")
+    total_ms = get(f"{name}.total_ms")
+    return {
+        'count': count,
+        'mean': (total_ms / count / 1000) if count else 0.0,
+        'max': get(f"{name}.max_ms") / 1000,
+    }
+
+
+def reset(*names):
+    _cache().delete_many([
+        _key(f"{name}{suffix}")
+        for name in names
+        for suffix in ('', '.max', '.count', '.total_ms', '.max_ms')
+    ])
@@ -0,0 +1,23 @@
+from asgiref.sync import iscoroutinefunction
+from django.utils.decorators import sync_and_async_middleware
+
+from . import sales_rollup
+
+
+@sync_and_async_middleware
+def sales_rollup_middleware(get_response):
+    """Refresh the daily sales rollups touched by a request once, after the view.
+
+    Views save orders and their items in autocommit, so without this every
+    save would recompute the affected days on its own. Async-capable so
+    async views and streams are not pushed through a thread under ASGI.
+    """
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            async with sales_rollup.adeferred():
+                return await get_response(request)
+    else:
+        def middleware(request):
+            with sales_rollup.deferred():
+                return get_response(request)
+    return middleware
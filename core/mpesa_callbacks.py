@@ -0,0 +1,241 @@
+"""
+Fast-ack ingestion and background processing of M-Pesa STK callbacks.
+
+The callback endpoints only parse enough of the payload to find the
+CheckoutRequestID and insert it into the ``MpesaCallback`` inbox; repeated
+deliveries hit the unique key and are dropped. ``process_callbacks`` then
+applies the payment/order transitions exactly once per CheckoutRequestID.
+"""
+import json
+import logging
+import time
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from home.models import MpesaCallback, PaymentRequest, RawPayment
+
+from .notifications import payment_request_channel, publish_on_commit
+
+logger = logging.getLogger(__name__)
+
+# PaymentRequest states a callback may still move out of
+OPEN_PAYMENT_STATUSES = ('queued', 'pending')
+
+# An orphan (callback seen before its PaymentRequest has the CheckoutRequestID)
+# is retried on later passes until this many attempts have been made.
+MAX_ORPHAN_ATTEMPTS = 10
+ORPHAN_RETRY_SECONDS = 10
+
+# last_error of an inbox row no PaymentRequest has claimed
+NO_PAYMENT_REQUEST = 'No PaymentRequest with this CheckoutRequestID'
+
+# Rows left in 'processing' this long belong to a crashed processor
+STALE_PROCESSING_SECONDS = 300
+
+
+class InvalidCallback(ValueError):
+    pass
+
+
+def parse_callback(raw_body):
+    """
+    Decode a raw callback body without storing it.
+
+    Returns ``(payload, stk_callback)``. Raises ``InvalidCallback`` when the
+    body is not a parseable STK callback.
+    """
+    try:
+        data = json.loads(raw_body)
+    except (TypeError, ValueError) as e:
+        raise InvalidCallback(f"Invalid JSON data: {e}")
+
+    if not isinstance(data, dict):
+        raise InvalidCallback("Callback body must be a JSON object")
+    stk_callback = (data.get('Body') or {}).get('stkCallback') or {}
+    if not stk_callback.get('CheckoutRequestID'):
+        raise InvalidCallback("Missing CheckoutRequestID")
+    return data, stk_callback
+
+
+def ingest_callback(raw_body):
+    """
+    Store a raw callback body in the inbox.
+
+    Returns ``(inbox_row, created)``; ``created`` is False for a duplicate
+    delivery, in which case ``inbox_row`` is None. Raises ``InvalidCallback``
+    when the body is not a parseable STK callback.
+    """
+    data, stk_callback = parse_callback(raw_body)
+    checkout_request_id = stk_callback['CheckoutRequestID']
+
+    result_code = stk_callback.get('ResultCode')
+    try:
+        result_code = int(result_code) if result_code is not None else None
+    except (TypeError, ValueError):
+        result_code = None
+
+    try:
+        with transaction.atomic():
+            inbox = MpesaCallback.objects.create(
+                checkout_request_id=checkout_request_id,
+                merchant_request_id=stk_callback.get('MerchantRequestID'),
+                result_code=result_code,
+                payload=data,
+            )
+        return inbox, True
+    except IntegrityError:
+        MpesaCallback.objects.filter(checkout_request_id=checkout_request_id).update(
+            duplicate_count=F('duplicate_count') + 1
+        )
+        return None, False
+
+
+def apply_payment_callback(payment_request, callback_data):
+    """Apply an STK callback to a PaymentRequest and its order."""
+    payment_request.update_from_callback(callback_data)
+
+    order = payment_request.order if payment_request.order_id else None
+    if order is None:
+        return payment_request
+
+    if payment_request.status == 'completed':
+        order.status = 'paid'
+        order.payment_method = 'M-Pesa'
+        order.transaction_id = payment_request.mpesa_receipt_number
+        order.save()
+        logger.info("Order %s marked as paid with M-Pesa receipt %s", order.id, payment_request.mpesa_receipt_number)
+
+        if payment_request.mpesa_receipt_number:
+            RawPayment.objects.update_or_create(
+                transaction_id=payment_request.mpesa_receipt_number,
+                defaults={
+                    'product_id': str(order.id),
+                    'payment_method': 'mpesa',
+                    'amount': payment_request.amount,
+                    'currency': 'KES',
+                    'status': 'completed',
+                    'mpesa_receipt': payment_request.mpesa_receipt_number,
+                    'phone_number': payment_request.phone_number,
+                },
+            )
+    elif payment_request.status == 'cancelled':
+        order.status = 'cancelled'
+        order.save()
+        logger.info("Order %s marked as cancelled", order.id)
+    elif payment_request.status == 'failed':
+        order.status = 'payment_failed'
+        order.save()
+        logger.info("Order %s marked as payment failed", order.id)
+
+    return payment_request
+
+
+def process_callback(inbox_id, force=False):
+    """
+    Apply one claimed inbox row. The payment transition and the inbox's
+    ``processed`` mark commit together, so a callback is applied at most once
+    even if the processor crashes or the row is replayed. ``force`` re-applies
+    the callback to a PaymentRequest that has already left the pending state.
+    """
+    with transaction.atomic():
+        inbox = MpesaCallback.objects.select_for_update().get(pk=inbox_id)
+        if inbox.status == 'processed' and not force:
+            return inbox
+
+        payment_request = (
+            PaymentRequest.objects.select_for_update()
+            .filter(checkout_request_id=inbox.checkout_request_id)
+            .first()
+        )
+        if payment_request is None:
+            inbox.status = 'orphaned' if inbox.attempts < MAX_ORPHAN_ATTEMPTS else 'failed'
+            inbox.last_error = NO_PAYMENT_REQUEST
+            inbox.save(update_fields=['status', 'last_error', 'updated_at'])
+            return inbox
+
+        # The reconciler can complete a payment from an STK query, which carries
+        # no receipt; a late real callback still fills the receipt in
+        missing_receipt = (
+            payment_request.status == 'completed'
+            and not payment_request.mpesa_receipt_number
+            and inbox.result_code == 0
+        )
+        if force or missing_receipt or payment_request.status in OPEN_PAYMENT_STATUSES:
+            apply_payment_callback(payment_request, inbox.payload)
+            publish_on_commit(payment_request_channel(payment_request.id))
+        else:
+            logger.info("PaymentRequest %s already %s; callback %s not re-applied",
+                        payment_request.id, payment_request.status, inbox.checkout_request_id)
+
+        inbox.status = 'processed'
+        inbox.last_error = None
+        inbox.processed_at = timezone.now()
+        inbox.save(update_fields=['status', 'last_error', 'processed_at', 'updated_at'])
+        return inbox
+
+
+def _due():
+    """Rows ready for processing: new callbacks plus orphans due for a retry."""
+    retry_cutoff = timezone.now() - timedelta(seconds=ORPHAN_RETRY_SECONDS)
+    return Q(status='received') | Q(
+        status='orphaned', attempts__lt=MAX_ORPHAN_ATTEMPTS, updated_at__lt=retry_cutoff
+    )
+
+
+def _claim(inbox_id):
+    return MpesaCallback.objects.filter(_due(), pk=inbox_id).update(
+        status='processing', attempts=F('attempts') + 1, updated_at=timezone.now()
+    )
+
+
+def process_callbacks(batch_size=100):
+    """Process one batch of pending inbox rows; returns the number handled."""
+    stale_cutoff = timezone.now() - timedelta(seconds=STALE_PROCESSING_SECONDS)
+    MpesaCallback.objects.filter(status='processing', updated_at__lt=stale_cutoff).update(status='received')
+
+    candidate_ids = list(
+        MpesaCallback.objects.filter(_due()).order_by('received_at').values_list('id', flat=True)[:batch_size]
+    )
+
+    handled = 0
+    for inbox_id in candidate_ids:
+        if not _claim(inbox_id):
+            continue  # picked up by another processor
+        try:
+            process_callback(inbox_id)
+        except Exception as e:
+            logger.exception("Failed to process M-Pesa callback %s", inbox_id)
+            MpesaCallback.objects.filter(pk=inbox_id).update(status='failed', last_error=str(e))
+        handled += 1
+    return handled
+
+
+def run_processor(batch_size=100, poll_interval=1.0, once=False):
+    """Process inbox rows until stopped (or until drained when ``once``)."""
+    total = 0
+    while True:
+        handled = process_callbacks(batch_size=batch_size)
+        total += handled
+        if not handled:
+            if once:
+                break
+            time.sleep(poll_interval)
+    return total
+
+
+def replay_callbacks(queryset, force=False):
+    """Re-run processing for the given inbox rows; returns the rows replayed."""
+    replayed = []
+    for inbox in queryset.order_by('received_at'):
+        MpesaCallback.objects.filter(pk=inbox.pk).update(
+            status='processing', attempts=F('attempts') + 1, updated_at=timezone.now()
+        )
+        try:
+            replayed.append(process_callback(inbox.pk, force=force))
+        except Exception as e:
+            logger.exception("Replay of M-Pesa callback %s failed", inbox.checkout_request_id)
+            MpesaCallback.objects.filter(pk=inbox.pk).update(status='failed', last_error=str(e))
+    return replayed
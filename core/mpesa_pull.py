@@ -0,0 +1,154 @@
+"""
+Ingestion of the M-Pesa Pull Transactions API into ``RawPayment``.
+
+``pull_and_ingest`` pages through a window of transactions, bulk-upserts each
+page by ``transaction_id`` and links receipts to the orders of the
+``PaymentRequest`` that produced them. The newest transaction date seen is kept
+in ``MpesaPullCursor`` so the next run only re-reads a short overlap.
+"""
+import logging
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
+import pytz
+from django.db import connection, transaction
+from django.db.models import CharField, Exists, OuterRef, Subquery
+from django.db.models.functions import Cast
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from home.models import MpesaPullCursor, PaymentRequest, RawPayment
+
+logger = logging.getLogger(__name__)
+
+NAIROBI = pytz.timezone("Africa/Nairobi")
+
+# Re-read this much before the high-water mark to pick up late postings;
+# the upsert makes the overlap harmless
+DEFAULT_OVERLAP_MINUTES = 10
+
+UPSERT_FIELDS = ['amount', 'status', 'mpesa_receipt', 'phone_number', 'bill_reference', 'transaction_date']
+
+
+def format_pull_date(value):
+    """Format an aware datetime the way the Pull API expects (Nairobi time)."""
+    return value.astimezone(NAIROBI).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _parse_trx_date(value):
+    parsed = parse_datetime(str(value)) if value else None
+    if parsed is None:
+        return None
+    if timezone.is_naive(parsed):
+        parsed = NAIROBI.localize(parsed)
+    return parsed
+
+
+def _to_raw_payment(trx):
+    transaction_id = trx.get('transactionId') or trx.get('TransactionID')
+    if not transaction_id:
+        return None
+    try:
+        amount = Decimal(str(trx.get('amount', 0)))
+    except (InvalidOperation, ValueError):
+        amount = Decimal('0')
+    return RawPayment(
+        payment_method='mpesa',
+        amount=amount,
+        currency='KES',
+        status='completed',
+        transaction_id=transaction_id,
+        mpesa_receipt=transaction_id,
+        phone_number=str(trx.get('msisdn') or '') or None,
+        bill_reference=trx.get('billreference') or None,
+        transaction_date=_parse_trx_date(trx.get('trxDate')),
+    )
+
+
+def upsert_transactions(transactions):
+    """
+    Insert or update one page of Pull API transactions in a single statement.
+    Returns ``(transaction_ids, newest_transaction_date)``.
+    """
+    rows = {}
+    for trx in transactions:
+        raw_payment = _to_raw_payment(trx)
+        if raw_payment is not None:
+            # A repeated id inside one statement would make the upsert fail
+            rows[raw_payment.transaction_id] = raw_payment
+    if not rows:
+        return [], None
+
+    upsert = {'update_conflicts': True, 'update_fields': UPSERT_FIELDS}
+    if connection.features.supports_update_conflicts_with_target:
+        upsert['unique_fields'] = ['transaction_id']
+    # else MySQL: ON DUPLICATE KEY UPDATE hits transaction_id, the only unique key
+    RawPayment.objects.bulk_create(rows.values(), **upsert)
+    dates = [row.transaction_date for row in rows.values() if row.transaction_date]
+    return list(rows), max(dates) if dates else None
+
+
+def match_receipts(transaction_ids):
+    """
+    Link unlinked RawPayments to the order of the PaymentRequest carrying the
+    same receipt number. Runs as one UPDATE with a correlated subquery on the
+    indexed ``PaymentRequest.mpesa_receipt_number``. Returns rows linked.
+    """
+    requests_for_receipt = PaymentRequest.objects.filter(
+        mpesa_receipt_number=OuterRef('transaction_id'),
+        order__isnull=False,
+    )
+    return RawPayment.objects.filter(
+        transaction_id__in=transaction_ids,
+        product_id__isnull=True,
+    ).filter(Exists(requests_for_receipt)).update(
+        product_id=Cast(Subquery(requests_for_receipt.values('order_id')[:1]), CharField())
+    )
+
+
+def unmatched_transactions(transaction_ids):
+    """RawPayments from the pull that no PaymentRequest accounts for."""
+    return RawPayment.objects.filter(transaction_id__in=transaction_ids).exclude(
+        Exists(PaymentRequest.objects.filter(mpesa_receipt_number=OuterRef('transaction_id')))
+    )
+
+
+def pull_and_ingest(mpesa, since=None, until=None, full=False, overlap_minutes=DEFAULT_OVERLAP_MINUTES):
+    """
+    Page through the window and ingest it.
+
+    ``since``/``until`` are aware datetimes. Without ``since`` the window
+    starts ``overlap_minutes`` before the stored high-water mark (or the
+    Pull API default window on the first run, or when ``full``). The
+    high-water mark only advances after the whole window was read.
+    """
+    cursor, _ = MpesaPullCursor.objects.get_or_create(shortcode=mpesa.business_shortcode or '')
+    if since is None and not full and cursor.high_water_mark:
+        since = cursor.high_water_mark - timedelta(minutes=overlap_minutes)
+    until = until or timezone.now()
+
+    stats = {'pages': 0, 'ingested': 0, 'matched': 0, 'unmatched_ids': []}
+    newest = cursor.high_water_mark
+    pages = mpesa.iter_transaction_pages(
+        start_date=format_pull_date(since) if since else None,
+        end_date=format_pull_date(until),
+    )
+    for page in pages:
+        with transaction.atomic():
+            transaction_ids, page_newest = upsert_transactions(page)
+            matched = match_receipts(transaction_ids)
+        stats['pages'] += 1
+        stats['ingested'] += len(transaction_ids)
+        stats['matched'] += matched
+        stats['unmatched_ids'].extend(
+            unmatched_transactions(transaction_ids).values_list('transaction_id', flat=True)
+        )
+        if page_newest and (newest is None or page_newest > newest):
+            newest = page_newest
+        logger.info("Ingested page %s: %s transactions, %s matched", stats['pages'], len(transaction_ids), matched)
+
+    cursor.high_water_mark = newest
+    cursor.last_run_at = timezone.now()
+    cursor.last_ingested = stats['ingested']
+    cursor.save(update_fields=['high_water_mark', 'last_run_at', 'last_ingested'])
+    return stats
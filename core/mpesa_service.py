@@ -9,45 +9,108 @@ from django.conf import settings
 from django.http import HttpRequest
 import requests
 import pytz
+from urllib3.exceptions import NewConnectionError
 
 logger = logging.getLogger(__name__)
 
+
+class PullTransactionsError(Exception):
+    """A page of the Pull Transactions API could not be fetched."""
+
+    def __init__(self, message, offset=0):
+        super().__init__(message)
+        self.offset = offset
+
+
+def _request_not_sent(exc):
+    """True when ``exc`` was raised before the request left this host."""
+    if isinstance(exc, (requests.exceptions.ConnectTimeout, requests.exceptions.SSLError)):
+        return True
+    if isinstance(exc, requests.exceptions.ConnectionError) and exc.args:
+        # Refused connections and failed DNS lookups surface as a MaxRetryError
+        # whose reason is a NewConnectionError
+        return isinstance(getattr(exc.args[0], 'reason', exc.args[0]), NewConnectionError)
+    return False
+
+
+PLACEHOLDER_CALLBACK_URL = 'https://yourdomain.com/api/mpesa-callback/'
+
+
+def resolve_callback_url(request=None):
+    """
+    The STK callback URL: https://{NGROK_HOSTNAME}/api/mpesa-callback/ when
+    NGROK_HOSTNAME is set, else MPESA_CALLBACK_URL, else one built from the
+    host of ``request``.
+
+    Reads only the environment and settings, so views can resolve it per
+    request without constructing (and logging) an MPesaService.
+    """
+    ngrok_hostname = os.getenv('NGROK_HOSTNAME', '').strip()
+    if ngrok_hostname:
+        ngrok_hostname = ngrok_hostname.replace('http://', '').replace('https://', '').rstrip('/')
+        callback_url = f"https://{ngrok_hostname}/api/mpesa-callback/"
+        logger.debug("Using ngrok M-Pesa callback URL: %s", callback_url)
+        return callback_url
+
+    configured = (getattr(settings, 'MPESA_CALLBACK_URL', '') or '').strip()
+    if configured and configured != PLACEHOLDER_CALLBACK_URL:
+        callback_url = configured if configured.endswith('/') else configured + '/'
+        logger.debug("Using M-Pesa callback URL from settings: %s", callback_url)
+        return callback_url
+
+    if request is not None:
+        scheme = 'https' if request.is_secure() else 'http'
+        callback_url = f"{scheme}://{request.get_host()}/api/mpesa-callback/"
+        logger.warning("Using request-based fallback M-Pesa callback URL: %s", callback_url)
+        return callback_url
+
+    logger.error("No valid callback URL found! Using fallback: %s", PLACEHOLDER_CALLBACK_URL)
+    return PLACEHOLDER_CALLBACK_URL
+
+
 class MPesaService:
     """
     M-Pesa service with core functionality for STK push payments.
     Uses environment variables for configuration.
     """
     
-    def __init__(self):
-        """Initialize M-Pesa service with credentials from Django settings."""
+    def __init__(self, base_url=None):
+        """Initialize M-Pesa service with credentials from Django settings.
+
+        ``base_url`` overrides ``settings.MPESA_BASE_URL``, e.g. to point the
+        service at a local stand-in Daraja server.
+        """
         self.consumer_key = getattr(settings, 'MPESA_CONSUMER_KEY', '')
         self.consumer_secret = getattr(settings, 'MPESA_CONSUMER_SECRET', '')
         self.business_shortcode = getattr(settings, 'MPESA_BUSINESS_SHORTCODE', '')
         self.passkey = getattr(settings, 'MPESA_PASSKEY', '')
         self.callback_url = getattr(settings, 'MPESA_CALLBACK_URL', '')
-        # Use production URL for live M-Pesa API
-        self.base_url = "https://api.safaricom.co.ke"
+        # Production Daraja by default; override via MPESA_BASE_URL for local testing
+        self.base_url = (base_url or getattr(settings, 'MPESA_BASE_URL', '') or "https://api.safaricom.co.ke").rstrip('/')
+        # Access tokens are valid for an hour; reuse them across requests
+        self._access_token = None
+        self._access_token_expires_at = None
         
         # Log the initialization (without exposing sensitive data)
         logger.info("Initializing M-Pesa service with the following configuration:")
-        logger.info(f"Base URL: {self.base_url}")
-        logger.info(f"Business Shortcode: {self.business_shortcode}")
-        logger.info(f"Callback URL: {self.callback_url}")
-        logger.info(f"Consumer Key: {'*' * 8 + self.consumer_key[-4:] if self.consumer_key else 'Not set'}")
-        logger.info(f"Passkey: {'*' * 8 + self.passkey[-4:] if self.passkey else 'Not set'}")
+        logger.info("Base URL: %s", self.base_url)
+        logger.info("Business Shortcode: %s", self.business_shortcode)
+        logger.info("Callback URL: %s", self.callback_url)
+        logger.info("Consumer Key: %s", '*' * 8 + self.consumer_key[-4:] if self.consumer_key else 'Not set')
+        logger.info("Passkey: %s", '*' * 8 + self.passkey[-4:] if self.passkey else 'Not set')
         
         # Debug ngrok settings
         use_ngrok = getattr(settings, 'USE_NGROK', False)
         ngrok_hostname = getattr(settings, 'NGROK_HOSTNAME', 'localhost:8000')
-        logger.info(f"USE_NGROK: {use_ngrok}")
-        logger.info(f"NGROK_HOSTNAME: {ngrok_hostname}")
-        print(f"DEBUG: USE_NGROK={use_ngrok}, NGROK_HOSTNAME={ngrok_hostname}")
+        logger.info("USE_NGROK: %s", use_ngrok)
+        logger.info("NGROK_HOSTNAME: %s", ngrok_hostname)
         
         # Debug: Check if credentials are being read correctly
-        logger.info(f"Debug - Consumer Key length: {len(self.consumer_key) if self.consumer_key else 0}")
-        logger.info(f"Debug - Consumer Secret length: {len(self.consumer_secret) if self.consumer_secret else 0}")
-        logger.info(f"Debug - Business Shortcode: {repr(self.business_shortcode)}")
-        logger.info(f"Debug - Passkey length: {len(self.passkey) if self.passkey else 0}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Consumer Key length: %d", len(self.consumer_key) if self.consumer_key else 0)
+            logger.debug("Consumer Secret length: %d", len(self.consumer_secret) if self.consumer_secret else 0)
+            logger.debug("Business Shortcode: %r", self.business_shortcode)
+            logger.debug("Passkey length: %d", len(self.passkey) if self.passkey else 0)
         
         # Validate required credentials
         missing = []
@@ -67,46 +130,14 @@ class MPesaService:
             logger.error(error_msg)
             logger.error("Please set the following environment variables:")
             for cred in missing:
-                logger.error(f"  - {cred}")
+                logger.error("  - %s", cred)
             logger.error("Or add them to your .env file. See .env.example for reference.")
             # Don't raise an exception, just log the error and continue
             # This allows the app to start but M-Pesa payments will fail gracefully
     
     def get_callback_url(self, request=None, order_id=None):
-        """
-        Get the M-Pesa callback URL using ngrok URL from environment variables.
-        Format: https://{NGROK_HOSTNAME}/api/mpesa-callback/
-        """
-        # Get ngrok hostname from environment
-        ngrok_hostname = os.getenv('NGROK_HOSTNAME', '').strip()
-        
-        if ngrok_hostname:
-            # Ensure ngrok URL is properly formatted
-            ngrok_hostname = ngrok_hostname.replace('http://', '').replace('https://', '').rstrip('/')
-            callback_url = f"https://{ngrok_hostname}/api/mpesa-callback/"
-            logger.info(f"Using ngrok M-Pesa callback URL: {callback_url}")
-            return callback_url
-            
-        # Fallback to the callback URL from settings if ngrok is not configured
-        if self.callback_url and self.callback_url.strip() and self.callback_url != 'https://yourdomain.com/api/mpesa-callback/':
-            callback_url = self.callback_url.strip()
-            if not callback_url.endswith('/'):
-                callback_url += '/'
-            logger.info(f"Using M-Pesa callback URL from settings: {callback_url}")
-            return callback_url
-            
-        # Last resort: use request host if available
-        if request is not None:
-            scheme = 'https' if request.is_secure() else 'http'
-            host = request.get_host()
-            callback_url = f"{scheme}://{host}/api/mpesa-callback/"
-            logger.warning(f"Using request-based fallback M-Pesa callback URL: {callback_url}")
-            return callback_url
-            
-        # Final fallback (shouldn't happen in normal operation)
-        fallback = 'https://yourdomain.com/api/mpesa-callback/'
-        logger.error(f"No valid callback URL found! Using fallback: {fallback}")
-        return fallback
+        """Get the M-Pesa callback URL; see ``resolve_callback_url``."""
+        return resolve_callback_url(request=request)
     
     def _is_html_response(self, response_text):
         """Check if the response is HTML instead of JSON."""
@@ -117,7 +148,7 @@ class MPesaService:
         try:
             if self._is_html_response(response.text):
                 error_msg = "Received HTML response instead of JSON. This usually indicates a server-side issue or maintenance."
-                logger.error(f"{error_msg} Response starts with: {response.text[:200]}...")
+                logger.error("%s Response starts with: %s...", error_msg, response.text[:200])
                 return {
                     'error': 'M-Pesa API is currently unavailable. Please try again later.',
                     'error_code': 'API_UNAVAILABLE',
@@ -126,8 +157,8 @@ class MPesaService:
                 
             return response.json()
         except json.JSONDecodeError as e:
-            logger.error(f"Failed to decode JSON response: {str(e)}")
-            logger.error(f"Response content: {response.text[:500]}")
+            logger.error("Failed to decode JSON response: %s", e)
+            logger.error("Response content: %s", response.text[:500])
             return {
                 'error': 'Invalid response from payment service',
                 'error_code': 'INVALID_RESPONSE',
@@ -135,7 +166,15 @@ class MPesaService:
             }
 
     def generate_access_token(self):
-        """Generate access token for M-Pesa API authentication."""
+        """Generate access token for M-Pesa API authentication.
+
+        The token is cached on the instance until shortly before it expires, so
+        long-lived callers (e.g. the payment worker) fetch one per hour instead
+        of one per request.
+        """
+        if self._access_token and self._access_token_expires_at and datetime.now() < self._access_token_expires_at:
+            return self._access_token
+
         access_token_url = f'{self.base_url}/oauth/v1/generate?grant_type=client_credentials'
         
         if not self.consumer_key or not self.consumer_secret:
@@ -144,7 +183,7 @@ class MPesaService:
             return None
             
         try:
-            logger.info(f"Requesting access token from: {access_token_url}")
+            logger.info("Requesting access token from: %s", access_token_url)
             response = requests.get(
                 access_token_url,
                 auth=HTTPBasicAuth(self.consumer_key, self.consumer_secret),
@@ -152,42 +191,48 @@ class MPesaService:
                 timeout=30
             )
             
-            logger.info(f"Access token response status: {response.status_code}")
+            logger.info("Access token response status: %s", response.status_code)
             
             # Handle HTML responses
             if self._is_html_response(response.text):
-                logger.error(f"Received HTML response from M-Pesa API. Status: {response.status_code}")
-                logger.error(f"Response: {response.text[:500]}...")
+                logger.error("Received HTML response from M-Pesa API. Status: %s", response.status_code)
+                logger.error("Response: %s...", response.text[:500])
                 return None
                 
             # Try to parse JSON response
             try:
                 response_data = response.json()
             except json.JSONDecodeError:
-                logger.error(f"Failed to decode JSON response: {response.text[:500]}...")
+                logger.error("Failed to decode JSON response: %s...", response.text[:500])
                 return None
             
             if response.status_code == 200:
                 token = response_data.get('access_token')
-                print('acces token',token,'\n\n\n\n')
                 if token:
                     logger.info("Successfully generated M-Pesa access token")
+                    try:
+                        expires_in = int(response_data.get('expires_in') or 0)
+                    except (TypeError, ValueError):
+                        expires_in = 0
+                    if expires_in > 60:
+                        self._access_token = token
+                        self._access_token_expires_at = datetime.now() + timedelta(seconds=expires_in - 60)
                     return token
                 else:
                     logger.error("No access token in response")
-                    logger.error(f"Full response: {response.text}")
+                    logger.error("Full response: %s", response.text)
             else:
                 error_msg = response_data.get('errorMessage') or response_data.get('error') or 'Unknown error'
-                logger.error(f"Failed to generate access token. Status: {response.status_code}, Error: {error_msg}")
+                logger.error("Failed to generate access token. Status: %s, Error: %s", response.status_code, error_msg)
                 
             return None
                 
         except requests.exceptions.RequestException as e:
-            logger.error(f"Request error generating access token: {str(e)}")
+            logger.error("Request error generating access token: %s", e)
             if hasattr(e, 'response') and e.response is not None:
-                logger.error(f"Response content: {e.response.text[:500]}...")
+                logger.error("Response content: %s...", e.response.text[:500])
         except Exception as e:
-            logger.error(f"Unexpected error generating access token: {str(e)}", exc_info=True)
+            logger.error("Unexpected error generating access token: %s", e, exc_info=True)
             
         return None
     
@@ -213,15 +258,12 @@ class MPesaService:
             business_code = paybill_number or self.business_shortcode
             concatenated_string = f"{business_code}{self.passkey}{timestamp}"
             password = base64.b64encode(concatenated_string.encode()).decode('utf-8')
-            print(password, timestamp, '\n\n\n\n')  
-            # Log for debugging
-            logger.info(f"Generated password with timestamp (EAT): {timestamp}")
-            logger.debug(f"Password string: {concatenated_string}")
+            logger.debug("Generated password with timestamp (EAT): %s", timestamp)
             
             return password, timestamp
             
         except Exception as e:
-            logger.error(f"Error generating password: {str(e)}", exc_info=True)
+            logger.error("Error generating password: %s", e, exc_info=True)
             return None, None
     
     def initiate_stk_push(self, phone_number, amount, account_reference, description="Payment", callback_url=None, request=None, order_id=None):
@@ -233,6 +275,7 @@ class MPesaService:
             amount (float): Amount to charge
             account_reference (str): Reference for the transaction
             description (str): Description of the payment
+            callback_url (str): Explicit callback URL; derived from settings/request when omitted
             
         Returns:
             dict: Response from M-Pesa API or error details
@@ -246,9 +289,7 @@ class MPesaService:
             password, timestamp = self.generate_password()
             
             # Log the credentials being used (redact sensitive info in production)
-            logger.info(f"Using Business Shortcode: {self.business_shortcode}")
-            logger.info(f"Using Passkey: {'*' * (len(self.passkey) - 4) + self.passkey[-4:] if self.passkey else 'None'}")
-            logger.info(f"Generated Timestamp: {timestamp}")
+            logger.debug("Using Business Shortcode: %s, timestamp %s", self.business_shortcode, timestamp)
             
             if not access_token:
                 error_msg = "Failed to generate access token. Please check your M-Pesa credentials."
@@ -293,7 +334,7 @@ class MPesaService:
                 'PartyA': phone,
                 'PartyB': self.business_shortcode,
                 'PhoneNumber': phone,
-                'CallBackURL': self.get_callback_url(request=request, order_id=order_id),
+                'CallBackURL': callback_url or self.get_callback_url(request=request, order_id=order_id),
                 'AccountReference': account_reference[:12],  # Max 12 chars
                 'TransactionDesc': description[:13]  # Max 13 chars
             }
@@ -301,8 +342,7 @@ class MPesaService:
             # Log the request (without sensitive data)
             log_payload = payload.copy()
             log_payload['Password'] = '***'
-            logger.info(f"Initiating STK push with payload: {log_payload}")
-            print(f"DEBUG: STK Push Callback URL: {payload['CallBackURL']}")
+            logger.info("Initiating STK push with payload: %s", log_payload)
             
             # Make the API request
             url = f"{self.base_url}/mpesa/stkpush/v1/processrequest"
@@ -312,8 +352,8 @@ class MPesaService:
                 # Check for HTML response
                 if self._is_html_response(response.text):
                     error_msg = "Received HTML response from M-Pesa API. This usually indicates a server-side issue or maintenance."
-                    logger.error(f"{error_msg} Status: {response.status_code}")
-                    logger.error(f"Response: {response.text[:500]}...")
+                    logger.error("%s Status: %s", error_msg, response.status_code)
+                    logger.error("Response: %s...", response.text[:500])
                     return {
                         'error': 'M-Pesa API is currently unavailable. Please try again later.',
                         'error_code': 'API_UNAVAILABLE',
@@ -324,19 +364,19 @@ class MPesaService:
                     response_data = response.json()
                 except json.JSONDecodeError:
                     error_msg = f"Failed to decode JSON response. Status: {response.status_code}"
-                    logger.error(f"{error_msg} Response: {response.text[:500]}...")
+                    logger.error("%s Response: %s...", error_msg, response.text[:500])
                     return {
                         'error': 'Invalid response from payment service',
                         'error_code': 'INVALID_RESPONSE',
                         'raw_response': response.text
                     }
                 
-                logger.info(f"STK push response: {response.status_code} - {json.dumps(response_data)}")
+                logger.info("STK push response: %s - %s", response.status_code, response_data)
                 
                 # Process response
                 if response.status_code == 200:
                     if 'ResponseCode' in response_data and response_data['ResponseCode'] == '0':
-                        logger.info(f"STK push initiated successfully: {response_data}")
+                        logger.info("STK push initiated successfully: %s", response_data)
                         return response_data
                     else:
                         error_code = response_data.get('errorCode') or response_data.get('ResponseCode', 'UNKNOWN')
@@ -345,7 +385,7 @@ class MPesaService:
                         if error_code == '500.001.1001':
                             error_msg = "Invalid M-Pesa API credentials. Please verify your consumer key and secret."
                         
-                        logger.error(f"STK push failed with status {response.status_code}: {error_msg} (Code: {error_code})")
+                        logger.error("STK push failed with status %s: %s (Code: %s)", response.status_code, error_msg, error_code)
                         return {
                             "error": f"Payment request failed: {error_msg}",
                             "error_code": error_code,
@@ -353,7 +393,7 @@ class MPesaService:
                         }
                 else:
                     error_msg = f"STK push failed with status {response.status_code}"
-                    logger.error(f"{error_msg}. Response: {response.text[:500]}...")
+                    logger.error("%s. Response: %s...", error_msg, response.text[:500])
                     return {
                         "error": "Payment service is currently unavailable. Please try again later.",
                         "error_code": f"HTTP_{response.status_code}",
@@ -364,10 +404,12 @@ class MPesaService:
                 error_msg = f"Network error while initiating STK push: {str(e)}"
                 logger.error(error_msg)
                 if hasattr(e, 'response') and e.response is not None:
-                    logger.error(f"Response content: {e.response.text[:500]}...")
+                    logger.error("Response content: %s...", e.response.text[:500])
                 return {
                     "error": "Network error while processing your payment. Please check your internet connection and try again.",
-                    "error_code": "NETWORK_ERROR"
+                    # CONNECT_ERROR: the push never reached Daraja. NETWORK_ERROR
+                    # (e.g. a read timeout) may come after Daraja accepted it.
+                    "error_code": "CONNECT_ERROR" if _request_not_sent(e) else "NETWORK_ERROR"
                 }
                 
         except Exception as e:
@@ -379,15 +421,79 @@ class MPesaService:
                 "debug_info": str(e)
             }
     
-    def pull_transactions(self):
-        """Pull recent M-Pesa transactions (last 5 hours)."""
+    def query_stk_status(self, checkout_request_id):
+        """
+        Query the status of an STK push via the STK Push Query API.
+
+        Args:
+            checkout_request_id (str): CheckoutRequestID returned by the STK push
+
+        Returns:
+            dict: Response from M-Pesa API (``ResultCode``/``ResultDesc`` once the
+            transaction has completed) or error details. A transaction that is
+            still being processed comes back as an error with ``error_code``
+            ``'500.001.1001'``.
+        """
+        try:
+            access_token = self.generate_access_token()
+            if not access_token:
+                return {"error": "Failed to generate access token", "error_code": "AUTH_ERROR"}
+
+            password, timestamp = self.generate_password()
+            if not password or not timestamp:
+                return {"error": "Failed to generate transaction password", "error_code": "PASSWORD_GENERATION_ERROR"}
+
+            headers = {
+                'Authorization': f'Bearer {access_token}',
+                'Content-Type': 'application/json'
+            }
+            payload = {
+                'BusinessShortCode': self.business_shortcode,
+                'Password': password,
+                'Timestamp': timestamp,
+                'CheckoutRequestID': checkout_request_id,
+            }
+
+            url = f"{self.base_url}/mpesa/stkpushquery/v1/query"
+            try:
+                response = requests.post(url, json=payload, headers=headers, timeout=30)
+            except requests.exceptions.RequestException as e:
+                logger.warning("Network error querying STK status for %s: %s", checkout_request_id, e)
+                return {"error": "Network error while querying payment status", "error_code": "NETWORK_ERROR"}
+
+            response_data = self._handle_api_response(response)
+            if 'error' in response_data:
+                return response_data
+
+            if response.status_code == 200 and 'ResultCode' in response_data:
+                return response_data
+
+            error_code = response_data.get('errorCode') or f"HTTP_{response.status_code}"
+            error_msg = response_data.get('errorMessage') or response_data.get('ResponseDescription', 'Unknown error')
+            return {"error": error_msg, "error_code": error_code, "raw_response": response_data}
+
+        except Exception as e:
+            logger.error("Unexpected error querying STK status for %s", checkout_request_id, exc_info=True)
+            return {"error": f"Error querying payment status: {e}", "error_code": "INTERNAL_ERROR"}
+
+    def pull_transactions(self, start_date=None, end_date=None, offset=0):
+        """
+        Pull one page of M-Pesa transactions.
+
+        Dates are Nairobi-time strings (``YYYY-MM-DD HH:MM:SS``) and default
+        to the last 5 hours. Returns a flat list of transaction dicts or an
+        error dict.
+        """
         try:
             access_token = self.generate_access_token()
             if not access_token:
                 return {"error": "Failed to generate access token"}
                 
             url = f"{self.base_url}/pulltransactions/v1/query"
-            start_date, end_date = self._get_transaction_dates()
+            if not start_date or not end_date:
+                default_start, default_end = self._get_transaction_dates()
+                start_date = start_date or default_start
+                end_date = end_date or default_end
             
             headers = {
                 'Content-Type': 'application/json',
@@ -398,7 +504,7 @@ class MPesaService:
                 'ShortCode': self.business_shortcode,
                 'StartDate': start_date,
                 'EndDate': end_date,
-                'OffSetValue': '0'
+                'OffSetValue': str(offset)
             }
             
             response = requests.post(url, headers=headers, json=payload, timeout=30)
@@ -406,13 +512,47 @@ class MPesaService:
             if response.status_code == 200:
                 data = response.json()
                 if data.get('ResponseCode') == '1000':
-                    return data.get('Response', [])
-                return {"error": data.get('ResponseDescription', 'Failed to fetch transactions')}
+                    return self._flatten_transactions(data.get('Response') or [])
+                return {"error": data.get('ResponseDescription') or data.get('ResponseMessage') or 'Failed to fetch transactions'}
             else:
                 return {"error": f"API request failed: {response.status_code}"}
                 
         except Exception as e:
             return {"error": f"Error fetching transactions: {str(e)}"}
+
+    def iter_transaction_pages(self, start_date=None, end_date=None):
+        """
+        Yield successive pages of transactions for the window, advancing
+        ``OffSetValue`` by the size of each page until an empty page.
+
+        Raises ``PullTransactionsError`` if a page cannot be fetched, so a
+        partially read window is never mistaken for a complete one.
+        """
+        if not start_date or not end_date:
+            default_start, default_end = self._get_transaction_dates()
+            start_date = start_date or default_start
+            end_date = end_date or default_end
+
+        offset = 0
+        while True:
+            page = self.pull_transactions(start_date=start_date, end_date=end_date, offset=offset)
+            if isinstance(page, dict):
+                raise PullTransactionsError(page.get('error', 'Failed to fetch transactions'), offset=offset)
+            if not page:
+                return
+            yield page
+            offset += len(page)
+
+    @staticmethod
+    def _flatten_transactions(response):
+        """Daraja nests the transaction list (``[[{...}, ...]]``); flatten it."""
+        transactions = []
+        for item in response:
+            if isinstance(item, list):
+                transactions.extend(t for t in item if isinstance(t, dict))
+            elif isinstance(item, dict):
+                transactions.append(item)
+        return transactions
     
     def register_callback_url(self, nominated_number=None):
         """Register callback URL for transaction notifications."""
@@ -465,7 +605,7 @@ class MPesaService:
             return start, end
             
         except Exception as e:
-            logger.error(f"Error generating transaction dates: {str(e)}")
+            logger.error("Error generating transaction dates: %s", e)
             # Fallback to default values
             return (datetime.now() - timedelta(hours=5)).strftime("%Y-%m-%d %H:%M:%S"), \
                    datetime.now().strftime("%Y-%m-%d %H:%M:%S")
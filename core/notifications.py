@@ -0,0 +1,144 @@
+"""
+Lightweight change notifications for long-poll and server-sent event views.
+
+Each channel has a version counter kept in a Django cache (``NOTIFICATIONS_CACHE``,
+the file-based ``notifications`` alias unless set). Publishers bump the counter (after their
+transaction commits); waiters subscribe to the channel in-process and re-check
+the counter when woken, so a wake-up costs a cache read rather than a database
+query per waiting client, and a publish only wakes that channel's waiters.
+
+The cache is the cross-process transport: waiters also re-check it every
+``CROSS_PROCESS_POLL_SECONDS`` to see bumps made by other processes. Any shared
+backend works (the file-based ``notifications`` alias or a database cache with
+no extra services, or Redis and Memcached); with a local-memory cache
+notifications are process-local.
+"""
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+# Counters outlive any single wait by a wide margin
+VERSION_TIMEOUT = 60 * 60 * 24
+
+# How often waiters re-check the shared counter for changes made elsewhere
+CROSS_PROCESS_POLL_SECONDS = 0.5
+
+_lock = threading.Lock()
+_subscribers = {}
+
+
+def _cache():
+    return caches[getattr(settings, 'NOTIFICATIONS_CACHE', 'notifications')]
+
+
+def _key(channel):
+    return f"notify:{channel}"
+
+
+def payment_request_channel(payment_request_id):
+    return f"payment-request:{payment_request_id}"
+
+
+def buyer_seller_chat_channel(chat_id):
+    return f"buyer-seller-chat:{chat_id}"
+
+
+def current_version(channel):
+    return _cache().get(_key(channel), 0)
+
+
+async def acurrent_version(channel):
+    return await _cache().aget(_key(channel), 0)
+
+
+@contextmanager
+def _subscribe(channel, wake):
+    """Call ``wake()`` on every local publish to ``channel`` while inside the block."""
+    with _lock:
+        _subscribers.setdefault(channel, set()).add(wake)
+    try:
+        yield
+    finally:
+        with _lock:
+            waiters = _subscribers.get(channel)
+            if waiters is not None:
+                waiters.discard(wake)
+                if not waiters:
+                    del _subscribers[channel]
+
+
+def _wake_local(channel):
+    with _lock:
+        waiters = list(_subscribers.get(channel, ()))
+    for wake in waiters:
+        try:
+            wake()
+        except RuntimeError:
+            # The waiter's event loop has closed; it unsubscribes on its own
+            pass
+
+
+def publish(channel):
+    """Bump the channel's version and wake local waiters immediately."""
+    cache = _cache()
+    key = _key(channel)
+    if cache.add(key, 1, VERSION_TIMEOUT):
+        version = 1
+    else:
+        try:
+            version = cache.incr(key)
+        except ValueError:
+            # Expired between add() and incr()
+            cache.set(key, 1, VERSION_TIMEOUT)
+            version = 1
+    _wake_local(channel)
+    return version
+
+
+def publish_on_commit(channel):
+    """Publish once the surrounding transaction commits (immediately outside one)."""
+    transaction.on_commit(lambda: publish(channel))
+
+
+def wait_for_change(channel, version, timeout):
+    """
+    Block until the channel moves past ``version`` or ``timeout`` seconds pass.
+    Returns the new version, or None on timeout.
+    """
+    deadline = time.monotonic() + timeout
+    event = threading.Event()
+    with _subscribe(channel, event.set):
+        while True:
+            event.clear()
+            latest = current_version(channel)
+            if latest != version:
+                return latest
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            event.wait(min(remaining, CROSS_PROCESS_POLL_SECONDS))
+
+
+async def await_change(channel, version, timeout):
+    """Async counterpart of ``wait_for_change``; waits without holding a thread."""
+    deadline = time.monotonic() + timeout
+    loop = asyncio.get_running_loop()
+    event = asyncio.Event()
+    with _subscribe(channel, lambda: loop.call_soon_threadsafe(event.set)):
+        while True:
+            event.clear()
+            latest = await acurrent_version(channel)
+            if latest != version:
+                return latest
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            try:
+                await asyncio.wait_for(event.wait(), min(remaining, CROSS_PROCESS_POLL_SECONDS))
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,172 @@
+"""
+Local stand-in for the OpenAI chat completions API.
+
+Serves ``POST /v1/chat/completions`` in both plain and ``stream=True`` mode
+with configurable time to first token and per-token delay, so the chat
+endpoints can be exercised and load-tested without network access or API
+spend. Point ``OPENAI_BASE_URL`` at ``http://host:port/v1``;
+``manage.py openai_stub_server`` runs it from the command line.
+"""
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+
+class StubConfig:
+    def __init__(self, first_token_ms=300, token_ms=30, reply=None, failure_rate=0.0):
+        self.first_token_ms = first_token_ms
+        self.token_ms = token_ms
+        # None echoes the last user message back
+        self.reply = reply
+        self.failure_rate = failure_rate
+
+
+class CompletionStub:
+    """State shared by the request handler threads."""
+
+    def __init__(self, config=None):
+        self.config = config or StubConfig()
+        self.lock = threading.Lock()
+        self.stats = Counter()
+        self.in_flight = 0
+        self._failures = 0.0
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.stats[name] += amount
+
+    def enter(self):
+        with self.lock:
+            self.in_flight += 1
+            self.stats['max_in_flight'] = max(self.stats['max_in_flight'], self.in_flight)
+
+    def leave(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def should_fail(self):
+        # Deterministic: every 1/failure_rate-th request fails
+        if not self.config.failure_rate:
+            return False
+        with self.lock:
+            self._failures += self.config.failure_rate
+            if self._failures >= 1:
+                self._failures -= 1
+                return True
+        return False
+
+    def reply_tokens(self, messages):
+        text = self.config.reply
+        if text is None:
+            last_user = next(
+                (m.get('content', '') for m in reversed(messages or []) if m.get('role') == 'user'), ''
+            )
+            text = f"This is a stub reply to: {last_user}"
+        # Split into word-sized tokens, keeping the separating spaces
+        words = text.split(' ')
+        return [word if i == 0 else f" {word}" for i, word in enumerate(words)]
+
+    def summary(self):
+        with self.lock:
+            return dict(self.stats)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    stub = None  # set per server class by make_server()
+
+    def log_message(self, format, *args):
+        logger.debug("openai-stub %s", format % args)
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        if self.path.rstrip('/') not in ('/v1/chat/completions', '/chat/completions'):
+            return self._send_json(404, {'error': {'message': 'Not found', 'type': 'invalid_request_error'}})
+
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return self._send_json(400, {'error': {'message': 'Invalid JSON', 'type': 'invalid_request_error'}})
+
+        stub = self.stub
+        stub.count('requests')
+        if stub.should_fail():
+            stub.count('failed')
+            return self._send_json(503, {'error': {'message': 'Stub overloaded', 'type': 'server_error'}})
+
+        stub.enter()
+        try:
+            tokens = stub.reply_tokens(payload.get('messages'))
+            model = payload.get('model', 'stub')
+            completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+            time.sleep(stub.config.first_token_ms / 1000)
+            if payload.get('stream'):
+                stub.count('streamed')
+                self._stream(completion_id, model, tokens)
+            else:
+                time.sleep(stub.config.token_ms * max(0, len(tokens) - 1) / 1000)
+                self._send_json(200, {
+                    'id': completion_id,
+                    'object': 'chat.completion',
+                    'created': int(time.time()),
+                    'model': model,
+                    'choices': [{
+                        'index': 0,
+                        'message': {'role': 'assistant', 'content': ''.join(tokens)},
+                        'finish_reason': 'stop',
+                    }],
+                    'usage': {'prompt_tokens': 0, 'completion_tokens': len(tokens), 'total_tokens': len(tokens)},
+                })
+        except (BrokenPipeError, ConnectionResetError):
+            stub.count('client_disconnects')
+        finally:
+            stub.leave()
+
+    def _stream(self, completion_id, model, tokens):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+
+        def chunk(delta, finish_reason=None):
+            body = {
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}],
+            }
+            self.wfile.write(f"data: {json.dumps(body)}\n\n".encode())
+            self.wfile.flush()
+
+        for i, token in enumerate(tokens):
+            if i:
+                time.sleep(self.stub.config.token_ms / 1000)
+            chunk({'role': 'assistant', 'content': token} if i == 0 else {'content': token})
+        chunk({}, finish_reason='stop')
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+
+def make_server(host='127.0.0.1', port=0, config=None):
+    """Return ``(server, stub)``; call ``server.serve_forever()`` to run it."""
+    stub = CompletionStub(config)
+    handler = type('CompletionStubHandler', (_Handler,), {'stub': stub})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server, stub
@@ -0,0 +1,285 @@
+"""
+DB-backed job queue for M-Pesa STK pushes.
+
+Views record a ``PaymentRequest`` in the ``queued`` state and enqueue a
+``PaymentJob``; ``manage.py run_payment_worker`` claims jobs and talks to
+Daraja outside the web request, so slow upstream calls never hold a web worker.
+
+A push is only retried when it failed before reaching Daraja. If the outcome
+is unknown (a read timeout, a gateway error, a worker that died mid-send)
+the payment stays ``pending`` with error code ``UNCONFIRMED`` and
+``core.payment_reconciler`` resolves it, so a customer is never prompted
+twice for one payment.
+"""
+import logging
+import os
+import socket
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db.models import F
+from django.utils import timezone
+
+from home.models import Order, PaymentJob, PaymentRequest, RawPayment
+
+from .notifications import payment_request_channel, publish_on_commit
+
+logger = logging.getLogger(__name__)
+
+# MPesaService error codes for failures before the push reached Daraja;
+# only these are safe to retry
+RETRYABLE_ERROR_CODES = {
+    'AUTH_ERROR',
+    'CONNECT_ERROR',
+}
+
+# Failures after the push was sent (read timeouts, dropped connections,
+# gateway errors, unreadable replies): Daraja may already have prompted the
+# customer, so a resend could charge them twice. HTTP 5xx counts as well.
+# The payment is left unconfirmed for the reconciler to resolve instead.
+AMBIGUOUS_ERROR_CODES = {
+    'NETWORK_ERROR',
+    'API_UNAVAILABLE',
+    'INVALID_RESPONSE',
+    'INTERNAL_ERROR',
+}
+
+# PaymentRequest.error_code of a push whose outcome is unknown
+UNCONFIRMED = 'UNCONFIRMED'
+
+
+def default_worker_id():
+    """Identify a worker by host and pid (plus a short random suffix)."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+def enqueue_stk_push(payment_request, callback_url=None):
+    """Queue an STK push for ``payment_request`` and return the job."""
+    return PaymentJob.objects.create(
+        payment_request=payment_request,
+        kind='stk_push',
+        payload={'callback_url': callback_url} if callback_url else {},
+        max_attempts=getattr(settings, 'MPESA_JOB_MAX_ATTEMPTS', 3),
+        available_at=timezone.now(),
+    )
+
+
+def release_stale_jobs(stale_after=None):
+    """
+    Close jobs stuck in ``running`` (e.g. a crashed worker). The push may
+    already have been sent, so they are not retried; their payments are left
+    unconfirmed for the reconciler. Returns the number of jobs released.
+    """
+    if stale_after is None:
+        stale_after = getattr(settings, 'MPESA_JOB_STALE_AFTER_SECONDS', 300)
+    cutoff = timezone.now() - timedelta(seconds=stale_after)
+    released = 0
+    for job in PaymentJob.objects.filter(status='running', locked_at__lt=cutoff).select_related('payment_request'):
+        if job.payment_request.status == 'queued':
+            _leave_unconfirmed(job, 'WORKER_LOST', f"Worker {job.locked_by} stopped while sending the push")
+        else:
+            job.status = 'failed'
+            job.last_error = f"Worker {job.locked_by} stopped while sending the push"
+            job.finished_at = timezone.now()
+            job.save(update_fields=['status', 'last_error', 'finished_at', 'updated_at'])
+        released += 1
+    return released
+
+
+def claim_jobs(worker_id, limit=10):
+    """
+    Claim up to ``limit`` due jobs for ``worker_id``.
+
+    Each job is claimed with a conditional UPDATE (status still ``queued``), so
+    several workers can poll the same table without double-sending a push and
+    without relying on SELECT ... SKIP LOCKED support in the backend.
+    """
+    now = timezone.now()
+    candidate_ids = list(
+        PaymentJob.objects.filter(status='queued', available_at__lte=now)
+        .order_by('available_at', 'id')
+        .values_list('id', flat=True)[:limit]
+    )
+    claimed_ids = [
+        job_id for job_id in candidate_ids
+        if PaymentJob.objects.filter(pk=job_id, status='queued').update(
+            status='running',
+            locked_by=worker_id,
+            locked_at=now,
+            attempts=F('attempts') + 1,
+        )
+    ]
+    return list(
+        PaymentJob.objects.filter(pk__in=claimed_ids).select_related('payment_request')
+    )
+
+
+def _retry_delay(attempts):
+    """Exponential backoff capped at one minute."""
+    return min(2 ** attempts, 60)
+
+
+def _fail_job(job, error_code, error_message):
+    payment_request = job.payment_request
+    payment_request.status = 'failed'
+    payment_request.error_code = str(error_code)[:50]
+    payment_request.error_message = error_message
+    payment_request.save(update_fields=['status', 'error_code', 'error_message', 'updated_at'])
+
+    job.status = 'failed'
+    job.last_error = f"{error_code}: {error_message}"
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'last_error', 'finished_at', 'updated_at'])
+    publish_on_commit(payment_request_channel(payment_request.id))
+
+
+def _leave_unconfirmed(job, error_code, error_message):
+    payment_request = job.payment_request
+    payment_request.status = 'pending'
+    payment_request.error_code = UNCONFIRMED
+    payment_request.error_message = f"{error_code}: {error_message}"
+    payment_request.save(update_fields=['status', 'error_code', 'error_message', 'updated_at'])
+
+    job.status = 'failed'
+    job.last_error = f"{error_code}: {error_message} (outcome unknown, left for reconciliation)"
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'last_error', 'finished_at', 'updated_at'])
+    publish_on_commit(payment_request_channel(payment_request.id))
+
+
+def _mark_order_pending(order_id, payment_request):
+    """Record a sent push on its order and as a pending RawPayment."""
+    checkout_request_id = payment_request.checkout_request_id or ''
+    if checkout_request_id:
+        RawPayment.objects.get_or_create(
+            transaction_id=checkout_request_id,
+            defaults={
+                'product_id': str(order_id),
+                'payment_method': 'mpesa',
+                'amount': payment_request.amount,
+                'currency': 'KES',
+                'status': 'pending',
+                'phone_number': payment_request.phone_number,
+            },
+        )
+    order = Order.objects.filter(pk=order_id).first()
+    if order is None:
+        return
+    if order.status in ('paid', 'completed', 'shipped', 'delivered'):
+        logger.info("Order %s already in %s state, not changing to pending", order.id, order.status)
+        return
+    order.payment_method = 'mpesa'
+    order.transaction_id = checkout_request_id
+    order.status = 'pending'
+    order.save()
+    logger.info("Order %s status set to 'pending' for M-Pesa payment", order.id)
+
+
+def run_stk_push_job(job, mpesa):
+    """Send the STK push for a claimed job and record the outcome."""
+    payment_request = job.payment_request
+    if payment_request.status != 'queued':
+        # Already handled elsewhere (e.g. cancelled by an admin); nothing to send
+        job.status = 'succeeded'
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'finished_at', 'updated_at'])
+        return job
+
+    try:
+        response = mpesa.initiate_stk_push(
+            phone_number=payment_request.phone_number,
+            amount=payment_request.amount,
+            account_reference=payment_request.account_reference or f"PR{payment_request.id}",
+            description=payment_request.transaction_desc or "Payment",
+            callback_url=job.payload.get('callback_url'),
+            order_id=payment_request.order_id,
+        )
+    except Exception as e:
+        logger.exception("STK push job %s raised", job.id)
+        response = {'error': str(e), 'error_code': 'INTERNAL_ERROR'}
+
+    if 'error' in response:
+        error_code = str(response.get('error_code', 'UNKNOWN'))
+        error_message = response.get('error', 'Payment request failed')
+        if error_code in AMBIGUOUS_ERROR_CODES or error_code.startswith('HTTP_5'):
+            logger.warning("STK push job %s failed with %s after sending; not retrying, left for reconciliation",
+                           job.id, error_code)
+            _leave_unconfirmed(job, error_code, error_message)
+        elif error_code in RETRYABLE_ERROR_CODES and job.attempts < job.max_attempts:
+            job.status = 'queued'
+            job.locked_by = None
+            job.locked_at = None
+            job.last_error = f"{error_code}: {error_message}"
+            job.available_at = timezone.now() + timedelta(seconds=_retry_delay(job.attempts))
+            job.save(update_fields=['status', 'locked_by', 'locked_at', 'last_error', 'available_at', 'updated_at'])
+            logger.warning("STK push job %s failed with %s, retrying (attempt %s/%s)",
+                           job.id, error_code, job.attempts, job.max_attempts)
+        else:
+            logger.error("STK push job %s failed permanently: %s (%s)", job.id, error_message, error_code)
+            _fail_job(job, error_code, error_message)
+        return job
+
+    payment_request.merchant_request_id = response.get('MerchantRequestID')
+    payment_request.checkout_request_id = response.get('CheckoutRequestID')
+    payment_request.status = 'pending'
+    payment_request.save(update_fields=['merchant_request_id', 'checkout_request_id', 'status', 'updated_at'])
+    publish_on_commit(payment_request_channel(payment_request.id))
+    # Re-read the order: checkout may have linked it while the push was in flight
+    order_id = PaymentRequest.objects.filter(pk=payment_request.pk).values_list('order_id', flat=True).first()
+    if order_id:
+        _mark_order_pending(order_id, payment_request)
+
+    job.status = 'succeeded'
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'finished_at', 'updated_at'])
+    logger.info("STK push job %s sent, CheckoutRequestID %s", job.id, payment_request.checkout_request_id)
+    return job
+
+
+def _run_in_thread(job, mpesa):
+    close_old_connections()
+    try:
+        return run_stk_push_job(job, mpesa)
+    finally:
+        connection.close()
+
+
+def run_worker(worker_id=None, batch_size=10, concurrency=1, poll_interval=1.0,
+               once=False, max_jobs=None, mpesa=None):
+    """
+    Poll for due jobs and execute them until stopped.
+
+    Returns the number of jobs processed. ``once`` drains the currently due
+    jobs a single time, which is what tests and cron-style runs want.
+    """
+    if mpesa is None:
+        from .mpesa_service import MPesaService
+        mpesa = MPesaService()
+    worker_id = worker_id or default_worker_id()
+    processed = 0
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        while True:
+            release_stale_jobs()
+            limit = batch_size if max_jobs is None else min(batch_size, max_jobs - processed)
+            jobs = claim_jobs(worker_id, limit=limit) if limit > 0 else []
+
+            if concurrency > 1:
+                list(pool.map(lambda job: _run_in_thread(job, mpesa), jobs))
+            else:
+                for job in jobs:
+                    run_stk_push_job(job, mpesa)
+            processed += len(jobs)
+
+            if max_jobs is not None and processed >= max_jobs:
+                break
+            if once and not jobs:
+                break
+            if not jobs:
+                time.sleep(poll_interval)
+
+    return processed
@@ -0,0 +1,308 @@
+"""
+Reconciliation of M-Pesa payments whose callback never arrived.
+
+``reconcile_stale_payments`` selects ``pending`` PaymentRequests that have not
+changed for a while, asks Daraja for their status through the STK Push Query
+API (in a bounded thread pool, HTTP only) and applies the answers in the
+calling thread exactly as a callback would be applied.
+
+``resolve_unconfirmed`` handles pushes whose send failed ambiguously (see
+``core.payment_jobs``). They have no CheckoutRequestID to query, so an
+orphaned success callback for the same phone number and amount is adopted
+instead, and payments still unmatched after ``UNCONFIRMED_GIVE_UP_SECONDS``
+time out. A callback is adopted only when it is the sole candidate for the
+only pending push with that phone number and amount; anything else is marked
+``AMBIGUOUS_MATCH`` and left, with the callbacks, for manual review.
+"""
+import logging
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils import timezone
+
+from home.models import MpesaCallback, PaymentRequest
+
+from . import metrics
+from .mpesa_callbacks import NO_PAYMENT_REQUEST, OPEN_PAYMENT_STATUSES, apply_payment_callback
+from .notifications import payment_request_channel, publish_on_commit
+from .payment_jobs import UNCONFIRMED
+
+logger = logging.getLogger(__name__)
+
+# Daraja answers this while the customer has not yet acted on the prompt
+STILL_PROCESSING_ERROR_CODES = {'500.001.1001'}
+
+DEFAULT_STALE_AFTER_SECONDS = 120
+
+# Longest pause after batches that failed outright, e.g. Daraja down
+MAX_BACKOFF_SECONDS = 600
+
+# STK prompts expire long before this; an unconfirmed push with no matching
+# callback by then was either never delivered or not paid
+UNCONFIRMED_GIVE_UP_SECONDS = 600
+
+# Unconfirmed push whose phone number and amount fit more than one payment or
+# callback; it is neither adopted nor expired automatically
+AMBIGUOUS_MATCH = 'AMBIGUOUS_MATCH'
+
+
+def stale_payment_requests(stale_after=DEFAULT_STALE_AFTER_SECONDS, limit=50):
+    """Pending requests with a CheckoutRequestID untouched for ``stale_after`` seconds."""
+    cutoff = timezone.now() - timedelta(seconds=stale_after)
+    return list(
+        PaymentRequest.objects.filter(
+            status='pending',
+            checkout_request_id__isnull=False,
+            updated_at__lt=cutoff,
+        )
+        .exclude(checkout_request_id='')
+        .order_by('updated_at')
+        .only('id', 'checkout_request_id', 'merchant_request_id', 'created_at')[:limit]
+    )
+
+
+def _query(mpesa, payment_request):
+    started = time.monotonic()
+    try:
+        response = mpesa.query_stk_status(payment_request.checkout_request_id)
+    except Exception as e:
+        logger.exception("STK status query for PaymentRequest %s raised", payment_request.id)
+        response = {'error': str(e), 'error_code': 'INTERNAL_ERROR'}
+    metrics.observe('mpesa.reconcile.query_seconds', time.monotonic() - started)
+    return response
+
+
+def _as_callback(payment_request, response):
+    """Shape an STK query response like the callback body ``update_from_callback`` expects."""
+    try:
+        result_code = int(response.get('ResultCode'))
+    except (TypeError, ValueError):
+        result_code = None
+    return {
+        'Body': {
+            'stkCallback': {
+                'MerchantRequestID': response.get('MerchantRequestID') or payment_request.merchant_request_id,
+                'CheckoutRequestID': payment_request.checkout_request_id,
+                'ResultCode': result_code,
+                'ResultDesc': response.get('ResultDesc', ''),
+            }
+        },
+        'source': 'stk_query',
+    }
+
+
+def apply_query_result(payment_request_id, response):
+    """
+    Apply one STK query response. Returns the new status, or None when the
+    payment is still in progress (or was resolved by a callback meanwhile).
+    """
+    with transaction.atomic():
+        payment_request = PaymentRequest.objects.select_for_update().get(pk=payment_request_id)
+        if payment_request.status not in OPEN_PAYMENT_STATUSES:
+            return None
+
+        if 'error' in response or response.get('ResultCode') is None:
+            # Still processing or query failed: touch the row so it is
+            # re-checked after another stale interval rather than every pass
+            PaymentRequest.objects.filter(pk=payment_request.pk).update(updated_at=timezone.now())
+            return None
+
+        apply_payment_callback(payment_request, _as_callback(payment_request, response))
+        publish_on_commit(payment_request_channel(payment_request.id))
+        return payment_request.status
+
+
+def _record_attempt(payment_request_id):
+    """Push a request whose result could not be applied to the back of the stale queue."""
+    try:
+        PaymentRequest.objects.filter(pk=payment_request_id, status='pending').update(updated_at=timezone.now())
+    except Exception:
+        logger.exception("Failed to record reconcile attempt for PaymentRequest %s", payment_request_id)
+
+
+def _phone_key(phone):
+    return ''.join(ch for ch in str(phone or '') if ch.isdigit())[-9:]
+
+
+def _paid_by(payload):
+    """(phone key, amount) of a success callback, or None."""
+    stk_callback = (payload.get('Body') or {}).get('stkCallback') or {}
+    items = (stk_callback.get('CallbackMetadata') or {}).get('Item') or []
+    metadata = {item.get('Name'): item.get('Value') for item in items if isinstance(item, dict)}
+    try:
+        return _phone_key(metadata.get('PhoneNumber')), Decimal(str(metadata.get('Amount')))
+    except InvalidOperation:
+        return None
+
+
+def resolve_unconfirmed(give_up_after=UNCONFIRMED_GIVE_UP_SECONDS, limit=50):
+    """Match or expire unconfirmed pushes; returns ``(matched, expired)``."""
+    unconfirmed = list(
+        PaymentRequest.objects.filter(status='pending', error_code=UNCONFIRMED, checkout_request_id__isnull=True)
+        .order_by('created_at')[:limit]
+    )
+    if not unconfirmed:
+        return 0, 0
+
+    claimed = PaymentRequest.objects.filter(checkout_request_id__isnull=False).values('checkout_request_id')
+    orphans = [
+        (callback, _paid_by(callback.payload))
+        for callback in MpesaCallback.objects.filter(
+            status__in=('orphaned', 'failed'),
+            last_error=NO_PAYMENT_REQUEST,
+            result_code=0,
+            received_at__gte=unconfirmed[0].created_at,
+        ).exclude(checkout_request_id__in=claimed).order_by('received_at')
+    ]
+
+    # Every push still waiting on a match, beyond this batch and including
+    # ones already flagged, so a key never looks unique once another is set aside
+    pending_per_key = Counter(
+        (_phone_key(phone_number), Decimal(amount))
+        for phone_number, amount in PaymentRequest.objects.filter(
+            status='pending', error_code__in=(UNCONFIRMED, AMBIGUOUS_MATCH), checkout_request_id__isnull=True
+        ).values_list('phone_number', 'amount')
+    )
+
+    matched = expired = 0
+    give_up_cutoff = timezone.now() - timedelta(seconds=give_up_after)
+    for payment_request in unconfirmed:
+        key = (_phone_key(payment_request.phone_number), Decimal(payment_request.amount))
+        candidates = [
+            cb for cb, paid_by in orphans if paid_by == key and cb.received_at >= payment_request.created_at
+        ]
+        if candidates and (len(candidates) > 1 or pending_per_key[key] > 1):
+            if PaymentRequest.objects.filter(
+                pk=payment_request.pk, status='pending', checkout_request_id__isnull=True
+            ).update(
+                error_code=AMBIGUOUS_MATCH,
+                error_message=(
+                    f"{len(candidates)} callback(s) and {pending_per_key[key]} pending payment(s) "
+                    f"match this phone number and amount; needs manual review"
+                ),
+                updated_at=timezone.now(),
+            ):
+                metrics.incr('mpesa.reconcile.ambiguous')
+                logger.warning("Unconfirmed PaymentRequest %s has an ambiguous match (callbacks %s); left for review",
+                               payment_request.id, ', '.join(cb.checkout_request_id for cb in candidates))
+            continue
+
+        callback = candidates[0] if candidates else None
+        if callback is not None:
+            orphans = [(cb, paid_by) for cb, paid_by in orphans if cb.pk != callback.pk]
+            with transaction.atomic():
+                adopted = PaymentRequest.objects.filter(
+                    pk=payment_request.pk, status='pending', checkout_request_id__isnull=True
+                ).update(
+                    checkout_request_id=callback.checkout_request_id,
+                    merchant_request_id=callback.merchant_request_id,
+                    updated_at=timezone.now(),
+                )
+                if adopted:
+                    # process_callbacks applies it on its next pass
+                    MpesaCallback.objects.filter(pk=callback.pk).update(status='received', attempts=0, last_error=None)
+            if adopted:
+                matched += 1
+                logger.info("Matched unconfirmed PaymentRequest %s to callback %s",
+                            payment_request.id, callback.checkout_request_id)
+        elif payment_request.created_at < give_up_cutoff:
+            if PaymentRequest.objects.filter(
+                pk=payment_request.pk, status='pending', checkout_request_id__isnull=True
+            ).update(
+                status='timeout',
+                error_message=f"{payment_request.error_message or ''} (no callback received)".strip(),
+                updated_at=timezone.now(),
+            ):
+                expired += 1
+                publish_on_commit(payment_request_channel(payment_request.id))
+                logger.info("Unconfirmed PaymentRequest %s timed out", payment_request.id)
+    return matched, expired
+
+
+def reconcile_stale_payments(mpesa, stale_after=DEFAULT_STALE_AFTER_SECONDS,
+                             batch_size=50, concurrency=4):
+    """
+    Query and apply one batch of stale pending payments.
+
+    Returns a dict of counts: ``queried``, ``resolved``, ``still_pending``,
+    ``errors``, and ``matched``/``expired`` from ``resolve_unconfirmed``.
+    """
+    matched, expired = resolve_unconfirmed(limit=batch_size)
+    batch = stale_payment_requests(stale_after=stale_after, limit=batch_size)
+    stats = {'queried': len(batch), 'resolved': 0, 'still_pending': 0, 'errors': 0,
+             'matched': matched, 'expired': expired}
+    if not batch:
+        return stats
+
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(batch)))) as pool:
+        responses = list(pool.map(lambda pr: _query(mpesa, pr), batch))
+
+    for payment_request, response in zip(batch, responses):
+        if 'error' in response and str(response.get('error_code')) not in STILL_PROCESSING_ERROR_CODES:
+            stats['errors'] += 1
+            logger.warning("STK status query for PaymentRequest %s failed: %s (%s)",
+                           payment_request.id, response.get('error'), response.get('error_code'))
+        try:
+            status = apply_query_result(payment_request.id, response)
+        except Exception:
+            logger.exception("Failed to apply STK query result to PaymentRequest %s", payment_request.id)
+            stats['errors'] += 1
+            _record_attempt(payment_request.id)
+            continue
+
+        if status is None:
+            stats['still_pending'] += 1
+            continue
+
+        stats['resolved'] += 1
+        lag = (timezone.now() - payment_request.created_at).total_seconds()
+        metrics.observe('mpesa.reconcile.lag_seconds', lag)
+        logger.info("Reconciled PaymentRequest %s as %s after %.0fs", payment_request.id, status, lag)
+
+    for name, count in stats.items():
+        if count:
+            metrics.incr(f'mpesa.reconcile.{name}', count)
+    return stats
+
+
+def run_reconciler(mpesa, stale_after=DEFAULT_STALE_AFTER_SECONDS, batch_size=50,
+                   concurrency=4, poll_interval=30.0, once=False):
+    """
+    Reconcile batches until stopped (or a single batch when ``once``).
+
+    A batch in which every query failed, or one that raised, waits
+    ``poll_interval`` doubled per failed batch in a row (up to
+    ``MAX_BACKOFF_SECONDS``) before the next.
+    """
+    totals = {'queried': 0, 'resolved': 0, 'still_pending': 0, 'errors': 0, 'matched': 0, 'expired': 0}
+    failures = 0
+    while True:
+        try:
+            stats = reconcile_stale_payments(
+                mpesa, stale_after=stale_after, batch_size=batch_size, concurrency=concurrency
+            )
+        except Exception:
+            if once:
+                raise
+            logger.exception("Reconcile pass failed")
+            stats = None
+        if stats is not None:
+            for name, count in stats.items():
+                totals[name] += count
+        if once:
+            break
+        if stats is None or (stats['queried'] and stats['errors'] >= stats['queried']):
+            failures += 1
+            delay = min(poll_interval * 2 ** failures, MAX_BACKOFF_SECONDS)
+            logger.warning("Reconcile batch failed; retrying in %.0fs", delay)
+            time.sleep(delay)
+            continue
+        failures = 0
+        # A full batch means there is likely more backlog; go straight on
+        if stats['queried'] < batch_size:
+            time.sleep(poll_interval)
+    return totals
@@ -0,0 +1,292 @@
+"""
+Daily sales rollups for vendor dashboards and analytics.
+
+``VariationDailySales``, ``ProductDailySales`` and ``BusinessDailySales`` hold
+one row per variation, product or business and day: orders placed, units
+ordered, paid revenue, order requests and cart adds. Dashboards read these
+instead of scanning line items.
+
+Order-side figures are recomputed from the raw line items, but only for the
+(product, day) pairs an event touched, so they stay exact however an order
+changed. ``core.signals`` marks orders, order requests and deleted line items
+as they change (payments reach the rollup through the order status update
+they make) and ``flush`` refreshes each touched pair once. Inside a request,
+``core.middleware.sales_rollup_middleware`` holds the marks until the response
+is ready, so a checkout that saves an order and its items in autocommit
+refreshes once rather than after every save; elsewhere the marks are flushed
+when the transaction commits. Cart lines are deleted at checkout, so cart adds cannot
+be recomputed and are counted as they happen instead.
+
+A day is the local date (``TIME_ZONE``) an order or order request was
+created. Cancelled and failed orders are not counted, and revenue only
+includes orders that have been paid. The backfill_sales_rollups command
+rebuilds the order-side figures from history.
+"""
+import contextvars
+import logging
+from collections import defaultdict
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, time, timedelta
+
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Case, Count, DecimalField, F, Q, Sum, Value, When
+from django.utils import timezone
+
+from home.models import (
+    BusinessDailySales, Order, OrderItem, OrderRequest, OrderRequestItem, Product, ProductDailySales,
+    ProductVariation, VariationDailySales,
+)
+
+logger = logging.getLogger(__name__)
+
+UNCOUNTED_STATUSES = ('cancelled', 'payment_failed')
+PAID_STATUSES = ('paid', 'shipped', 'delivered')
+
+# Columns owned by the recompute; cart_adds is left alone
+ORDER_FIELDS = ['orders', 'units', 'revenue', 'order_requests']
+
+_REVENUE = DecimalField(max_digits=14, decimal_places=2)
+
+# Touched orders, order requests and (product, day) pairs of the current
+# thread or request, refreshed together on commit or at the end of a deferred
+# block. A context variable rather than a thread-local so an async request's
+# ORM calls, which run in a worker thread, share the request's state
+_pending = contextvars.ContextVar('sales_rollup_pending')
+
+
+class _Pending:
+    def __init__(self):
+        self.orders = set()
+        self.order_requests = set()
+        self.pairs = set()
+        self.deferred = False
+
+
+def _state():
+    state = _pending.get(None)
+    if state is None:
+        state = _Pending()
+        _pending.set(state)
+    return state
+
+
+def _schedule():
+    if not _state().deferred:
+        transaction.on_commit(flush, robust=True)
+
+
+def _hold():
+    """Start deferring; returns False when an outer block already is."""
+    state = _state()
+    if state.deferred:
+        return False
+    state.deferred = True
+    return True
+
+
+def _release():
+    _state().deferred = False
+    try:
+        flush()
+    except Exception:
+        logger.exception("Failed to refresh sales rollups")
+
+
+@contextmanager
+def deferred():
+    """Hold marks made inside the block and flush them once when it exits."""
+    owner = _hold()
+    try:
+        yield
+    finally:
+        if owner:
+            _release()
+
+
+@asynccontextmanager
+async def adeferred():
+    """Async counterpart of ``deferred``; the flush runs in a worker thread."""
+    owner = _hold()
+    try:
+        yield
+    finally:
+        if owner:
+            await sync_to_async(_release)()
+
+
+def _day_bounds(day):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    end = timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+    return start, end
+
+
+def mark_order(order_id):
+    """Refresh the products of ``order`` once the transaction commits (or the deferred block ends)."""
+    _state().orders.add(order_id)
+    _schedule()
+
+
+def mark_order_request(order_request_id):
+    _state().order_requests.add(order_request_id)
+    _schedule()
+
+
+def mark(product_id, created_at):
+    """Refresh ``product`` for the day of ``created_at`` along with the other marks."""
+    if product_id and created_at:
+        _state().pairs.add((product_id, timezone.localdate(created_at)))
+        _schedule()
+
+
+def flush():
+    """Refresh every pending (product, day) pair."""
+    state = _state()
+    pairs, state.pairs = state.pairs, set()
+    orders, state.orders = state.orders, set()
+    order_requests, state.order_requests = state.order_requests, set()
+    if orders:
+        pairs.update(
+            (product_id, timezone.localdate(created_at))
+            for product_id, created_at in OrderItem.objects.filter(order__in=orders).values_list(
+                'variation__product_id', 'order__created_at')
+        )
+    if order_requests:
+        pairs.update(
+            (product_id, timezone.localdate(created_at))
+            for product_id, created_at in OrderRequestItem.objects.filter(order_request__in=order_requests).values_list(
+                'variation__product_id', 'order_request__created_at')
+        )
+    by_day = defaultdict(set)
+    for product_id, day in pairs:
+        by_day[day].add(product_id)
+    for day, product_ids in by_day.items():
+        refresh(day, product_ids)
+
+
+def _totals(items, requests, key):
+    """Order-side figures of ``items`` and ``requests`` grouped by ``key``."""
+    totals = defaultdict(dict)
+    rows = items.order_by().values(key).annotate(
+        n_orders=Count('order', distinct=True),
+        n_units=Sum('quantity'),
+        paid=Sum(
+            Case(
+                When(order__status__in=PAID_STATUSES, then=F('price') * F('quantity')),
+                default=Value(0),
+                output_field=_REVENUE,
+            ),
+            output_field=_REVENUE,
+        ),
+    )
+    for row in rows:
+        totals[row[key]].update(orders=row['n_orders'], units=row['n_units'] or 0, revenue=row['paid'] or 0)
+    for row in requests.order_by().values(key).annotate(n=Count('order_request', distinct=True)):
+        totals[row[key]]['order_requests'] = row['n']
+    return totals
+
+
+def _write(model, field, day, totals, scope):
+    """Upsert ``totals`` for ``day`` and zero the rows in ``scope`` that no longer have any."""
+    upsert = {'update_conflicts': True, 'update_fields': ORDER_FIELDS}
+    if connection.features.supports_update_conflicts_with_target:
+        upsert['unique_fields'] = [field, 'date']
+    # else MySQL: ON DUPLICATE KEY UPDATE hits (field, date), the only unique key
+    model.objects.bulk_create(
+        [model(date=day, **{f'{field}_id': key}, **values) for key, values in totals.items()],
+        **upsert,
+    )
+    stale = scope.filter(date=day).exclude(**{f'{field}__in': list(totals)})
+    stale.filter(cart_adds=0).delete()
+    stale.update(orders=0, units=0, revenue=0, order_requests=0)
+
+
+def refresh(day, product_ids):
+    """Recompute ``day`` for ``product_ids``, their variations and their businesses."""
+    start, end = _day_bounds(day)
+    items = OrderItem.objects.filter(
+        order__created_at__gte=start, order__created_at__lt=end
+    ).exclude(order__status__in=UNCOUNTED_STATUSES)
+    requests = OrderRequestItem.objects.filter(
+        order_request__created_at__gte=start, order_request__created_at__lt=end
+    )
+    product_ids = list(product_ids)
+    business_ids = list(
+        Product.objects.filter(pk__in=product_ids, business__isnull=False).values_list('business_id', flat=True).distinct()
+    )
+    by_product = Q(variation__product__in=product_ids)
+    by_business = Q(variation__product__business__in=business_ids)
+
+    with transaction.atomic():
+        _write(
+            VariationDailySales, 'variation', day,
+            _totals(items.filter(by_product), requests.filter(by_product), 'variation'),
+            VariationDailySales.objects.filter(variation__product__in=product_ids),
+        )
+        _write(
+            ProductDailySales, 'product', day,
+            _totals(items.filter(by_product), requests.filter(by_product), 'variation__product'),
+            ProductDailySales.objects.filter(product__in=product_ids),
+        )
+        if business_ids:
+            _write(
+                BusinessDailySales, 'business', day,
+                _totals(items.filter(by_business), requests.filter(by_business), 'variation__product__business'),
+                BusinessDailySales.objects.filter(business__in=business_ids),
+            )
+
+
+def _bump(model, field, key, day):
+    lookup = {field: key, 'date': day}
+    if model.objects.filter(**lookup).update(cart_adds=F('cart_adds') + 1):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(cart_adds=1, **{f'{field}_id': key, 'date': day})
+    except IntegrityError:
+        # Created concurrently
+        model.objects.filter(**lookup).update(cart_adds=F('cart_adds') + 1)
+
+
+def record_cart_add(variation_id, when=None):
+    """Count a new cart line for ``variation`` on today's (or ``when``'s) rows."""
+    row = ProductVariation.objects.filter(pk=variation_id).values_list('product_id', 'product__business_id').first()
+    if row is None:
+        return
+    day = timezone.localdate(when)
+    product_id, business_id = row
+    _bump(VariationDailySales, 'variation', variation_id, day)
+    _bump(ProductDailySales, 'product', product_id, day)
+    if business_id:
+        _bump(BusinessDailySales, 'business', business_id, day)
+
+
+def backfill(since=None):
+    """Recompute the order-side figures of every day with activity; returns the days refreshed."""
+    orders = Order.objects.all()
+    order_requests = OrderRequest.objects.all()
+    rollups = ProductDailySales.objects.exclude(orders=0, order_requests=0)
+    if since is not None:
+        orders = orders.filter(created_at__gte=_day_bounds(since)[0])
+        order_requests = order_requests.filter(created_at__gte=_day_bounds(since)[0])
+        rollups = rollups.filter(date__gte=since)
+    days = set(orders.dates('created_at', 'day')) | set(order_requests.dates('created_at', 'day'))
+    days.update(rollups.order_by().values_list('date', flat=True).distinct())
+
+    for day in sorted(days):
+        start, end = _day_bounds(day)
+        product_ids = set(
+            OrderItem.objects.filter(order__created_at__gte=start, order__created_at__lt=end)
+            .values_list('variation__product_id', flat=True).distinct()
+        )
+        product_ids.update(
+            OrderRequestItem.objects.filter(order_request__created_at__gte=start, order_request__created_at__lt=end)
+            .values_list('variation__product_id', flat=True).distinct()
+        )
+        product_ids.update(
+            ProductDailySales.objects.filter(date=day).values_list('product_id', flat=True)
+        )
+        if product_ids:
+            refresh(day, product_ids)
+            logger.info("Refreshed sales rollups of %s products for %s", len(product_ids), day)
+    return len(days)
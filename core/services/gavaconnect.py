@@ -1,13 +1,33 @@
 import base64
-from typing import Tuple, Dict, Any
+import csv
+import io
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Tuple, Dict, Any, Iterable, Iterator, List
 from django.conf import settings
+from django.core.cache import cache
 import requests, os
 
+from ..log import lazy
+
+logger = logging.getLogger(__name__)
+
 
 class GavaConnectError(Exception):
     pass
 
 
+class GavaTokenRejected(GavaConnectError):
+    """The API rejected the bearer token (HTTP 401)."""
+    pass
+
+
+# Taxpayer type used when a bulk CSV row only carries an ID
+DEFAULT_TAXPAYER_TYPE = "KE"
+
+
 def _build_basic_auth_header(client_key: str, client_secret: str) -> str:
     token = f"{client_key}:{client_secret}".encode("utf-8")
     b64 = base64.b64encode(token).decode("ascii")
@@ -40,8 +60,7 @@ def get_access_token() -> Tuple[str, int]:
         expires_in = int(data.get("expires_in") or 0)
         if not access_token:
             raise GavaConnectError("Token response missing access_token")
-        # Debug: log access token and expiry
-        print(f"[Gava TOKEN] access_token={access_token!r} expires_in={expires_in}")
+        logger.debug("[Gava TOKEN] fetched, expires_in=%s", expires_in)
         return access_token, expires_in
     except requests.RequestException as e:
         # Try to surface server message
@@ -49,7 +68,8 @@ def get_access_token() -> Tuple[str, int]:
         raise GavaConnectError(f"Token request failed: {msg}")
 
 
-def _pin_check_request(access_token: str, taxpayer_type: str, taxpayer_id: str) -> Dict[str, Any]:
+def _pin_check_request(access_token: str, taxpayer_type: str, taxpayer_id: str) -> Tuple[Dict[str, Any], int]:
+    """POST one PIN check; returns (response JSON, HTTP status)."""
     base_url = getattr(settings, "GAVA_BASE_URL", "https://sbx.kra.go.ke")
     url = f"{base_url}/checker/v1/pin"
     headers = {
@@ -65,30 +85,171 @@ def _pin_check_request(access_token: str, taxpayer_type: str, taxpayer_id: str)
         "TaxpayerID": tid,
     }
     try:
-        # Debug: log request payload
-        print(f"[Gava PIN REQ] url={url} json_body={json_body}")
+        logger.debug("[Gava PIN REQ] url=%s json_body=%s", url, json_body)
         r = requests.post(url, json=json_body, headers=headers, timeout=20)
-        # Debug: log upstream response
-        try:
-            print(f"[Gava PIN RESP] status={r.status_code} body={r.text!r}")
-        except Exception:
-            pass
+        logger.debug("[Gava PIN RESP] status=%s body=%r", r.status_code, lazy(lambda: r.text))
+        if r.status_code == 401:
+            raise GavaTokenRejected(f"PIN check unauthorized: {r.text}")
         # If the API returns an error body with 4xx, return JSON for caller to handle
         if r.status_code >= 400:
             try:
-                return r.json()
+                return r.json(), r.status_code
             except ValueError:
                 raise GavaConnectError(f"PIN check failed {r.status_code}: {r.text}")
-        return r.json()
+        return r.json(), r.status_code
     except requests.RequestException as e:
         msg = getattr(e.response, 'text', str(e)) if hasattr(e, 'response') and e.response is not None else str(e)
         raise GavaConnectError(f"PIN check error: {msg}")
 
 
+# ==============================
+# Token and result caching, rate limiting
+# ==============================
+_token_lock = threading.Lock()
+_cached_token: Dict[str, Any] = {"access_token": None, "expires_at": 0.0}
+
+
+def get_cached_access_token(force_refresh: bool = False) -> str:
+    """Return a process-wide access token, generating one only when it is
+    missing or within a minute of expiry."""
+    with _token_lock:
+        if not force_refresh and _cached_token["access_token"] and time.monotonic() < _cached_token["expires_at"]:
+            return _cached_token["access_token"]
+        access_token, expires_in = get_access_token()
+        _cached_token["access_token"] = access_token
+        _cached_token["expires_at"] = time.monotonic() + max(0, (expires_in or 0) - 60)
+        return access_token
+
+
+class RateLimiter:
+    """Token bucket shared by all threads: at most ``rate`` acquisitions per
+    second on average, with bursts of up to ``burst``."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if not self.rate or self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+_kra_rate_limiter = RateLimiter(getattr(settings, "GAVA_RATE_LIMIT_PER_SECOND", 5))
+
+
+def _pin_cache_key(taxpayer_type: str, taxpayer_id: str) -> str:
+    return f"gava:pin:{(taxpayer_type or '').strip().upper()}:{(taxpayer_id or '').strip().upper()}"
+
+
+def _is_error_response(data: Any) -> bool:
+    return isinstance(data, dict) and ("ErrorCode" in data or "errorCode" in data)
+
+
+def check_pin_cached(taxpayer_type: str, taxpayer_id: str, use_cache: bool = True) -> Tuple[Dict[str, Any], bool]:
+    """Check a PIN, serving repeat lookups from the cache.
+
+    Returns (response JSON, served_from_cache). Successful lookups are kept for
+    GAVA_PIN_CACHE_TTL seconds and error responses about the PIN for
+    GAVA_PIN_NEGATIVE_CACHE_TTL. Throttling (429) and server errors (5xx) say
+    nothing about the PIN and are not cached; transport failures raise.
+    """
+    key = _pin_cache_key(taxpayer_type, taxpayer_id)
+    if use_cache:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached, True
+
+    _kra_rate_limiter.acquire()
+    try:
+        data, status = _pin_check_request(get_cached_access_token(), taxpayer_type, taxpayer_id)
+    except GavaTokenRejected:
+        # Token revoked or expired early; fetch a fresh one and retry once
+        _kra_rate_limiter.acquire()
+        data, status = _pin_check_request(get_cached_access_token(force_refresh=True), taxpayer_type, taxpayer_id)
+
+    if status == 429 or status >= 500:
+        ttl = 0
+    elif _is_error_response(data):
+        ttl = getattr(settings, "GAVA_PIN_NEGATIVE_CACHE_TTL", 600)
+    else:
+        ttl = getattr(settings, "GAVA_PIN_CACHE_TTL", 86400)
+    if ttl:
+        cache.set(key, data, ttl)
+    return data, False
+
+
 def check_pin(taxpayer_type: str, taxpayer_id: str) -> Dict[str, Any]:
-    """Full flow: generate token then check PIN; returns response JSON."""
-    access_token, _ = get_access_token()
-    return _pin_check_request(access_token, taxpayer_type, taxpayer_id)
+    """Full flow: (cached) token then (cached) PIN check; returns response JSON."""
+    data, _ = check_pin_cached(taxpayer_type, taxpayer_id)
+    return data
+
+
+# ==============================
+# Bulk verification
+# ==============================
+def parse_pin_csv(text: str) -> List[Tuple[str, str]]:
+    """Parse (TaxpayerType, TaxpayerID) pairs from CSV text.
+
+    Accepts a header row naming TaxpayerType/TaxpayerID columns, or headerless
+    rows of ``type,id`` or just ``id`` (taxpayer type defaults to KE).
+    """
+    rows = [row for row in csv.reader(io.StringIO(text)) if any(cell.strip() for cell in row)]
+    if not rows:
+        return []
+
+    header = [cell.strip().lower() for cell in rows[0]]
+    if "taxpayerid" in header:
+        id_col = header.index("taxpayerid")
+        type_col = header.index("taxpayertype") if "taxpayertype" in header else None
+        rows = rows[1:]
+    else:
+        id_col, type_col = (1, 0) if len(rows[0]) > 1 else (0, None)
+
+    pairs = []
+    for row in rows:
+        if id_col >= len(row) or not row[id_col].strip():
+            continue
+        ttype = row[type_col].strip() if type_col is not None and type_col < len(row) else ""
+        pairs.append(((ttype or DEFAULT_TAXPAYER_TYPE).upper(), row[id_col].strip()))
+    return pairs
+
+
+def check_pins(pairs: Iterable[Tuple[str, str]], concurrency: int = 4, use_cache: bool = True) -> Iterator[Dict[str, Any]]:
+    """Verify many PINs with a bounded thread pool, yielding one result per
+    pair as soon as it completes (not in input order).
+
+    Each result is {"index", "TaxpayerType", "TaxpayerID", "ok", "cached",
+    "response" | "error"}. Upstream calls are throttled by the shared
+    rate limiter regardless of ``concurrency``.
+    """
+    pairs = list(pairs)
+
+    def _one(index: int, ttype: str, tid: str) -> Dict[str, Any]:
+        result = {"index": index, "TaxpayerType": ttype, "TaxpayerID": tid}
+        try:
+            data, cached = check_pin_cached(ttype, tid, use_cache=use_cache)
+            result.update(ok=not _is_error_response(data), cached=cached, response=data)
+        except GavaConnectError as e:
+            result.update(ok=False, cached=False, error=str(e))
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = [pool.submit(_one, i, ttype, tid) for i, (ttype, tid) in enumerate(pairs)]
+        for future in as_completed(futures):
+            yield future.result()
 
 
 def pin_check_by_id(taxpayer_type: str, taxpayer_id: str) -> Dict[str, Any]:
@@ -112,12 +273,9 @@ def _pending_returns_request(access_token: str, tax_payer_pin: str, obligation_i
         "obligationId": str(obligation_id).strip(),
     }
     try:
-        print(f"[Gava PENDING REQ] url={url} json_body={json_body}")
+        logger.debug("[Gava PENDING REQ] url=%s json_body=%s", url, json_body)
         r = requests.post(url, json=json_body, headers=headers, timeout=20)
-        try:
-            print(f"[Gava PENDING RESP] status={r.status_code} body={r.text!r}")
-        except Exception:
-            pass
+        logger.debug("[Gava PENDING RESP] status=%s body=%r", r.status_code, lazy(lambda: r.text))
         if r.status_code >= 400:
             try:
                 return r.json()
@@ -130,6 +288,6 @@ def _pending_returns_request(access_token: str, tax_payer_pin: str, obligation_i
 
 
 def pending_returns(tax_payer_pin: str, obligation_id: str) -> Dict[str, Any]:
-    """Full flow: token then Pending Returns API."""
-    access_token, _ = get_access_token()
+    """Full flow: (cached) token then Pending Returns API."""
+    access_token = get_cached_access_token()
     return _pending_returns_request(access_token, tax_payer_pin, obligation_id)
@@ -0,0 +1,155 @@
+"""
+Signal receivers that keep core's caches in step with the catalog, index and
+publish new buyer-seller chat messages, and keep the daily sales rollups
+current.
+
+Connected from ``CoreConfig.ready``. Invalidation runs after the surrounding
+transaction commits so a concurrent chat turn cannot re-cache the old
+catalog version in between.
+"""
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from home.models import (
+    AgentAIKnowledgeBase, BuyerSellerMessage, Business, CartItem, Order, OrderItem, OrderRequest,
+    OrderRequestItem, PriceTier, Product, ProductCategory, ProductImage, ProductKB, ProductVariation,
+)
+
+from . import kb_index, message_search, sales_rollup
+from .notifications import buyer_seller_chat_channel, publish_on_commit
+from .chat_utils import _variation_product_key, invalidate_chat_context
+
+
+def _invalidate(*product_ids):
+    product_ids = {pid for pid in product_ids if pid}
+    if product_ids:
+        transaction.on_commit(lambda: [invalidate_chat_context(pid) for pid in product_ids])
+
+
+def _rebuild_kb_index(scope, object_id):
+    if object_id:
+        transaction.on_commit(lambda: kb_index.rebuild_index(scope, object_id))
+
+
+def _variation_product_id(variation_id):
+    if not variation_id:
+        return None
+    return ProductVariation.objects.filter(pk=variation_id).values_list('product_id', flat=True).first()
+
+
+@receiver([post_save, post_delete], sender=Product)
+def product_changed(sender, instance, **kwargs):
+    _invalidate(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=ProductVariation)
+def variation_changed(sender, instance, **kwargs):
+    cache.delete(_variation_product_key(instance.pk))
+    _invalidate(instance.product_id)
+
+
+@receiver([post_save, post_delete], sender=PriceTier)
+def price_tier_changed(sender, instance, **kwargs):
+    _invalidate(_variation_product_id(instance.variation_id))
+
+
+@receiver(pre_delete, sender=ProductKB)
+@receiver(pre_delete, sender=ProductImage)
+def product_attachment_deleting(sender, instance, **kwargs):
+    # When the variation is deleted too (cascade) it is gone by post_delete
+    instance._product_id = instance.product_id or _variation_product_id(instance.variation_id)
+
+
+@receiver([post_save, post_delete], sender=ProductKB)
+@receiver([post_save, post_delete], sender=ProductImage)
+def product_attachment_changed(sender, instance, **kwargs):
+    product_id = (
+        getattr(instance, '_product_id', None) or instance.product_id or _variation_product_id(instance.variation_id)
+    )
+    _invalidate(product_id)
+    if sender is ProductKB:
+        _rebuild_kb_index('product', product_id)
+
+
+@receiver([post_save, post_delete], sender=AgentAIKnowledgeBase)
+def agent_kb_changed(sender, instance, **kwargs):
+    _rebuild_kb_index('agent', instance.agent_id)
+
+
+@receiver(post_save, sender=BuyerSellerMessage)
+def buyer_seller_message_saved(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        message_search.index_message(instance)
+        publish_on_commit(buyer_seller_chat_channel(instance.chat_id))
+    elif update_fields is None or 'message' in update_fields:
+        message_search.index_message(instance, replace=True)
+
+
+@receiver(post_save, sender=Order)
+def order_saved(sender, instance, **kwargs):
+    # Also reached by payments, which move the order to paid or cancelled
+    sales_rollup.mark_order(instance.pk)
+
+
+@receiver(post_save, sender=OrderItem)
+def order_item_saved(sender, instance, **kwargs):
+    sales_rollup.mark_order(instance.order_id)
+
+
+@receiver(post_save, sender=OrderRequest)
+def order_request_saved(sender, instance, **kwargs):
+    sales_rollup.mark_order_request(instance.pk)
+
+
+@receiver(post_save, sender=OrderRequestItem)
+def order_request_item_saved(sender, instance, **kwargs):
+    sales_rollup.mark_order_request(instance.order_request_id)
+
+
+@receiver(pre_delete, sender=OrderItem)
+def order_item_deleted(sender, instance, **kwargs):
+    # Resolved now: the order may be gone by the time the rollup refreshes
+    row = OrderItem.objects.filter(pk=instance.pk).values_list('variation__product_id', 'order__created_at').first()
+    if row:
+        sales_rollup.mark(*row)
+
+
+@receiver(pre_delete, sender=OrderRequestItem)
+def order_request_item_deleted(sender, instance, **kwargs):
+    row = OrderRequestItem.objects.filter(pk=instance.pk).values_list(
+        'variation__product_id', 'order_request__created_at').first()
+    if row:
+        sales_rollup.mark(*row)
+
+
+@receiver(post_save, sender=CartItem)
+def cart_item_saved(sender, instance, created, **kwargs):
+    if created and instance.variation_id:
+        variation_id = instance.variation_id
+        transaction.on_commit(lambda: sales_rollup.record_cart_add(variation_id), robust=True)
+
+
+@receiver(post_save, sender=ProductCategory)
+def category_changed(sender, instance, **kwargs):
+    _invalidate(*instance.products.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Business)
+def business_changed(sender, instance, **kwargs):
+    _invalidate(*instance.products.values_list('pk', flat=True))
+
+
+@receiver(m2m_changed, sender=Product.categories.through)
+def product_categories_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            _invalidate(instance.pk)
+    elif action == 'pre_clear':
+        # Capture the products before the through rows are gone
+        instance._cleared_product_ids = list(instance.products.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        _invalidate(*getattr(instance, '_cleared_product_ids', []))
+    elif action in ('post_add', 'post_remove'):
+        _invalidate(*(pk_set or ()))
@@ -1,3 +1,468 @@
-from django.test import TestCase
+import json
+import socket
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from openai import OpenAI
+
+from home.models import (
+    Business, BusinessDailySales, MpesaCallback, Order, OrderItem, PaymentJob, PaymentRequest, Product,
+    ProductDailySales, ProductVariation,
+)
+
+from . import (
+    answer_cache, chat_utils, daraja_simulator, llm_gate, metrics, openai_stub, payment_jobs, payment_reconciler,
+)
+from .mpesa_callbacks import NO_PAYMENT_REQUEST, ingest_callback, process_callback, process_callbacks, replay_callbacks
+from .mpesa_service import MPesaService
+
+SNAPSHOT = {'product_id': 1, 'variation_id': None, 'version': 1}
+
+
+def _key(question):
+    return answer_cache._answer_key(SNAPSHOT, answer_cache.normalize_question(question))
+
+
+class NormalizeQuestionTests(SimpleTestCase):
+    def test_question_words_give_distinct_keys(self):
+        questions = [
+            'When will it ship?',
+            'Where will it ship?',
+            'How will it ship?',
+            'Why will it ship?',
+            'What will it ship?',
+            'Which will it ship?',
+        ]
+        self.assertEqual(len({_key(q) for q in questions}), len(questions))
+
+    def test_direction_words_give_distinct_keys(self):
+        self.assertNotEqual(_key('Can you ship to Mombasa?'), _key('Can you ship from Mombasa?'))
+
+    def test_equivalent_questions_share_a_key(self):
+        self.assertEqual(_key('What is the price for 1,000 units?'), _key('what the price for 1k unit'))
+        self.assertEqual(_key('How many boxes per carton'), _key('how many box per carton please'))
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    METRICS_CACHE='default',
+    CHAT_ANSWER_CACHE_TTL=60,
+    CHAT_ANSWER_SIMILARITY=0.1,
+)
+class AnswerCacheTests(SimpleTestCase):
+    def test_similar_lookup_keeps_question_words(self):
+        answer_cache.store(SNAPSHOT, 'When does the order ship to Nairobi?', 'Within two days.')
+        self.assertEqual(answer_cache.lookup(SNAPSHOT, 'when does order ship to Nairobi'), 'Within two days.')
+        self.assertIsNone(answer_cache.lookup(SNAPSHOT, 'Where does the order ship to Nairobi?'))
+        self.assertIsNone(answer_cache.lookup(SNAPSHOT, 'When does the order ship from Nairobi?'))
+
+
+class AnswerCacheStatsCommandTests(SimpleTestCase):
+    def _run(self):
+        out, err = StringIO(), StringIO()
+        call_command('chat_answer_cache_stats', stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    @override_settings(
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        METRICS_CACHE='default',
+    )
+    def test_warns_about_a_process_local_cache(self):
+        out, err = self._run()
+        self.assertIn("Counters from the 'default' cache", out)
+        self.assertIn('process-local', err)
+
+    def test_reads_counters_written_to_the_shared_cache(self):
+        with tempfile.TemporaryDirectory() as location, override_settings(
+            CACHES={
+                'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                'shared': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location},
+            },
+            METRICS_CACHE='shared',
+        ):
+            metrics.incr('chat.answer_cache.hit', 3)
+            metrics.incr('chat.answer_cache.miss')
+            out, err = self._run()
+        self.assertEqual(err, '')
+        self.assertIn('Exact hits:   3', out)
+        self.assertIn('Hit rate:     75.0%', out)
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    CHAT_RATE_LIMIT_CACHE='default',
+    METRICS_CACHE='default',
+    CHAT_RATE_LIMIT_BURST=2,
+    CHAT_USER_RATE_PER_MINUTE=20,
+    CHAT_IP_RATE_PER_MINUTE=10,
+)
+class RateLimitTests(SimpleTestCase):
+    def _request(self, ip, user_id=None):
+        request = RequestFactory().post('/core/api/chat/', REMOTE_ADDR=ip)
+        request.user = SimpleNamespace(is_authenticated=user_id is not None, pk=user_id)
+        return request
+
+    def test_burst_then_throttled(self):
+        results = [llm_gate.allow_request(self._request('10.0.0.1')) for _ in range(3)]
+        self.assertEqual([allowed for allowed, _ in results], [True, True, False])
+        self.assertGreater(results[-1][1], 0)
+
+    def test_signed_in_users_share_the_ip_limit(self):
+        # Different users behind one address still count against that address
+        results = [llm_gate.allow_request(self._request('10.0.0.2', user_id=n))[0] for n in range(3)]
+        self.assertEqual(results, [True, True, False])
+
+    def test_user_limit_follows_the_user_across_addresses(self):
+        results = [llm_gate.allow_request(self._request(f'10.0.1.{n}', user_id=7))[0] for n in range(3)]
+        self.assertEqual(results, [True, True, False])
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    CHAT_RATE_LIMIT_CACHE='default',
+    METRICS_CACHE='default',
+)
+class ChatApiAsyncErrorTests(SimpleTestCase):
+    snapshot = dict(SNAPSHOT, product_name='Rice', variation_name=None)
+
+    async def _post(self):
+        with mock.patch('core.chat_views.aget_chat_context', mock.AsyncMock(return_value=self.snapshot)):
+            return await self.async_client.post(
+                reverse('core:chat_api_async'),
+                json.dumps({'message': 'Is it in stock?', 'product_id': 1}),
+                content_type='application/json',
+            )
+
+    async def test_answer_cache_failure_returns_json_error(self):
+        with mock.patch('core.chat_views.answer_cache.lookup', side_effect=RuntimeError('cache down')):
+            response = await self._post()
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.json()['type'], 'RuntimeError')
+
+    async def test_prompt_failure_returns_json_error(self):
+        with mock.patch('core.chat_views.build_system_prompt', side_effect=ValueError('bad template')):
+            response = await self._post()
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.json()['error'], 'An error occurred while processing your request')
+
+
+# Keeps counters, notifications and rate limits out of the on-disk caches
+local_caches = override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    METRICS_CACHE='default',
+    NOTIFICATIONS_CACHE='default',
+    CHAT_RATE_LIMIT_CACHE='default',
+)
+
+mpesa_credentials = override_settings(
+    MPESA_CONSUMER_KEY='test-key',
+    MPESA_CONSUMER_SECRET='test-secret',
+    MPESA_BUSINESS_SHORTCODE='174379',
+    MPESA_PASSKEY='test-passkey',
+    MPESA_CALLBACK_URL='https://shop.example.com/api/mpesa-callback/',
+)
+
+PHONE = '254712345678'
+CALLBACK_URL = 'https://shop.example.com/api/mpesa-callback/'
+
+
+def _serve(test, server):
+    """Run a stand-in server for the rest of ``test``; returns its base URL."""
+    threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+    test.addCleanup(server.server_close)
+    test.addCleanup(server.shutdown)
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def _closed_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _stk_callback(checkout_request_id, amount=100, phone=PHONE, receipt='SIM0001', result_code=0):
+    """A Daraja STK callback body as the simulator sends it."""
+    stk_callback = {
+        'MerchantRequestID': f'm-{checkout_request_id}',
+        'CheckoutRequestID': checkout_request_id,
+        'ResultCode': result_code,
+        'ResultDesc': daraja_simulator.RESULT_DESCRIPTIONS[result_code],
+    }
+    if result_code == 0:
+        stk_callback['CallbackMetadata'] = {'Item': [
+            {'Name': 'Amount', 'Value': amount},
+            {'Name': 'MpesaReceiptNumber', 'Value': receipt},
+            {'Name': 'TransactionDate', 'Value': 20250101120000},
+            {'Name': 'PhoneNumber', 'Value': int(phone)},
+        ]}
+    return {'Body': {'stkCallback': stk_callback}}
+
+
+class DarajaTestCase(TestCase):
+    """Runs an in-process Daraja simulator that decides at once and never calls back."""
+
+    def setUp(self):
+        server, self.simulator = daraja_simulator.make_server(config=daraja_simulator.SimulatorConfig(
+            callback_delay=0, success_rate=1.0, callback_drop_rate=1.0, seed=1,
+        ))
+        self.mpesa = MPesaService(base_url=_serve(self, server))
+
+    def push(self, amount=100):
+        """Send an STK push and wait for the simulated customer to act on it."""
+        checkout_request_id = self.mpesa.initiate_stk_push(PHONE, amount, 'TEST', callback_url=CALLBACK_URL)['CheckoutRequestID']
+        deadline = time.monotonic() + 5
+        while self.simulator.stk_requests[checkout_request_id]['result_code'] is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return checkout_request_id
+
+
+@local_caches
+@mpesa_credentials
+class PaymentWorkerTests(DarajaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.payment_request = PaymentRequest.objects.create(amount=100, phone_number=PHONE, status='queued')
+        self.job = payment_jobs.enqueue_stk_push(self.payment_request, callback_url=CALLBACK_URL)
+
+    def test_push_is_sent(self):
+        self.assertEqual(payment_jobs.run_worker(once=True, mpesa=self.mpesa), 1)
+        self.payment_request.refresh_from_db()
+        self.assertEqual(self.payment_request.status, 'pending')
+        self.assertIn(self.payment_request.checkout_request_id, self.simulator.stk_requests)
+        self.assertEqual(PaymentJob.objects.get().status, 'succeeded')
+
+    def test_job_is_claimed_by_one_worker(self):
+        self.assertEqual([job.pk for job in payment_jobs.claim_jobs('worker-a')], [self.job.pk])
+        self.assertEqual(payment_jobs.claim_jobs('worker-b'), [])
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.status, self.job.locked_by, self.job.attempts), ('running', 'worker-a', 1))
+
+    def test_push_that_never_reached_daraja_is_retried(self):
+        offline = MPesaService(base_url=f"http://127.0.0.1:{_closed_port()}")
+        payment_jobs.run_worker(once=True, mpesa=offline)
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.status, self.job.attempts), ('queued', 1))
+        self.assertGreater(self.job.available_at, timezone.now())
+        self.assertEqual(payment_jobs.claim_jobs('worker-a'), [])
+
+        PaymentJob.objects.filter(pk=self.job.pk).update(available_at=timezone.now())
+        payment_jobs.run_worker(once=True, mpesa=self.mpesa)
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.status, self.job.attempts), ('succeeded', 2))
+
+    def test_ambiguous_failure_is_left_unconfirmed(self):
+        self.mpesa.generate_access_token()
+        # Daraja answers the push itself with a 503: it may have prompted the customer
+        self.simulator.config.failure_rate = 1.0
+        payment_jobs.run_worker(once=True, mpesa=self.mpesa)
+        self.payment_request.refresh_from_db()
+        self.assertEqual((self.payment_request.status, self.payment_request.error_code), ('pending', payment_jobs.UNCONFIRMED))
+        self.assertIsNone(self.payment_request.checkout_request_id)
+        self.assertEqual(PaymentJob.objects.get().status, 'failed')
+        self.assertEqual(self.simulator.stats['stk_push'], 1)
+
+
+@local_caches
+class CallbackInboxTests(TestCase):
+    def test_duplicate_delivery_is_stored_once(self):
+        body = json.dumps(_stk_callback('ws_CO_1'))
+        inbox, created = ingest_callback(body)
+        self.assertTrue(created)
+        self.assertEqual(ingest_callback(body), (None, False))
+        inbox.refresh_from_db()
+        self.assertEqual(inbox.duplicate_count, 1)
+        self.assertEqual(MpesaCallback.objects.count(), 1)
+
+    def test_callback_is_applied_once(self):
+        order = Order.objects.create(total=100)
+        payment_request = PaymentRequest.objects.create(
+            amount=100, phone_number=PHONE, status='pending', checkout_request_id='ws_CO_1', order=order,
+        )
+        inbox, _ = ingest_callback(json.dumps(_stk_callback('ws_CO_1')))
+        self.assertEqual(process_callbacks(), 1)
+        payment_request.refresh_from_db()
+        self.assertEqual((payment_request.status, payment_request.mpesa_receipt_number), ('completed', 'SIM0001'))
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'paid')
+
+        with mock.patch('core.mpesa_callbacks.apply_payment_callback') as apply:
+            process_callback(inbox.pk)
+            replay_callbacks(MpesaCallback.objects.all())
+        apply.assert_not_called()
+        self.assertEqual(process_callbacks(), 0)
+
+    def test_callback_without_payment_request_is_orphaned(self):
+        inbox, _ = ingest_callback(json.dumps(_stk_callback('ws_CO_unknown')))
+        process_callbacks()
+        inbox.refresh_from_db()
+        self.assertEqual((inbox.status, inbox.last_error), ('orphaned', NO_PAYMENT_REQUEST))
+
+
+@local_caches
+@mpesa_credentials
+class ReconcilerTests(DarajaTestCase):
+    def _unconfirmed(self, amount=100):
+        return PaymentRequest.objects.create(
+            amount=amount, phone_number='0712345678', status='pending', error_code=payment_jobs.UNCONFIRMED,
+        )
+
+    def _orphan(self, checkout_request_id, amount=100):
+        return MpesaCallback.objects.create(
+            checkout_request_id=checkout_request_id, result_code=0, status='orphaned', last_error=NO_PAYMENT_REQUEST,
+            payload=_stk_callback(checkout_request_id, amount=amount),
+        )
+
+    def test_stale_payment_is_resolved_by_query(self):
+        payment_request = PaymentRequest.objects.create(
+            amount=100, phone_number=PHONE, status='pending', checkout_request_id=self.push(),
+        )
+        stats = payment_reconciler.reconcile_stale_payments(self.mpesa, stale_after=0)
+        self.assertEqual((stats['queried'], stats['resolved']), (1, 1))
+        payment_request.refresh_from_db()
+        self.assertEqual(payment_request.status, 'completed')
+
+    def test_query_for_an_unanswered_prompt_leaves_it_pending(self):
+        self.simulator.config.callback_delay = 60
+        checkout_request_id = self.mpesa.initiate_stk_push(PHONE, 100, 'TEST', callback_url=CALLBACK_URL)['CheckoutRequestID']
+        payment_request = PaymentRequest.objects.create(
+            amount=100, phone_number=PHONE, status='pending', checkout_request_id=checkout_request_id,
+        )
+        response = self.mpesa.query_stk_status(checkout_request_id)
+        self.assertIn(response['error_code'], payment_reconciler.STILL_PROCESSING_ERROR_CODES)
+        self.assertIsNone(payment_reconciler.apply_query_result(payment_request.id, response))
+        payment_request.refresh_from_db()
+        self.assertEqual(payment_request.status, 'pending')
+
+    def test_orphaned_callback_is_adopted(self):
+        payment_request = self._unconfirmed()
+        self._orphan('ws_CO_1')
+        self.assertEqual(payment_reconciler.resolve_unconfirmed(), (1, 0))
+        payment_request.refresh_from_db()
+        self.assertEqual(payment_request.checkout_request_id, 'ws_CO_1')
+        self.assertEqual(MpesaCallback.objects.get().status, 'received')
+
+        process_callbacks()
+        payment_request.refresh_from_db()
+        self.assertEqual(payment_request.status, 'completed')
+
+    def test_ambiguous_match_is_left_for_review(self):
+        first, second = self._unconfirmed(), self._unconfirmed()
+        self._orphan('ws_CO_1')
+        self.assertEqual(payment_reconciler.resolve_unconfirmed(give_up_after=0), (0, 0))
+        for payment_request in (first, second):
+            payment_request.refresh_from_db()
+            self.assertEqual(payment_request.error_code, payment_reconciler.AMBIGUOUS_MATCH)
+            self.assertEqual(payment_request.status, 'pending')
+        self.assertEqual(MpesaCallback.objects.get().status, 'orphaned')
+
+    def test_unmatched_push_times_out(self):
+        payment_request = self._unconfirmed()
+        self._orphan('ws_CO_other', amount=250)
+        self.assertEqual(payment_reconciler.resolve_unconfirmed(give_up_after=0), (0, 1))
+        payment_request.refresh_from_db()
+        self.assertEqual(payment_request.status, 'timeout')
+
+
+class RunReconcilerTests(SimpleTestCase):
+    def _stats(self, queried=0, errors=0):
+        return {'queried': queried, 'resolved': 0, 'still_pending': queried - errors, 'errors': errors,
+                'matched': 0, 'expired': 0}
+
+    def test_failed_batches_back_off(self):
+        passes = [RuntimeError('db down'), RuntimeError('db down'), self._stats(queried=3, errors=3), self._stats()]
+        delays = []
+
+        def sleep(seconds):
+            delays.append(seconds)
+            if len(delays) == len(passes):
+                raise KeyboardInterrupt
+
+        with mock.patch.object(payment_reconciler, 'reconcile_stale_payments', side_effect=passes), \
+                mock.patch.object(payment_reconciler.time, 'sleep', sleep), \
+                self.assertLogs('core.payment_reconciler', 'WARNING'), \
+                self.assertRaises(KeyboardInterrupt):
+            payment_reconciler.run_reconciler(mpesa=None, poll_interval=10)
+        # Doubled per failed batch in a row, back to the poll interval after a good one
+        self.assertEqual(delays, [20, 40, 80, 10])
+
+
+@local_caches
+class SalesRollupTests(TestCase):
+    def setUp(self):
+        vendor = get_user_model().objects.create_user(email='vendor@example.com')
+        self.business = Business.objects.create(owner=vendor, name='Wholesale Co')
+        self.product = Product.objects.create(name='Rice', business=self.business)
+        self.small = ProductVariation.objects.create(product=self.product, name='5kg', price=Decimal('2.00'))
+        self.large = ProductVariation.objects.create(product=self.product, name='25kg', price=Decimal('3.00'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order = Order.objects.create()
+            OrderItem(order=self.order, variation=self.small, quantity=4, price=Decimal('2.00')).save()
+            OrderItem(order=self.order, variation=self.large, quantity=1, price=Decimal('3.00')).save()
+
+    def _row(self, model=ProductDailySales, **owner):
+        owner = owner or {'product': self.product}
+        return model.objects.filter(**owner).values_list('orders', 'units', 'revenue').get()
+
+    def _set_status(self, status):
+        self.order.status = status
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order.save()
+
+    def test_orders_are_counted_when_placed(self):
+        self.assertEqual(self._row(), (1, 5, Decimal('0')))
+        self.assertEqual(self._row(BusinessDailySales, business=self.business), (1, 5, Decimal('0')))
+
+    def test_revenue_counts_once_paid(self):
+        self._set_status('paid')
+        self.assertEqual(self._row(), (1, 5, Decimal('11.00')))
+
+    def test_cancelled_orders_drop_out(self):
+        self._set_status('paid')
+        self._set_status('cancelled')
+        self.assertFalse(ProductDailySales.objects.filter(product=self.product).exists())
+
+    def test_backfill_rebuilds_the_same_figures(self):
+        self._set_status('paid')
+        expected = self._row()
+        ProductDailySales.objects.update(orders=99, units=99, revenue=99)
+        call_command('backfill_sales_rollups', stdout=StringIO())
+        self.assertEqual(self._row(), expected)
+
+
+@local_caches
+@override_settings(CHAT_ANSWER_CACHE_TTL=60)
+class ChatApiTests(TestCase):
+    def setUp(self):
+        server, self.stub = openai_stub.make_server(config=openai_stub.StubConfig(
+            first_token_ms=0, token_ms=0, reply='Ships within two days.',
+        ))
+        client = OpenAI(api_key='test', base_url=f"{_serve(self, server)}/v1")
+        patcher = mock.patch.object(chat_utils, 'client', client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.product = Product.objects.create(name='Rice', description='Long grain rice')
+
+    def _ask(self, question):
+        return self.client.post(
+            reverse('core:chat_api'),
+            json.dumps({'message': question, 'product_id': self.product.id}),
+            content_type='application/json',
+        )
+
+    def test_repeated_question_is_answered_from_the_cache(self):
+        for _ in range(2):
+            response = self._ask('When will it ship?')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()['response'], 'Ships within two days.')
+        self.assertEqual(self.stub.summary()['requests'], 1)
@@ -1,10 +1,14 @@
-from django.http import JsonResponse, HttpRequest
+from django.contrib.auth.decorators import login_required
+from django.http import JsonResponse, HttpRequest, StreamingHttpResponse
 from django.shortcuts import render
 from django.views.decorators.http import require_POST
 from django.views.decorators.csrf import csrf_exempt
 import json
+import logging
 from .services import gavaconnect
 
+logger = logging.getLogger(__name__)
+
 
 def health(request):
     """Basic health endpoint for the core app."""
@@ -30,7 +34,7 @@ def gava_pin_check(request: HttpRequest) -> JsonResponse:
         ttype = (payload.get('TaxpayerType') or '').strip()
         tid = (payload.get('TaxpayerID') or '').strip()
         # Debug print: show submitted values in server console
-        print(f"[Gava PIN API] Submitted TaxpayerType={ttype!r} TaxpayerID={tid!r}")
+        logger.debug("[Gava PIN API] Submitted TaxpayerType=%r TaxpayerID=%r", ttype, tid)
         if not ttype or not tid:
             return JsonResponse({
                 'error': 'Missing parameters',
@@ -73,7 +77,7 @@ def pin_check_form(request: HttpRequest):
             from .services.gavaconnect import check_pin
             for ttype_s, tid_s, label in samples:
                 try:
-                    print(f"[Gava PIN FORM][TESTALL] {label}: TaxpayerType={ttype_s!r} TaxpayerID={tid_s!r}")
+                    logger.debug("[Gava PIN FORM][TESTALL] %s: TaxpayerType=%r TaxpayerID=%r", label, ttype_s, tid_s)
                     data = check_pin(ttype_s, tid_s)
                     batch_results.append({
                         'label': label,
@@ -93,7 +97,7 @@ def pin_check_form(request: HttpRequest):
             ttype = (request.POST.get('TaxpayerType') or '').strip()
             tid = (request.POST.get('TaxpayerID') or '').strip()
             # Debug print: show submitted values in server console
-            print(f"[Gava PIN FORM] Submitted TaxpayerType={ttype!r} TaxpayerID={tid!r}")
+            logger.debug("[Gava PIN FORM] Submitted TaxpayerType=%r TaxpayerID=%r", ttype, tid)
             if not ttype or not tid:
                 context['error'] = 'TaxpayerType and TaxpayerID are required.'
             else:
@@ -127,7 +131,7 @@ def gava_pending_returns(request: HttpRequest) -> JsonResponse:
             }
         pin = (payload.get('taxPayerPin') or '').strip().upper()
         obl = str(payload.get('obligationId') or '').strip()
-        print(f"[Gava PENDING API] taxPayerPin={pin!r} obligationId={obl!r}")
+        logger.debug("[Gava PENDING API] taxPayerPin=%r obligationId=%r", pin, obl)
         if not pin or not obl:
             return JsonResponse({'error': 'Missing parameters', 'details': 'taxPayerPin and obligationId are required.'}, status=400)
         data = gavaconnect.pending_returns(pin, obl)
@@ -150,7 +154,7 @@ def pending_returns_form(request: HttpRequest):
     if request.method == 'POST':
         pin = (request.POST.get('taxPayerPin') or '').strip().upper()
         obl = str(request.POST.get('obligationId') or '').strip()
-        print(f"[Gava PENDING FORM] taxPayerPin={pin!r} obligationId={obl!r}")
+        logger.debug("[Gava PENDING FORM] taxPayerPin=%r obligationId=%r", pin, obl)
         if not pin or not obl:
             context['error'] = 'taxPayerPin and obligationId are required.'
         else:
@@ -180,3 +184,63 @@ def gava_token(request: HttpRequest) -> JsonResponse:
         return JsonResponse({'error': 'GavaConnectError', 'details': str(e)}, status=502)
     except Exception as e:
         return JsonResponse({'error': 'ServerError', 'details': str(e)}, status=500)
+
+
+# Bulk requests are capped so a single upload cannot tie up a worker for hours
+BULK_PIN_CHECK_MAX_ROWS = 2000
+BULK_PIN_CHECK_MAX_CONCURRENCY = 8
+
+
+@csrf_exempt  # Consider removing once called from your own frontend with CSRF token
+@login_required
+@require_POST
+def gava_pin_check_bulk(request: HttpRequest):
+    """Verify many PINs, streaming results as newline-delimited JSON.
+
+    Accepts a CSV upload (``file``), a CSV request body (text/csv) or a JSON
+    body ``{"pins": [{"TaxpayerType": "KE", "TaxpayerID": "..."}], "concurrency": 4}``.
+    Each output line is one result with running ``done``/``total`` counts; the
+    last line is a ``summary``.
+    """
+    try:
+        concurrency = 4
+        if request.content_type == 'application/json':
+            payload = json.loads(request.body.decode('utf-8'))
+            pairs = [
+                ((p.get('TaxpayerType') or gavaconnect.DEFAULT_TAXPAYER_TYPE).strip().upper(),
+                 (p.get('TaxpayerID') or '').strip())
+                for p in payload.get('pins', [])
+                if (p.get('TaxpayerID') or '').strip()
+            ]
+            concurrency = payload.get('concurrency', concurrency)
+        elif 'file' in request.FILES:
+            pairs = gavaconnect.parse_pin_csv(request.FILES['file'].read().decode('utf-8-sig'))
+            concurrency = request.POST.get('concurrency', concurrency)
+        else:
+            pairs = gavaconnect.parse_pin_csv(request.body.decode('utf-8-sig'))
+            concurrency = request.GET.get('concurrency', concurrency)
+        concurrency = max(1, min(int(concurrency), BULK_PIN_CHECK_MAX_CONCURRENCY))
+    except (ValueError, TypeError, AttributeError, UnicodeDecodeError) as e:
+        return JsonResponse({'error': 'Invalid request', 'details': str(e)}, status=400)
+
+    if not pairs:
+        return JsonResponse({'error': 'Missing parameters', 'details': 'No TaxpayerID values found.'}, status=400)
+    if len(pairs) > BULK_PIN_CHECK_MAX_ROWS:
+        return JsonResponse({
+            'error': 'Too many rows',
+            'details': f'At most {BULK_PIN_CHECK_MAX_ROWS} PINs per request; use manage.py verify_kra_pins for larger files.',
+        }, status=400)
+
+    def stream():
+        summary = {'total': len(pairs), 'ok': 0, 'failed': 0, 'cached': 0}
+        for done, result in enumerate(gavaconnect.check_pins(pairs, concurrency=concurrency), start=1):
+            summary['ok' if result['ok'] else 'failed'] += 1
+            summary['cached'] += int(result.get('cached', False))
+            result.update(done=done, total=len(pairs))
+            yield json.dumps(result) + '\n'
+        yield json.dumps({'summary': summary}) + '\n'
+
+    response = StreamingHttpResponse(stream(), content_type='application/x-ndjson')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -11,8 +11,8 @@ from .models import (
     ProductVariation,
     PriceTier,
     ProductOrder,
-    ProductAttribute,BuyerSellerMessage,
-    ProductAttributeValue,RawPayment,OrderAdditionalFees,PaymentRequest,
+    ProductAttribute,BuyerSellerMessage,ArchivedMessageBatch,BusinessDailySales,
+    ProductAttributeValue,RawPayment,OrderAdditionalFees,PaymentRequest,PaymentJob,MpesaCallback,MpesaPullCursor,
     ProductAttributeAssignment,PromiseFee,ProductKB, ServiceCategory,Agent, AgentImage, AgentReview, AgentAIKnowledgeBase, ExchangeRate, Order, OrderRequest,OrderRequestItem,AdditionalFees)
 admin.site.register(Order)
 admin.site.register(OrderRequest)
@@ -24,7 +24,12 @@ admin.site.register(ExchangeRate)
 admin.site.register(AdditionalFees)
 admin.site.register(RawPayment)
 admin.site.register(BuyerSellerMessage)
+admin.site.register(ArchivedMessageBatch)
+admin.site.register(BusinessDailySales)
 admin.site.register(PaymentRequest)
+admin.site.register(PaymentJob)
+admin.site.register(MpesaCallback)
+admin.site.register(MpesaPullCursor)
 class ProductVariationInline(admin.TabularInline):
     model = ProductVariation
     extra = 1
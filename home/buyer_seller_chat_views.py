@@ -1,20 +1,34 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse, HttpResponseForbidden
-from django.utils import timezone
-from django.db.models import Q, Max
+from django.http import HttpResponse, JsonResponse, HttpResponseForbidden, StreamingHttpResponse
+from django.db.models import Q, F, Max, Case, Count, IntegerField, OuterRef, Prefetch, Subquery, When
+from django.db.models.functions import Coalesce
 from django.contrib import messages
 from django.core.paginator import Paginator
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 from django.urls import reverse
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from asgiref.sync import sync_to_async
 import json
+import logging
+import time
 
 from django.contrib.auth import get_user_model
-from .models import Product, BuyerSellerChat, BuyerSellerMessage, Order, OrderItem, ProductVariation
+from core import chat_archive, message_search
+from core.log import lazy
+from core.notifications import (
+    acurrent_version, await_change, buyer_seller_chat_channel, current_version, wait_for_change,
+)
+from .models import Product, ProductImage, BuyerSellerChat, BuyerSellerMessage, Order, OrderItem, ProductVariation
 from .forms import BuyerSellerMessageForm
 
 User = get_user_model()
+logger = logging.getLogger(__name__)
+
+# Comment line sent on idle chat streams so proxies keep the connection open
+CHAT_STREAM_KEEPALIVE_SECONDS = 15
 
 
 @login_required
@@ -75,14 +89,10 @@ def start_chat(request, seller_id):
         chat.product = product
         chat.save(update_fields=['product'])
     
-    print(f"Debug - Product from URL: {request.GET.get('product_id')}")
-    print(f"Debug - Product from chat: {chat.product}")
-    print(f"Debug - Product variable: {product}")
+    logger.debug("start_chat: product from URL %s, chat %s product %s",
+                 request.GET.get('product_id'), chat.pk, product.pk if product else None)
     
-    if product:
-        print(f"Debug - Added product to context: {product.name} (ID: {product.id})")
-    else:
-        print("Debug - No product to add to context")
+    if not product:
         chat.save(update_fields=['product'])
     
     # Redirect to the chat page with the product_id in the URL
@@ -126,19 +136,13 @@ def buyer_seller_chat(request, chat_id):
         if not product and chat.product:
             product = chat.product
     
-    # Get messages for this chat (exclude messages with None sender)
-    messages_qs = chat.messages.select_related('sender').filter(sender__isnull=False).order_by('created_at')
-    
-    # Pagination for messages
-    paginator = Paginator(messages_qs, 50)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Render the latest page of messages (exclude messages with None sender);
+    # older ones load on scroll through get_messages?before_id=
+    chat_messages, has_older = _older_messages(chat, None, settings.CHAT_HISTORY_PAGE_SIZE)
     
     # Mark messages as read when user views the chat
-    if request.user == chat.buyer:
-        chat.messages.filter(sender=chat.seller, is_read=False).update(is_read=True)
-    elif request.user == chat.seller:
-        chat.messages.filter(sender=chat.buyer, is_read=False).update(is_read=True)
+    if request.user.pk in (chat.buyer_id, chat.seller_id):
+        chat.mark_read(request.user)
     
     # Handle message sending
     if request.method == 'POST':
@@ -150,12 +154,9 @@ def buyer_seller_chat(request, chat_id):
             # If we have a product in context, associate it with the message
             if product:
                 message.product = product
+            # Saving also bumps the chat's last_message and updated_at
             message.save()
             
-            # Update chat's updated_at timestamp
-            chat.updated_at = timezone.now()
-            chat.save(update_fields=['updated_at'])
-            
             # Redirect to the same page to avoid form resubmission
             return redirect('home:buyer_seller_chat', chat_id=chat.id)
     else:
@@ -190,23 +191,22 @@ def buyer_seller_chat(request, chat_id):
             # For products without variations, use the product's price
             min_price = max_price = product.price
     
-    # Debug prints
-    print(f"\n=== DEBUG - buyer_seller_chat ===")
-    print(f"Product from URL param: {request.GET.get('product_id')}")
-    print(f"Product from chat: {chat.product}")
-    print(f"Product variable: {product}")
-    print(f"Product ID in URL: {request.get_full_path()}")
-    if product:
-        print(f"Product name: {product.name}")
-        print(f"Product has images: {product.images.exists()}")
-        print(f"Min price: {min_price}, Max price: {max_price}, Variants: {variants_count}")
-        if product.images.exists():
-            print(f"First image URL: {product.images.first().image.url}")
+    # The image lookups below cost queries, so only run them when debugging
+    if product and logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "buyer_seller_chat %s: product %s (URL param %s), has images %s, "
+            "min price %s, max price %s, variants %s",
+            chat.pk, product.pk, request.GET.get('product_id'), lazy(product.images.exists),
+            min_price, max_price, variants_count,
+        )
     
     context = {
         'chat': chat,
         'other_user': other_user,
-        'messages': page_obj,
+        'messages': chat_messages,
+        'has_older': has_older,
+        'oldest_message_id': chat_messages[0].id if chat_messages else 0,
+        'last_message_id': chat_messages[-1].id if chat_messages else 0,
         'form': form,
         'is_buyer': is_buyer,
         'is_manager': is_manager,
@@ -215,6 +215,7 @@ def buyer_seller_chat(request, chat_id):
         'min_price': min_price,
         'max_price': max_price,
         'variants_count': variants_count,
+        'stream_messages': _serves_stream(request),
     }
     
     return render(request, 'home/buyer_seller_chat.html', context)
@@ -267,27 +268,39 @@ def create_order_from_chat(request, chat_id):
 @login_required
 def chat_list(request):
     """Display list of all chats for the current user"""
-    # Get all chats where user is either buyer or seller, and both users exist
+    # Get all chats where user is either buyer or seller, and both users exist.
+    # The preview comes from the denormalized last_message, and the unread
+    # count is a correlated id-range count above the user's read watermark,
+    # so only the 20 chats on the requested page are ever counted.
+    unread = BuyerSellerMessage.objects.filter(
+        chat=OuterRef('pk'),
+        id__gt=OuterRef('read_watermark')
+    ).exclude(sender=request.user).order_by().values('chat').annotate(n=Count('id')).values('n')
     chats = BuyerSellerChat.objects.filter(
         Q(buyer=request.user) | Q(seller=request.user),
         buyer__isnull=False,
         seller__isnull=False
-    ).select_related('buyer', 'seller', 'product').prefetch_related('messages').order_by('-updated_at')
-    
-    # Add unread count for each chat
-    for chat in chats:
-        if request.user == chat.buyer:
-            chat.unread_count = chat.messages.filter(sender=chat.seller, is_read=False).count()
-        else:
-            chat.unread_count = chat.messages.filter(sender=chat.buyer, is_read=False).count()
+    ).select_related('buyer', 'seller', 'product', 'last_message').annotate(
+        read_watermark=Case(
+            When(buyer=request.user, then=F('buyer_last_read_message_id')),
+            default=F('seller_last_read_message_id'),
+        )
+    ).annotate(
+        unread_count=Coalesce(Subquery(unread, output_field=IntegerField()), 0)
+    ).order_by('-updated_at', '-id')
     
     # Pagination
     paginator = Paginator(chats, 20)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
     
+    # Message search across the user's chats
+    query = request.GET.get('q', '').strip()
+    
     context = {
         'chats': page_obj,
+        'query': query,
+        'search_results': message_search.search(request.user, query) if query else None,
         'title': 'My Chats'
     }
     
@@ -333,10 +346,6 @@ def send_message(request, chat_id):
             product=product
         )
         
-        # Update chat's updated_at timestamp
-        chat.updated_at = timezone.now()
-        chat.save(update_fields=['updated_at'])
-        
         # Get sender display name
         if hasattr(message.sender, 'get_full_name') and message.sender.get_full_name():
             sender_name = message.sender.get_full_name()
@@ -362,61 +371,261 @@ def send_message(request, chat_id):
         return JsonResponse({'error': str(e)}, status=500)
 
 
+def _sender_name(sender):
+    """Display name for a message sender"""
+    if sender:
+        if hasattr(sender, 'get_full_name') and sender.get_full_name():
+            return sender.get_full_name()
+        elif sender.email:
+            return sender.email
+    return 'Unknown User'
+
+
+def _message_data(msg, user, sender_name=None):
+    """JSON payload for one chat message, as returned by get_messages"""
+    message_data = {
+        'id': msg.id,
+        'text': msg.message,
+        'sender': sender_name if sender_name is not None else _sender_name(msg.sender),
+        'created_at': msg.created_at.strftime('%b %d, %Y %I:%M %p'),
+        'is_own': msg.sender_id == user.pk
+    }
+    
+    # Add product data if exists
+    if msg.product:
+        # First product image, from the prefetched chat_images when available
+        images = getattr(msg.product, 'chat_images', None)
+        if images is None:
+            images = msg.product.images.order_by('id')[:1]
+        first_image = images[0] if images else None
+        
+        message_data['product'] = {
+            'id': msg.product.id,
+            'name': msg.product.name,
+            'price': str(msg.product.price) if hasattr(msg.product, 'price') else None,
+            'image_url': first_image.image.url if first_image and first_image.image else None
+        }
+    return message_data
+
+
+def _chat_messages(chat):
+    """The chat's messages with senders and product thumbnails loaded in constant queries"""
+    return chat.messages.filter(sender__isnull=False).select_related('sender', 'product').prefetch_related(
+        Prefetch('product__images', queryset=ProductImage.objects.order_by('id'), to_attr='chat_images')
+    )
+
+
+def _older_messages(chat, before_id, limit):
+    """
+    Up to ``limit`` messages before ``before_id`` (the newest when None),
+    oldest first, and whether older ones remain.
+
+    Keyset pagination newest-first over the (chat, created_at) index: the
+    cost depends on the page size, not on how long the thread is. Once the
+    hot table runs out the page continues from the cold archive.
+    """
+    messages = _chat_messages(chat).order_by('-created_at', '-id')
+    if before_id is not None:
+        anchor = chat.messages.filter(id=before_id).values_list('created_at', flat=True).first()
+        if anchor is None:
+            # Already scrolled past the hot window
+            return chat_archive.archived_messages(chat, before_id, limit)
+        messages = messages.filter(created_at__lte=anchor).exclude(created_at=anchor, id__gte=before_id)
+    messages = list(messages[:limit + 1])
+    if len(messages) > limit:
+        return messages[:limit][::-1], True
+    messages.reverse()
+    archived, has_more = chat_archive.archived_messages(
+        chat, messages[0].id if messages else before_id, limit - len(messages))
+    return archived + messages, has_more
+
+
+def _messages_data(messages, user):
+    """Payloads for ``messages``, calling get_full_name() once per participant"""
+    sender_names = {}
+    messages_data = []
+    for msg in messages:
+        if msg.sender_id not in sender_names:
+            sender_names[msg.sender_id] = _sender_name(msg.sender)
+        messages_data.append(_message_data(msg, user, sender_names[msg.sender_id]))
+    return messages_data
+
+
+def _new_messages_data(chat, last_message_id, user):
+    """
+    Payloads for up to CHAT_MESSAGES_PAGE_SIZE of the chat's messages after
+    ``last_message_id``, oldest first, and whether more are waiting.
+    """
+    limit = settings.CHAT_MESSAGES_PAGE_SIZE
+    messages = list(_chat_messages(chat).filter(id__gt=last_message_id).order_by('id')[:limit + 1])
+    return _messages_data(messages[:limit], user), len(messages) > limit
+
+
+def _cursor(messages_data, last_message_id):
+    """Id to pass back as ``last_message_id`` on the next fetch"""
+    return messages_data[-1]['id'] if messages_data else last_message_id
+
+
 @login_required
 def get_messages(request, chat_id):
-    """API endpoint to get new messages via AJAX"""
+    """API endpoint to get messages via AJAX
+    
+    ``?after_id=`` (or the older ``last_message_id``) returns new messages for
+    delta sync; ``?before_id=`` returns the page of history before that id
+    for infinite scroll. Both come back oldest first, with ``has_more`` set
+    when another page is waiting in that direction.
+    """
     chat = get_object_or_404(BuyerSellerChat, id=chat_id)
     
     # Check if user is part of this chat
     if request.user not in [chat.buyer, chat.seller]:
         return JsonResponse({'error': 'Permission denied'}, status=403)
     
-    last_message_id = request.GET.get('last_message_id', 0)
-    messages = chat.messages.filter(
-        id__gt=last_message_id,
-        sender__isnull=False
-    ).select_related('sender', 'product').order_by('created_at')
+    try:
+        before_id = request.GET.get('before_id')
+        before_id = int(before_id) if before_id else None
+        last_message_id = max(0, int(request.GET.get('after_id') or request.GET.get('last_message_id') or 0))
+    except (TypeError, ValueError):
+        return JsonResponse({'error': 'Invalid message id'}, status=400)
+    
+    if before_id is not None:
+        older, has_more = _older_messages(chat, before_id, settings.CHAT_HISTORY_PAGE_SIZE)
+        return JsonResponse({
+            'messages': _messages_data(older, request.user),
+            'cursor': older[0].id if older else before_id,
+            'has_more': has_more
+        })
     
-    messages_data = []
-    for msg in messages:
-        if msg.sender:
-            # Get sender display name
-            if hasattr(msg.sender, 'get_full_name') and msg.sender.get_full_name():
-                sender_name = msg.sender.get_full_name()
-            elif msg.sender.email:
-                sender_name = msg.sender.email
-            else:
-                sender_name = 'Unknown User'
-        else:
-            sender_name = 'Unknown User'
-            
-        message_data = {
-            'id': msg.id,
-            'text': msg.message,
-            'sender': sender_name,
-            'created_at': msg.created_at.strftime('%b %d, %Y %I:%M %p'),
-            'is_own': msg.sender == request.user
-        }
-        
-        # Add product data if exists
-        if msg.product:
-            # Get the first product image URL if available
-            image_url = None
-            if hasattr(msg.product, 'images') and msg.product.images.exists():
-                first_image = msg.product.images.first()
-                if first_image and hasattr(first_image, 'image'):
-                    image_url = first_image.image.url
-            
-            message_data['product'] = {
-                'id': msg.product.id,
-                'name': msg.product.name,
-                'price': str(msg.product.price) if hasattr(msg.product, 'price') else None,
-                'image_url': image_url
-            }
-            
-        messages_data.append(message_data)
+    messages_data, has_more = _new_messages_data(chat, last_message_id, request.user)
     
-    return JsonResponse({'messages': messages_data})
+    # Clients resume from ``cursor``; ``has_more`` means fetch again right away
+    return JsonResponse({
+        'messages': messages_data,
+        'cursor': _cursor(messages_data, last_message_id),
+        'has_more': has_more
+    })
+
+
+def _last_event_id(request):
+    """Resume point: the EventSource's Last-Event-ID on reconnect, else ?last_message_id="""
+    raw = request.headers.get('Last-Event-ID') or request.GET.get('last_message_id', 0)
+    try:
+        return max(0, int(raw))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _messages_event(messages_data):
+    return f"id: {messages_data[-1]['id']}\nevent: messages\ndata: {json.dumps({'messages': messages_data})}\n\n"
+
+
+def _message_event_stream(chat, user, last_message_id, deadline):
+    channel = buyer_seller_chat_channel(chat.id)
+    version = current_version(channel)
+    while True:
+        messages_data, has_more = _new_messages_data(chat, last_message_id, user)
+        if messages_data:
+            last_message_id = _cursor(messages_data, last_message_id)
+            yield _messages_event(messages_data)
+        if has_more:
+            continue
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                yield "event: timeout\ndata: {}\n\n"
+                return
+            new_version = wait_for_change(channel, version, min(remaining, CHAT_STREAM_KEEPALIVE_SECONDS))
+            if new_version is not None:
+                version = new_version
+                break
+            yield ": keepalive\n\n"
+
+
+async def _amessage_event_stream(chat, user, last_message_id, deadline):
+    channel = buyer_seller_chat_channel(chat.id)
+    new_messages_data = sync_to_async(_new_messages_data)
+    version = await acurrent_version(channel)
+    while True:
+        messages_data, has_more = await new_messages_data(chat, last_message_id, user)
+        if messages_data:
+            last_message_id = _cursor(messages_data, last_message_id)
+            yield _messages_event(messages_data)
+        if has_more:
+            continue
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                yield "event: timeout\ndata: {}\n\n"
+                return
+            new_version = await await_change(channel, version, min(remaining, CHAT_STREAM_KEEPALIVE_SECONDS))
+            if new_version is not None:
+                version = new_version
+                break
+            yield ": keepalive\n\n"
+
+
+def _serves_stream(request):
+    """
+    Whether chat messages are pushed over server-sent events.
+
+    Under ASGI an idle stream costs no thread. Under WSGI each open stream
+    holds a worker thread for up to CHAT_STREAM_MAX_SECONDS, so clients poll
+    instead unless CHAT_SSE_ENABLED says the deployment can afford it.
+    """
+    return isinstance(request, ASGIRequest) or settings.CHAT_SSE_ENABLED
+
+
+@login_required
+def message_events(request, chat_id):
+    """
+    Server-sent events stream of new messages in a chat.
+
+    Emits a ``messages`` event (the get_messages payload, with the newest id as
+    the event id) for messages after ``?last_message_id=`` and then whenever a
+    participant posts, and closes after ``CHAT_STREAM_MAX_SECONDS`` so the
+    browser's EventSource reconnects from ``Last-Event-ID``. Under ASGI the
+    stream is an async generator, so idle connections do not hold a thread.
+    Under WSGI it answers 204 (which stops EventSource reconnecting) unless
+    CHAT_SSE_ENABLED is set, and the page polls get_messages instead.
+    """
+    chat = get_object_or_404(BuyerSellerChat, id=chat_id)
+    
+    # Check if user is part of this chat
+    if request.user not in [chat.buyer, chat.seller]:
+        return JsonResponse({'error': 'Permission denied'}, status=403)
+    
+    if not _serves_stream(request):
+        return HttpResponse(status=204)
+    
+    last_message_id = _last_event_id(request)
+    deadline = time.monotonic() + settings.CHAT_STREAM_MAX_SECONDS
+    if isinstance(request, ASGIRequest):
+        stream = _amessage_event_stream(chat, request.user, last_message_id, deadline)
+    else:
+        stream = _message_event_stream(chat, request.user, last_message_id, deadline)
+    response = StreamingHttpResponse(stream, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@login_required
+def search_messages(request):
+    """API endpoint to search the current user's chat messages
+    
+    Returns ranked hits for ``?q=`` with chat ids and HTML snippets.
+    """
+    query = request.GET.get('q', '').strip()
+    if not query:
+        return JsonResponse({'error': 'Query cannot be empty'}, status=400)
+    try:
+        limit = min(max(1, int(request.GET.get('limit', 20))), 50)
+    except ValueError:
+        limit = 20
+    return JsonResponse({
+        'query': query,
+        'results': message_search.search(request.user, query, limit=limit)
+    })
 
 
 @login_required
@@ -429,12 +638,8 @@ def mark_messages_read(request, chat_id):
     if request.user not in [chat.buyer, chat.seller]:
         return JsonResponse({'error': 'Permission denied'}, status=403)
     
-    # Mark messages from the other user as read
-    other_user = chat.seller if request.user == chat.buyer else chat.buyer
-    updated_count = chat.messages.filter(
-        sender=other_user,
-        is_read=False
-    ).update(is_read=True)
+    # Move the current user's read watermark up to the latest message
+    updated_count = chat.mark_read(request.user)
     
     return JsonResponse({
         'success': True,
@@ -1,7 +1,9 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse
+from django.conf import settings
 from django.utils import timezone
+from core import chat_archive
 from .models import Product, ChatMessage
 from .chat_forms import ChatMessageForm
 
@@ -33,19 +35,35 @@ def chat_room(request, product_id):
 
 @login_required
 def get_messages(request, product_id):
-    """API endpoint to get new messages via AJAX"""
-    last_message_id = request.GET.get('last_message_id', 0)
-    messages = ChatMessage.objects.filter(
+    """API endpoint to get new messages via AJAX
+    
+    Returns at most CHAT_MESSAGES_PAGE_SIZE messages after ``last_message_id``,
+    plus the ``cursor`` to send next time and whether more are waiting.
+    Messages moved to the cold archive are read back before the hot ones.
+    """
+    try:
+        last_message_id = max(0, int(request.GET.get('last_message_id', 0)))
+    except (TypeError, ValueError):
+        last_message_id = 0
+    limit = settings.CHAT_MESSAGES_PAGE_SIZE
+    messages = chat_archive.archived_group_messages(product_id, last_message_id, limit + 1)
+    messages += ChatMessage.objects.filter(
         product_id=product_id,
         id__gt=last_message_id
-    ).order_by('created_at')
+    ).select_related('user').order_by('id')[:limit + 1 - len(messages)]
+    has_more = len(messages) > limit
+    messages = messages[:limit]
     
     messages_data = [{
         'id': msg.id,
         'user': msg.user.username,
         'message': msg.message,
         'created_at': msg.created_at.strftime('%b %d, %Y %I:%M %p'),
-        'is_own': msg.user == request.user
+        'is_own': msg.user_id == request.user.pk
     } for msg in messages]
     
-    return JsonResponse({'messages': messages_data})
+    return JsonResponse({
+        'messages': messages_data,
+        'cursor': messages[-1].id if messages else last_message_id,
+        'has_more': has_more
+    })
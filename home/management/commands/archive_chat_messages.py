@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.chat_archive import archive_messages
+
+
+class Command(BaseCommand):
+    help = 'Move old messages of inactive or quiet chats into compressed archive batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=settings.CHAT_ARCHIVE_AFTER_DAYS,
+                            help='Archive messages older than this many days')
+        parser.add_argument('--quiet-days', type=int, default=settings.CHAT_ARCHIVE_QUIET_DAYS,
+                            help='Only threads inactive or without new messages for this many days')
+        parser.add_argument('--batch-size', type=int, default=settings.CHAT_ARCHIVE_BATCH_SIZE,
+                            help='Messages per compressed batch')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be archived without moving it')
+
+    def handle(self, *args, **options):
+        totals = archive_messages(
+            older_than_days=options['older_than_days'],
+            quiet_days=options['quiet_days'],
+            batch_size=options['batch_size'],
+            dry_run=options['dry_run'],
+        )
+        verb = 'Would archive' if options['dry_run'] else 'Archived'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {totals['chat_messages']} messages from {totals['chats']} buyer-seller chats and "
+            f"{totals['group_messages']} from {totals['products']} product group chats "
+            f"in {totals['batches']} batches"
+        ))
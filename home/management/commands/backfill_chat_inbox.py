@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F, Max, Min, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from home.models import BuyerSellerChat, BuyerSellerMessage
+
+
+class Command(BaseCommand):
+    help = 'Fill the inbox preview and read watermarks of buyer-seller chats from their messages'
+
+    def handle(self, *args, **options):
+        messages = BuyerSellerMessage.objects.filter(chat=OuterRef('pk')).order_by().values('chat')
+        newest = messages.annotate(newest=Max('id')).values('newest')
+        updated = BuyerSellerChat.objects.update(last_message_id=Subquery(newest))
+        self.stdout.write(self.style.SUCCESS(f'Backfilled last_message for {updated} chats'))
+
+        # A participant has read everything below the other side's oldest
+        # message still flagged unread, or the whole chat if there is none.
+        # Greatest() keeps a re-run from moving a watermark backwards once
+        # the is_read flags have gone stale.
+        def watermark(field, other):
+            first_unread = messages.filter(sender=OuterRef(other), is_read=False).annotate(
+                first=Min('id')).values('first')
+            return Greatest(
+                F(field),
+                Coalesce(Subquery(first_unread) - 1, F('last_message_id'), Value(0)),
+            )
+
+        BuyerSellerChat.objects.update(
+            buyer_last_read_message_id=watermark('buyer_last_read_message_id', 'seller'),
+            seller_last_read_message_id=watermark('seller_last_read_message_id', 'buyer'),
+        )
+        self.stdout.write(self.style.SUCCESS(f'Backfilled read watermarks for {updated} chats'))
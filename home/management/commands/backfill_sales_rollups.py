@@ -0,0 +1,22 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.sales_rollup import backfill
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily sales rollups from orders and order requests (cart adds are kept as counted)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Only days from this date on (YYYY-MM-DD); all history by default')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = date.fromisoformat(options['since'])
+            except ValueError:
+                raise CommandError('--since must be a date in YYYY-MM-DD format')
+        days = backfill(since=since)
+        self.stdout.write(self.style.SUCCESS(f'Refreshed sales rollups for {days} days'))
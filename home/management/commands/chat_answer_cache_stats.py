@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from core import answer_cache, metrics
+
+
+class Command(BaseCommand):
+    help = 'Show hit/miss counters for the assistant answer cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Zero the counters after printing them')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Counters from the '{metrics.cache_alias()}' cache")
+        warning = metrics.source_warning()
+        if warning:
+            self.stderr.write(self.style.WARNING(warning))
+        stats = answer_cache.stats()
+        self.stdout.write(f"Exact hits:   {stats['hits']}")
+        self.stdout.write(f"Similar hits: {stats['similar_hits']}")
+        self.stdout.write(f"Misses:       {stats['misses']}")
+        self.stdout.write(self.style.SUCCESS(f"Hit rate:     {stats['hit_rate']:.1%}"))
+        if options['reset']:
+            answer_cache.reset_stats()
+            self.stdout.write('Counters reset.')
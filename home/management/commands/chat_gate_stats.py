@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from core import llm_gate, metrics
+
+
+class Command(BaseCommand):
+    help = 'Show queue depth, wait time, rejections and throttles for the LLM concurrency gate'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Zero the counters after printing them')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Counters from the '{metrics.cache_alias()}' cache")
+        warning = metrics.source_warning()
+        if warning:
+            self.stderr.write(self.style.WARNING(warning))
+        stats = llm_gate.stats()
+        wait = stats['wait_seconds']
+        self.stdout.write(f"Queue depth:          {stats['queue_depth']} (peak {stats['queue_depth_max']})")
+        self.stdout.write(f"Queued requests:      {wait['count']} (mean wait {wait['mean']:.2f}s, max {wait['max']:.2f}s)")
+        self.stdout.write(f"Rejected, queue full: {stats['rejected_queue_full']}")
+        self.stdout.write(f"Rejected, timed out:  {stats['rejected_timeout']}")
+        self.stdout.write(f"Throttled (rate):     {stats['throttled']}")
+        if options['reset']:
+            metrics.reset(
+                'chat.gate.queue_depth', 'chat.gate.wait_seconds', 'chat.gate.rejected_queue_full',
+                'chat.gate.rejected_timeout', 'chat.gate.throttled',
+            )
+            self.stdout.write('Counters reset.')
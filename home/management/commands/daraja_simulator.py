@@ -0,0 +1,63 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from core.daraja_simulator import SimulatorConfig, make_server
+
+
+class Command(BaseCommand):
+    help = 'Run a local stand-in for the Daraja (M-Pesa) API for load and latency testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8900)
+        parser.add_argument('--latency-ms', type=float, default=0, help='Added latency per API call')
+        parser.add_argument('--jitter-ms', type=float, default=0, help='Uniform +/- jitter on the latency')
+        parser.add_argument('--failure-rate', type=float, default=0.0, help='Fraction of API calls answered with 503')
+        parser.add_argument('--success-rate', type=float, default=0.9,
+                            help='Fraction of STK pushes the simulated customer completes')
+        parser.add_argument('--callback-delay', type=float, default=2.0,
+                            help='Seconds between an STK push and its callback')
+        parser.add_argument('--callback-drop-rate', type=float, default=0.0,
+                            help='Fraction of callbacks never delivered (exercises the reconciler)')
+        parser.add_argument('--callback-url', default=None,
+                            help='Deliver callbacks here instead of the CallBackURL in each request, '
+                                 'e.g. http://127.0.0.1:8000/api/mpesa-callback/')
+        parser.add_argument('--pull-page-size', type=int, default=100, help='Transactions per Pull API page')
+        parser.add_argument('--seed', type=int, default=None, help='Seed for reproducible outcomes')
+
+    def handle(self, *args, **options):
+        config = SimulatorConfig(
+            latency_ms=options['latency_ms'],
+            jitter_ms=options['jitter_ms'],
+            failure_rate=options['failure_rate'],
+            callback_delay=options['callback_delay'],
+            success_rate=options['success_rate'],
+            callback_drop_rate=options['callback_drop_rate'],
+            callback_url=options['callback_url'],
+            pull_page_size=options['pull_page_size'],
+            seed=options['seed'],
+        )
+        server, simulator = make_server(options['host'], options['port'], config)
+        host, port = server.server_address[:2]
+        self.stdout.write(self.style.SUCCESS(f'Daraja simulator listening on http://{host}:{port}'))
+        self.stdout.write(f'Set MPESA_BASE_URL=http://{host}:{port} (or pass --base-url to the payment commands)')
+
+        def _stop(signum, frame):
+            raise KeyboardInterrupt
+
+        # Stop (and print the summary) on SIGTERM as well as Ctrl-C
+        signal.signal(signal.SIGTERM, _stop)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+        self.stdout.write('Daraja simulator stopped.')
+        for name, value in sorted(simulator.summary().items()):
+            if isinstance(value, float):
+                self.stdout.write(f'  {name}: {value:.3f}s')
+            else:
+                self.stdout.write(f'  {name}: {value}')
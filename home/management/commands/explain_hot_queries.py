@@ -0,0 +1,135 @@
+import re
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+from home.models import (
+    Business, Cart, MpesaCallback, Order, OrderRequest, PaymentJob, PaymentRequest,
+    Product, ProductVariation, RawPayment,
+)
+
+PRODUCT_LIST = 'product_list: active products, newest first'
+VENDOR_PRODUCT_LIST = 'vendor product_list: live products for a vendor'
+
+# Flagged plan steps that are the intended plan, by query: (plan detail, why)
+ACCEPTED_SCANS = {
+    PRODUCT_LIST: [
+        ('SCAN home_product USING INDEX product_active_created_idx',
+         'walks the partial index of live products in display order, so every row read is listed '
+         'and a page stops after its LIMIT'),
+    ],
+    VENDOR_PRODUCT_LIST: [
+        ('USE TEMP B-TREE FOR ORDER BY',
+         "sorts only the vendor's own products, found through the business and user indexes"),
+    ],
+}
+
+
+def hot_queries(user_id=0):
+    """The lookups behind the busiest views, as (label, queryset) pairs."""
+    return [
+        # get_object_or_404 drops the default ordering
+        ('mpesa_callback / check_payment_status: payment by CheckoutRequestID',
+         PaymentRequest.objects.filter(checkout_request_id='ws_CO_0').order_by()),
+        ('order_detail: raw payments for an order',
+         RawPayment.objects.filter(product_id='1')),
+        ('cart context processor: guest cart',
+         Cart.objects.filter(session_id='session', user=None)),
+        ('cart context processor: user cart',
+         Cart.objects.filter(user_id=user_id)),
+        ('order_history: orders',
+         Order.objects.filter(user_id=user_id).order_by('-created_at')),
+        ('order_history: order requests',
+         OrderRequest.objects.filter(user_id=user_id).order_by('-created_at')),
+        ('vendor order requests: pending, newest first',
+         OrderRequest.objects.filter(status='pending').order_by('-created_at')),
+        (PRODUCT_LIST,
+         Product.objects.filter(is_active=True, is_archived=False).order_by('-created_at')),
+        # As vendor.views.product_list filters it: the business subquery lets
+        # SQLite answer the OR from two indexes instead of walking products
+        (VENDOR_PRODUCT_LIST,
+         Product.objects.filter(
+             Q(business__in=Business.objects.filter(owner_id=user_id)) | Q(user_id=user_id), is_archived=False
+         ).order_by('id')),
+        ('product_detail: live variations of a product',
+         ProductVariation.objects.filter(product_id=1, is_archived=False)),
+        ('payment worker: due jobs',
+         PaymentJob.objects.filter(status='queued', available_at__lte=timezone.now())
+         .order_by('available_at', 'id')),
+        ('callback processor: received callbacks',
+         MpesaCallback.objects.filter(status='received').order_by('received_at')),
+        ('reconciler: stale pending payments',
+         PaymentRequest.objects.filter(status='pending', updated_at__lt=timezone.now()).order_by('updated_at')),
+    ]
+
+
+# SQLite plan details: "SCAN <table> [USING [COVERING] INDEX <name>]" walks
+# the whole table or index; only an index used with a constraint, e.g.
+# "USING INDEX <name> (user_id=?)", narrows it down
+_SCAN_RE = re.compile(r'\bSCAN (?!CONSTANT ROW\b)')
+_CONSTRAINED_RE = re.compile(r'USING (?:COVERING )?INDEX \S+ \(')
+_SORT_RE = re.compile(r'USE TEMP B-TREE FOR .*ORDER BY')
+
+
+def full_scans(plan):
+    """Plan lines that read a whole table or index, or sort rows in a temporary b-tree."""
+    flagged = []
+    for line in plan.splitlines():
+        if 'SUBQUERY' in line:
+            continue
+        if (_SCAN_RE.search(line) and not _CONSTRAINED_RE.search(line)) or _SORT_RE.search(line):
+            flagged.append(line)
+    return flagged
+
+
+def accepted_reason(label, line):
+    """Why a flagged plan line of the query ``label`` is expected, or None."""
+    for detail, reason in ACCEPTED_SCANS.get(label, ()):
+        if line.rstrip().endswith(detail):
+            return reason
+    return None
+
+
+class Command(BaseCommand):
+    help = 'Print query plans (EXPLAIN QUERY PLAN on SQLite) for the hot view queries and flag full scans and sorts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-id', type=int, default=None, help='User id to plug into per-user queries')
+        parser.add_argument('--only-scans', action='store_true', help='Only print queries that fall back to a full scan or sort')
+        parser.add_argument('--fail-on-scan', action='store_true', help='Exit with an error if any query full-scans or sorts')
+
+    def handle(self, *args, **options):
+        user_id = options['user_id']
+        if user_id is None:
+            user_id = get_user_model().objects.values_list('id', flat=True).first() or 0
+
+        scanning = []
+        for label, queryset in hot_queries(user_id):
+            plan = queryset.explain()
+            flagged = full_scans(plan) if connection.vendor == 'sqlite' else []
+            accepted = {line: accepted_reason(label, line) for line in flagged}
+            scans = [line for line in flagged if accepted[line] is None]
+            if scans:
+                scanning.append(label)
+            if options['only_scans'] and not scans:
+                continue
+
+            style = self.style.WARNING if scans else self.style.SUCCESS
+            self.stdout.write(style(f"== {label}{' (FULL SCAN / SORT)' if scans else ''}"))
+            self.stdout.write(plan)
+            for line, reason in accepted.items():
+                if reason:
+                    self.stdout.write(f"Accepted: {line.split(' ', 3)[-1]}: {reason}")
+            self.stdout.write('')
+
+        if connection.vendor != 'sqlite':
+            self.stdout.write('Full-scan detection only understands SQLite plans; review the plans above.')
+        elif scanning:
+            self.stdout.write(self.style.WARNING(f"{len(scanning)} queries fall back to a full scan or sort"))
+            if options['fail_on_scan']:
+                raise CommandError('Full scans or sorts found: ' + '; '.join(scanning))
+        else:
+            self.stdout.write(self.style.SUCCESS('No hot query falls back to a full scan or sort'))
@@ -0,0 +1,45 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from core.openai_stub import StubConfig, make_server
+
+
+class Command(BaseCommand):
+    help = 'Run a local stand-in for the OpenAI chat completions API (plain and streaming)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8901)
+        parser.add_argument('--first-token-ms', type=float, default=300, help='Delay before the first token')
+        parser.add_argument('--token-ms', type=float, default=30, help='Delay between subsequent tokens')
+        parser.add_argument('--reply', default=None, help='Fixed reply text (default: echo the last user message)')
+        parser.add_argument('--failure-rate', type=float, default=0.0, help='Fraction of requests answered with 503')
+
+    def handle(self, *args, **options):
+        config = StubConfig(
+            first_token_ms=options['first_token_ms'],
+            token_ms=options['token_ms'],
+            reply=options['reply'],
+            failure_rate=options['failure_rate'],
+        )
+        server, stub = make_server(options['host'], options['port'], config)
+        host, port = server.server_address[:2]
+        self.stdout.write(self.style.SUCCESS(f'OpenAI stub listening on http://{host}:{port}/v1'))
+        self.stdout.write(f'Set OPENAI_BASE_URL=http://{host}:{port}/v1 (and any OPENAI_API_KEY)')
+
+        def _stop(signum, frame):
+            raise KeyboardInterrupt
+
+        # Stop (and print the summary) on SIGTERM as well as Ctrl-C
+        signal.signal(signal.SIGTERM, _stop)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+        self.stdout.write('OpenAI stub stopped.')
+        for name, value in sorted(stub.summary().items()):
+            self.stdout.write(f'  {name}: {value}')
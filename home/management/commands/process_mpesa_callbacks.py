@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from core.mpesa_callbacks import run_processor
+
+
+class Command(BaseCommand):
+    help = 'Apply M-Pesa callbacks from the inbox to payment requests and orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drain the inbox once and exit')
+        parser.add_argument('--batch-size', type=int, default=100, help='Callbacks handled per pass')
+        parser.add_argument('--poll-interval', type=float, default=0.5, help='Seconds to sleep when the inbox is empty')
+
+    def handle(self, *args, **options):
+        self.stdout.write('M-Pesa callback processor starting...')
+        try:
+            processed = run_processor(
+                batch_size=options['batch_size'],
+                poll_interval=options['poll_interval'],
+                once=options['once'],
+            )
+        except KeyboardInterrupt:
+            self.stdout.write('M-Pesa callback processor stopped.')
+            return
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} callbacks'))
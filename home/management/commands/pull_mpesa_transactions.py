@@ -0,0 +1,60 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.mpesa_pull import DEFAULT_OVERLAP_MINUTES, NAIROBI, pull_and_ingest
+from core.mpesa_service import MPesaService, PullTransactionsError
+from home.models import RawPayment
+
+
+def _parse_date(value):
+    try:
+        return NAIROBI.localize(datetime.strptime(value, "%Y-%m-%d %H:%M:%S"))
+    except ValueError:
+        try:
+            return NAIROBI.localize(datetime.strptime(value, "%Y-%m-%d"))
+        except ValueError:
+            raise CommandError(f"Invalid date {value!r}; use 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM:SS' (Nairobi time)")
+
+
+class Command(BaseCommand):
+    help = 'Ingest M-Pesa Pull Transactions into RawPayment and match receipts to payment requests'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', default=None, help="Window start, Nairobi time (default: high-water mark)")
+        parser.add_argument('--until', default=None, help="Window end, Nairobi time (default: now)")
+        parser.add_argument('--full', action='store_true', help='Ignore the high-water mark and read the default window')
+        parser.add_argument('--overlap-minutes', type=int, default=DEFAULT_OVERLAP_MINUTES,
+                            help='Minutes re-read before the high-water mark')
+        parser.add_argument('--show-unmatched', action='store_true',
+                            help='List ingested transactions no payment request accounts for')
+        parser.add_argument('--base-url', default=None, help='Override MPESA_BASE_URL (e.g. a local stand-in server)')
+
+    def handle(self, *args, **options):
+        since = _parse_date(options['since']) if options['since'] else None
+        until = _parse_date(options['until']) if options['until'] else None
+
+        try:
+            stats = pull_and_ingest(
+                MPesaService(base_url=options['base_url']),
+                since=since,
+                until=until,
+                full=options['full'],
+                overlap_minutes=options['overlap_minutes'],
+            )
+        except PullTransactionsError as e:
+            raise CommandError(f"Pull failed at offset {e.offset}: {e}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Ingested {stats['ingested']} transactions in {stats['pages']} pages; "
+            f"{stats['matched']} newly matched, {len(stats['unmatched_ids'])} without a payment request"
+        ))
+
+        if options['show_unmatched'] and stats['unmatched_ids']:
+            unmatched = RawPayment.objects.filter(transaction_id__in=stats['unmatched_ids']).order_by('transaction_date')
+            for raw_payment in unmatched:
+                date = raw_payment.transaction_date.strftime('%Y-%m-%d %H:%M') if raw_payment.transaction_date else '-'
+                self.stdout.write(
+                    f"  {raw_payment.transaction_id}  {date}  {raw_payment.amount} KES  "
+                    f"{raw_payment.phone_number or '-'}  {raw_payment.bill_reference or '-'}"
+                )
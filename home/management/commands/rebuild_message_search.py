@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core import message_search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the buyer-seller chat message search index from scratch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Postings written per insert')
+
+    def handle(self, *args, **options):
+        messages, postings = message_search.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Indexed {messages} messages into {postings} postings'))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from core import metrics
+from core.mpesa_service import MPesaService
+from core.payment_reconciler import DEFAULT_STALE_AFTER_SECONDS, run_reconciler
+
+
+class Command(BaseCommand):
+    help = 'Query Daraja for pending M-Pesa payments whose callback never arrived'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Reconcile a single batch and exit')
+        parser.add_argument('--stale-after', type=int, default=DEFAULT_STALE_AFTER_SECONDS,
+                            help='Seconds a pending payment must be unchanged before it is queried')
+        parser.add_argument('--batch-size', type=int, default=50, help='Payments selected per pass')
+        parser.add_argument('--concurrency', type=int, default=4, help='Status queries sent in parallel')
+        parser.add_argument('--poll-interval', type=float, default=30.0, help='Seconds to sleep between passes')
+        parser.add_argument('--base-url', default=None, help='Override MPESA_BASE_URL (e.g. a local stand-in server)')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Payment reconciler starting...')
+        try:
+            totals = run_reconciler(
+                MPesaService(base_url=options['base_url']),
+                stale_after=options['stale_after'],
+                batch_size=options['batch_size'],
+                concurrency=options['concurrency'],
+                poll_interval=options['poll_interval'],
+                once=options['once'],
+            )
+        except KeyboardInterrupt:
+            self.stdout.write('Payment reconciler stopped.')
+            return
+
+        lag = metrics.summary('mpesa.reconcile.lag_seconds')
+        self.stdout.write(self.style.SUCCESS(
+            f"Queried {totals['queried']}, resolved {totals['resolved']}, "
+            f"still pending {totals['still_pending']}, errors {totals['errors']}; "
+            f"unconfirmed pushes matched {totals['matched']}, timed out {totals['expired']}"
+        ))
+        if lag['count']:
+            self.stdout.write(f"Reconciliation lag: mean {lag['mean']:.1f}s, max {lag['max']:.1f}s over {lag['count']} payments")
@@ -0,0 +1,78 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from core.mpesa_callbacks import InvalidCallback, ingest_callback, parse_callback, replay_callbacks
+from home.models import MpesaCallback
+
+
+class Command(BaseCommand):
+    help = 'Replay stored M-Pesa callbacks (or load lost ones from a file) through the processor'
+
+    def add_arguments(self, parser):
+        parser.add_argument('checkout_request_ids', nargs='*', help='CheckoutRequestIDs to replay')
+        parser.add_argument('--status', choices=[c[0] for c in MpesaCallback.STATUS_CHOICES],
+                            help='Replay every callback in this inbox status (e.g. failed, orphaned)')
+        parser.add_argument('--since', help='Only callbacks received at or after this ISO datetime')
+        parser.add_argument('--file', help='JSON file with a callback payload or a list of payloads to ingest first')
+        parser.add_argument('--force', action='store_true',
+                            help='Re-apply even if the payment request is no longer pending')
+        parser.add_argument('--dry-run', action='store_true', help='List the callbacks without ingesting or replaying them')
+
+    def handle(self, *args, **options):
+        ids = list(options['checkout_request_ids'])
+        # CheckoutRequestIDs from --file that a dry run leaves out of the inbox
+        not_ingested = []
+
+        if options['file']:
+            with open(options['file']) as f:
+                payloads = json.load(f)
+            if isinstance(payloads, dict):
+                payloads = [payloads]
+            for payload in payloads:
+                try:
+                    if options['dry_run']:
+                        parse_callback(json.dumps(payload))
+                    else:
+                        ingest_callback(json.dumps(payload))
+                except InvalidCallback as e:
+                    self.stdout.write(self.style.WARNING(f'Skipping payload: {e}'))
+                    continue
+                ids.append(payload['Body']['stkCallback']['CheckoutRequestID'])
+                if options['dry_run']:
+                    not_ingested.append(ids[-1])
+
+        if not ids and not options['status']:
+            raise CommandError('Give CheckoutRequestIDs, --status or --file')
+
+        callbacks = MpesaCallback.objects.all()
+        if ids:
+            callbacks = callbacks.filter(checkout_request_id__in=ids)
+        if options['status']:
+            callbacks = callbacks.filter(status=options['status'])
+        if options['since']:
+            since = parse_datetime(options['since'])
+            if since is None:
+                raise CommandError(f"Invalid --since value: {options['since']}")
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+            callbacks = callbacks.filter(received_at__gte=since)
+
+        if options['dry_run']:
+            for callback in callbacks.order_by('received_at'):
+                self.stdout.write(f'{callback.checkout_request_id}  {callback.status}  received {callback.received_at:%Y-%m-%d %H:%M:%S}')
+            stored = set(MpesaCallback.objects.filter(checkout_request_id__in=not_ingested)
+                         .values_list('checkout_request_id', flat=True))
+            # Ingesting would store them as 'received' now, so only --status can exclude them
+            action = 'ingested and replayed' if options['status'] in (None, 'received') else 'ingested'
+            for checkout_request_id in dict.fromkeys(not_ingested):
+                if checkout_request_id not in stored:
+                    self.stdout.write(f'{checkout_request_id}  new  would be {action} from {options["file"]}')
+            return
+
+        replayed = replay_callbacks(callbacks, force=options['force'])
+        for callback in replayed:
+            self.stdout.write(f'{callback.checkout_request_id} -> {callback.status}')
+        self.stdout.write(self.style.SUCCESS(f'Replayed {len(replayed)} callbacks'))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from core.mpesa_service import MPesaService
+from core.payment_jobs import default_worker_id, run_worker
+
+
+class Command(BaseCommand):
+    help = 'Process queued M-Pesa STK push jobs outside the web request'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drain due jobs once and exit')
+        parser.add_argument('--batch-size', type=int, default=10, help='Jobs claimed per poll')
+        parser.add_argument('--concurrency', type=int, default=4, help='STK pushes sent in parallel')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--max-jobs', type=int, default=None, help='Exit after processing this many jobs')
+        parser.add_argument('--base-url', default=None, help='Override MPESA_BASE_URL (e.g. a local stand-in server)')
+
+    def handle(self, *args, **options):
+        worker_id = default_worker_id()
+        self.stdout.write(f'Payment worker {worker_id} starting...')
+
+        try:
+            processed = run_worker(
+                worker_id=worker_id,
+                batch_size=options['batch_size'],
+                concurrency=options['concurrency'],
+                poll_interval=options['poll_interval'],
+                once=options['once'],
+                max_jobs=options['max_jobs'],
+                mpesa=MPesaService(base_url=options['base_url']),
+            )
+        except KeyboardInterrupt:
+            self.stdout.write('Payment worker stopped.')
+            return
+
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} payment jobs'))
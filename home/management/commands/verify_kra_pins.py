@@ -0,0 +1,78 @@
+import csv
+import json
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.services import gavaconnect
+
+
+class Command(BaseCommand):
+    help = 'Verify a CSV of KRA PINs (TaxpayerType,TaxpayerID) concurrently through GavaConnect'
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_path', help="CSV with TaxpayerType,TaxpayerID columns (or just IDs); '-' for stdin")
+        parser.add_argument('--concurrency', type=int, default=4, help='Lookups in flight at once')
+        parser.add_argument('--output', default=None,
+                            help='Write results to this file (.csv or .ndjson); defaults to NDJSON on stdout')
+        parser.add_argument('--no-cache', action='store_true', help='Ignore cached results and query KRA again')
+
+    def handle(self, *args, **options):
+        path = options['csv_path']
+        try:
+            if path == '-':
+                text = sys.stdin.read()
+            else:
+                with open(path, encoding='utf-8-sig') as f:
+                    text = f.read()
+        except OSError as e:
+            raise CommandError(f"Cannot read {path}: {e}")
+
+        pairs = gavaconnect.parse_pin_csv(text)
+        if not pairs:
+            raise CommandError('No TaxpayerID values found')
+
+        output = options['output']
+        results = []
+        summary = {'ok': 0, 'failed': 0, 'cached': 0}
+        started = time.monotonic()
+        for done, result in enumerate(
+            gavaconnect.check_pins(pairs, concurrency=options['concurrency'], use_cache=not options['no_cache']),
+            start=1,
+        ):
+            summary['ok' if result['ok'] else 'failed'] += 1
+            summary['cached'] += int(result['cached'])
+            if output:
+                results.append(result)
+            else:
+                self.stdout.write(json.dumps(result))
+            self.stderr.write(
+                f"\r{done}/{len(pairs)} checked ({summary['failed']} failed, {summary['cached']} cached)",
+                ending='',
+            )
+        self.stderr.write('')
+
+        if output:
+            results.sort(key=lambda r: r['index'])
+            self._write_results(output, results)
+
+        elapsed = time.monotonic() - started
+        self.stderr.write(self.style.SUCCESS(
+            f"Verified {len(pairs)} PINs in {elapsed:.1f}s: {summary['ok']} ok, "
+            f"{summary['failed']} failed, {summary['cached']} from cache"
+        ))
+
+    def _write_results(self, output, results):
+        with open(output, 'w', newline='', encoding='utf-8') as f:
+            if output.endswith('.csv'):
+                writer = csv.writer(f)
+                writer.writerow(['TaxpayerType', 'TaxpayerID', 'ok', 'cached', 'response'])
+                for r in results:
+                    writer.writerow([
+                        r['TaxpayerType'], r['TaxpayerID'], r['ok'], r['cached'],
+                        json.dumps(r.get('response') or {'error': r.get('error')}),
+                    ])
+            else:
+                for r in results:
+                    f.write(json.dumps(r) + '\n')
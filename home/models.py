@@ -14,6 +14,7 @@ class PaymentRequest(models.Model):
     Model to store M-Pesa payment request and callback data
     """
     STATUS_CHOICES = [
+        ('queued', 'Queued'),
         ('pending', 'Pending'),
         ('completed', 'Completed'),
         ('failed', 'Failed'),
@@ -24,7 +25,7 @@ class PaymentRequest(models.Model):
 
     # Request details
     merchant_request_id = models.CharField(max_length=100, blank=True, null=True)
-    checkout_request_id = models.CharField(max_length=100, blank=True, null=True)
+    checkout_request_id = models.CharField(max_length=100, blank=True, null=True, db_index=True)
     order = models.ForeignKey('Order', on_delete=models.SET_NULL, null=True, blank=True, related_name='payment_requests')
     order_request = models.ForeignKey('OrderRequest', on_delete=models.SET_NULL, null=True, blank=True, related_name='payment_requests')
     
@@ -45,7 +46,7 @@ class PaymentRequest(models.Model):
     callback_data = models.JSONField(blank=True, null=True)
     
     # Transaction details from callback
-    mpesa_receipt_number = models.CharField(max_length=100, blank=True, null=True)
+    mpesa_receipt_number = models.CharField(max_length=100, blank=True, null=True, db_index=True)
     transaction_date = models.DateTimeField(blank=True, null=True)
     transaction_id = models.CharField(max_length=100, blank=True, null=True)
     
@@ -57,6 +58,9 @@ class PaymentRequest(models.Model):
         ordering = ['-created_at']
         verbose_name = 'Payment Request'
         verbose_name_plural = 'Payment Requests'
+        indexes = [
+            models.Index(fields=['status', 'updated_at']),
+        ]
     
     def __str__(self):
         return f"Payment {self.id} - {self.get_status_display()} - {self.amount} KES"
@@ -122,6 +126,107 @@ class PaymentRequest(models.Model):
         return self
 
 
+class PaymentJob(models.Model):
+    """
+    Durable queue entry for M-Pesa work performed outside the web request.
+    Jobs are claimed and executed by `manage.py run_payment_worker`.
+    """
+    KIND_CHOICES = [
+        ('stk_push', 'STK Push'),
+    ]
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    ]
+
+    payment_request = models.ForeignKey(PaymentRequest, on_delete=models.CASCADE, related_name='jobs')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default='stk_push')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    payload = models.JSONField(blank=True, default=dict)
+
+    # Retry bookkeeping
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    available_at = models.DateTimeField(help_text="Earliest time the job may be picked up")
+    locked_by = models.CharField(max_length=100, blank=True, null=True)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, null=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['available_at', 'id']
+        indexes = [
+            models.Index(fields=['status', 'available_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} job {self.id} ({self.status})"
+
+
+class MpesaCallback(models.Model):
+    """
+    Append-only inbox of raw STK callbacks, one row per CheckoutRequestID.
+    The callback view only inserts here; state transitions are applied by
+    `manage.py process_mpesa_callbacks`.
+    """
+    STATUS_CHOICES = [
+        ('received', 'Received'),
+        ('processing', 'Processing'),
+        ('processed', 'Processed'),
+        ('orphaned', 'Orphaned'),
+        ('failed', 'Failed'),
+    ]
+
+    checkout_request_id = models.CharField(max_length=100, unique=True)
+    merchant_request_id = models.CharField(max_length=100, blank=True, null=True)
+    result_code = models.IntegerField(blank=True, null=True)
+    payload = models.JSONField()
+
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='received')
+    attempts = models.PositiveIntegerField(default=0)
+    duplicate_count = models.PositiveIntegerField(default=0, help_text="Repeated deliveries ignored at ingestion")
+    last_error = models.TextField(blank=True, null=True)
+
+    received_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['received_at']
+        verbose_name = 'M-Pesa Callback'
+        verbose_name_plural = 'M-Pesa Callbacks'
+        indexes = [
+            models.Index(fields=['status', 'received_at']),
+        ]
+
+    def __str__(self):
+        return f"Callback {self.checkout_request_id} ({self.status})"
+
+
+class MpesaPullCursor(models.Model):
+    """
+    High-water mark for `manage.py pull_mpesa_transactions`, one row per
+    shortcode. Incremental runs start slightly before the newest transaction
+    seen so far instead of re-reading a fixed window.
+    """
+    shortcode = models.CharField(max_length=20, unique=True)
+    high_water_mark = models.DateTimeField(blank=True, null=True)
+    last_run_at = models.DateTimeField(blank=True, null=True)
+    last_ingested = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'M-Pesa Pull Cursor'
+        verbose_name_plural = 'M-Pesa Pull Cursors'
+
+    def __str__(self):
+        return f"{self.shortcode} @ {self.high_water_mark}"
+
+
 class ExchangeRate(models.Model):
     currency = models.CharField(max_length=3)
     rate = models.DecimalField(max_digits=10, decimal_places=2)
@@ -440,6 +545,18 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Partial indexes cover only live catalog rows (ignored by
+            # backends without partial index support)
+            models.Index(fields=['-created_at'], condition=Q(is_active=True, is_archived=False),
+                         name='product_active_created_idx'),
+            models.Index(fields=['business', '-created_at'], condition=Q(is_archived=False),
+                         name='product_live_business_idx'),
+            models.Index(fields=['user', '-created_at'], condition=Q(is_archived=False),
+                         name='product_live_user_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -540,6 +657,12 @@ class ProductVariation(models.Model):
 
     class Meta:
         ordering = ['order', 'name']
+        indexes = [
+            models.Index(fields=['product', 'order', 'name'], condition=Q(is_archived=False),
+                         name='variation_live_product_idx'),
+            models.Index(fields=['product', 'order', 'name'], condition=Q(is_active=True, is_archived=False),
+                         name='variation_active_product_idx'),
+        ]
         
     def clean(self):
         super().clean()
@@ -596,6 +719,7 @@ class PriceTier(models.Model):
     min_quantity = models.PositiveIntegerField()
     max_quantity = models.PositiveIntegerField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         unique_together = ('variation', 'min_quantity')
@@ -781,6 +905,11 @@ class Order(models.Model):
             # Save again with the updated total
             super().save(update_fields=['total'] if self.pk else None)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at']),
+        ]
+
     def __str__(self):
         if self.user:
             return f"Order #{self.id} by {self.user}"
@@ -806,8 +935,12 @@ class OrderItem(models.Model):
         super().save(*args, **kwargs)
         # Update order total after saving the item
         if not skip_order_update:
-            # Create a copy of kwargs without skip_total_update to pass to order.save()
-            order_save_kwargs = {k: v for k, v in kwargs.items() if k != 'skip_total_update'}
+            # Only pass on options that apply to the order row; force_insert
+            # (from objects.create) or this item's update_fields would not
+            order_save_kwargs = {
+                k: v for k, v in kwargs.items()
+                if k not in ('skip_total_update', 'force_insert', 'force_update', 'update_fields')
+            }
             self.order.save(**order_save_kwargs)
     
     def delete(self, *args, **kwargs):
@@ -840,6 +973,12 @@ class OrderRequest(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', '-created_at']),
+            models.Index(fields=['user', '-created_at']),
+        ]
+
     def __str__(self):
         return f"OrderRequest #{self.id} ({self.status})"
     
@@ -1080,7 +1219,7 @@ class RawPayment(models.Model):
         ('refunded', 'Refunded'),
     ]
 
-    product_id = models.CharField(max_length=100, blank=True, null=True)
+    product_id = models.CharField(max_length=100, blank=True, null=True, db_index=True)
     payment_method = models.CharField(max_length=20, choices=PAYMENT_METHODS)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     currency = models.CharField(max_length=10, default="KES")
@@ -1091,6 +1230,8 @@ class RawPayment(models.Model):
     # ---- Mpesa specific fields ----
     mpesa_receipt = models.CharField(max_length=100, blank=True, null=True)
     phone_number = models.CharField(max_length=20, blank=True, null=True)
+    bill_reference = models.CharField(max_length=100, blank=True, null=True)
+    transaction_date = models.DateTimeField(blank=True, null=True)
 
     # ---- Card specific fields ----
     card_last4 = models.CharField(max_length=4, blank=True, null=True)
@@ -1187,6 +1328,18 @@ class BuyerSellerChat(models.Model):
         help_text="Optional: Link to a specific product being discussed"
     )
     is_active = models.BooleanField(default=True)
+    # Denormalized inbox preview, kept current by BuyerSellerMessage.save()
+    last_message = models.ForeignKey(
+        'BuyerSellerMessage',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    # Read watermarks: each participant has read every message up to and
+    # including this id, so unread is "id above the watermark, from the other side"
+    buyer_last_read_message_id = models.PositiveBigIntegerField(default=0)
+    seller_last_read_message_id = models.PositiveBigIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -1220,18 +1373,28 @@ class BuyerSellerChat(models.Model):
             
         return f"Chat: {buyer_name} ↔ {seller_name}{product_name}"
 
-    @property
-    def last_message(self):
-        """Get the last message in this chat"""
-        return self.messages.last()
+    @staticmethod
+    def watermark_field(chat, user):
+        """Name of ``user``'s read watermark field on ``chat``"""
+        return 'buyer_last_read_message_id' if user.pk == chat.buyer_id else 'seller_last_read_message_id'
+
+    def mark_read(self, user):
+        """Move ``user``'s watermark up to the latest message; one single-row UPDATE"""
+        field = self.watermark_field(self, user)
+        updated = BuyerSellerChat.objects.filter(
+            pk=self.pk,
+            last_message__isnull=False,
+            **{f'{field}__lt': models.F('last_message_id')}
+        ).update(**{field: models.F('last_message_id')})
+        if updated:
+            self.refresh_from_db(fields=[field])
+        return updated
 
-    @property
     def unread_count_for_user(self, user):
         """Get unread message count for a specific user"""
         return self.messages.filter(
-            sender=user,
-            is_read=False
-        ).count()
+            id__gt=getattr(self, self.watermark_field(self, user))
+        ).exclude(sender=user).count()
 
 
 class BuyerSellerMessage(models.Model):
@@ -1255,6 +1418,8 @@ class BuyerSellerMessage(models.Model):
         help_text="The product this message is about, if any"
     )
     message = models.TextField()
+    # Superseded by the read watermarks on BuyerSellerChat; kept only until
+    # backfill_chat_inbox has copied existing flags into them
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -1263,7 +1428,6 @@ class BuyerSellerMessage(models.Model):
         indexes = [
             models.Index(fields=['chat', 'created_at']),
             models.Index(fields=['sender']),
-            models.Index(fields=['is_read']),
         ]
 
     def __str__(self):
@@ -1279,7 +1443,135 @@ class BuyerSellerMessage(models.Model):
             
         return f"Message from {sender_name} in chat {self.chat.id}"
 
-    def mark_as_read(self):
-        """Mark this message as read"""
-        self.is_read = True
-        self.save(update_fields=['is_read'])
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        if adding:
+            # Point the chat's inbox preview at the newest message; the id
+            # guard keeps a slower concurrent writer from moving it backwards
+            BuyerSellerChat.objects.filter(
+                Q(last_message__isnull=True) | Q(last_message_id__lt=self.pk),
+                pk=self.chat_id,
+            ).update(last_message=self, updated_at=self.created_at)
+
+
+class ArchivedMessageBatch(models.Model):
+    """
+    zlib-compressed JSON batch of old chat messages moved out of the hot tables.
+
+    Written by the archive_chat_messages command (see core/chat_archive.py);
+    a batch holds consecutive messages of one buyer-seller chat or one
+    product group chat, oldest first.
+    """
+    chat = models.ForeignKey(
+        BuyerSellerChat,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='archived_batches'
+    )
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='archived_chat_batches',
+        help_text="Product group chat (ChatMessage) the batch belongs to"
+    )
+    first_message_id = models.PositiveBigIntegerField()
+    last_message_id = models.PositiveBigIntegerField()
+    first_created_at = models.DateTimeField()
+    last_created_at = models.DateTimeField()
+    message_count = models.PositiveIntegerField()
+    payload = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['first_message_id']
+        indexes = [
+            models.Index(fields=['chat', 'last_message_id']),
+            models.Index(fields=['product', 'last_message_id']),
+        ]
+
+    def __str__(self):
+        owner = f"chat {self.chat_id}" if self.chat_id else f"product {self.product_id}"
+        return f"{self.message_count} archived messages in {owner} (#{self.first_message_id}-#{self.last_message_id})"
+
+
+class MessageSearchPosting(models.Model):
+    """
+    Inverted index entry: ``term`` occurs ``count`` times in ``message``.
+
+    Maintained on message save and by the rebuild_message_search command
+    (see core/message_search.py); ``chat`` is denormalized so a search can be
+    scoped to the requesting user's chats without joining messages.
+    """
+    term = models.CharField(max_length=64)
+    message = models.ForeignKey(
+        BuyerSellerMessage,
+        on_delete=models.CASCADE,
+        related_name='search_postings'
+    )
+    chat = models.ForeignKey(
+        BuyerSellerChat,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    count = models.PositiveSmallIntegerField(default=1)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['term', 'chat']),
+        ]
+
+    def __str__(self):
+        return f"{self.term} in message {self.message_id}"
+
+
+class DailySales(models.Model):
+    """
+    One day of sales activity; maintained by core.sales_rollup.
+
+    ``orders``, ``units``, ``revenue`` and ``order_requests`` are recomputed
+    from order and order request line items, ``cart_adds`` is counted as cart
+    lines are created.
+    """
+    date = models.DateField()
+    orders = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0, help_text="Paid orders only")
+    cart_adds = models.PositiveIntegerField(default=0)
+    order_requests = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+
+class VariationDailySales(DailySales):
+    variation = models.ForeignKey(ProductVariation, on_delete=models.CASCADE, related_name='daily_sales')
+
+    class Meta:
+        unique_together = ('variation', 'date')
+
+    def __str__(self):
+        return f"Variation {self.variation_id} sales on {self.date}"
+
+
+class ProductDailySales(DailySales):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_sales')
+
+    class Meta:
+        unique_together = ('product', 'date')
+
+    def __str__(self):
+        return f"Product {self.product_id} sales on {self.date}"
+
+
+class BusinessDailySales(DailySales):
+    business = models.ForeignKey(Business, on_delete=models.CASCADE, related_name='daily_sales')
+
+    class Meta:
+        unique_together = ('business', 'date')
+
+    def __str__(self):
+        return f"Business {self.business_id} sales on {self.date}"
@@ -1,3 +1,139 @@
-from django.test import TestCase
+import json
+import tempfile
+from datetime import timedelta
+from io import StringIO
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from core import chat_archive
+
+from .models import ArchivedMessageBatch, BuyerSellerChat, BuyerSellerMessage, MpesaCallback
+
+
+class MessageEventsTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.buyer = User.objects.create_user(email='buyer@example.com', password='pw')
+        self.seller = User.objects.create_user(email='seller@example.com', password='pw')
+        self.chat = BuyerSellerChat.objects.create(buyer=self.buyer, seller=self.seller)
+        self.events_url = reverse('home:buyer_seller_message_events', args=[self.chat.id])
+
+    def test_wsgi_declines_to_stream(self):
+        self.client.force_login(self.buyer)
+        response = self.client.get(self.events_url)
+        self.assertEqual(response.status_code, 204)
+
+    def test_chat_page_polls_under_wsgi(self):
+        self.client.force_login(self.buyer)
+        response = self.client.get(reverse('home:buyer_seller_chat', args=[self.chat.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.context['stream_messages'])
+        self.assertContains(response, 'const streamMessages = false;')
+
+    @override_settings(CHAT_SSE_ENABLED=True)
+    def test_wsgi_streams_when_enabled(self):
+        self.client.force_login(self.buyer)
+        response = self.client.get(self.events_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        response.close()
+
+    async def test_asgi_streams(self):
+        await self.async_client.aforce_login(self.buyer)
+        response = await self.async_client.get(self.events_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertTrue(response.is_async)
+
+    def test_outsider_is_refused(self):
+        outsider = get_user_model().objects.create_user(email='outsider@example.com', password='pw')
+        self.client.force_login(outsider)
+        self.assertEqual(self.client.get(self.events_url).status_code, 403)
+
+
+def _stk_callback(checkout_request_id, result_code=0):
+    return {'Body': {'stkCallback': {
+        'MerchantRequestID': f'm-{checkout_request_id}',
+        'CheckoutRequestID': checkout_request_id,
+        'ResultCode': result_code,
+        'ResultDesc': 'The service request is processed successfully.',
+    }}}
+
+
+class ReplayCallbacksCommandTests(TestCase):
+    def _replay_file(self, payloads, *args):
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as f:
+            json.dump(payloads, f)
+            f.flush()
+            out = StringIO()
+            call_command('replay_mpesa_callbacks', '--file', f.name, *args, stdout=out)
+        return out.getvalue()
+
+    def test_dry_run_file_does_not_ingest(self):
+        MpesaCallback.objects.create(checkout_request_id='ws_stored', result_code=0,
+                                     payload=_stk_callback('ws_stored'), status='orphaned')
+        output = self._replay_file(
+            [_stk_callback('ws_new'), _stk_callback('ws_stored'), {'Body': {}}], '--dry-run'
+        )
+        self.assertIn('Skipping payload: Missing CheckoutRequestID', output)
+        self.assertIn('ws_stored  orphaned', output)
+        self.assertIn('ws_new  new  would be ingested and replayed', output)
+        self.assertEqual(list(MpesaCallback.objects.values_list('checkout_request_id', flat=True)), ['ws_stored'])
+        self.assertEqual(MpesaCallback.objects.get().duplicate_count, 0)
+
+    def test_file_is_ingested_and_replayed(self):
+        output = self._replay_file(_stk_callback('ws_new'))
+        self.assertIn('Replayed 1 callbacks', output)
+        self.assertEqual(MpesaCallback.objects.get().checkout_request_id, 'ws_new')
+
+
+@override_settings(CHAT_HISTORY_PAGE_SIZE=3)
+class ChatHistoryTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.buyer = User.objects.create_user(email='buyer@example.com')
+        seller = User.objects.create_user(email='seller@example.com')
+        self.chat = BuyerSellerChat.objects.create(buyer=self.buyer, seller=seller)
+        now = timezone.now()
+        # Six messages old enough to archive (two sharing a timestamp), four recent
+        created = [now - timedelta(days=200, minutes=10 - n) for n in (0, 1, 2, 2, 3, 4)]
+        created += [now - timedelta(minutes=4 - n) for n in range(4)]
+        self.message_ids = []
+        for n, created_at in enumerate(created):
+            message = BuyerSellerMessage.objects.create(
+                chat=self.chat, sender=seller if n % 2 else self.buyer, message=f'message {n}')
+            BuyerSellerMessage.objects.filter(pk=message.pk).update(created_at=created_at)
+            self.message_ids.append(message.id)
+        BuyerSellerChat.objects.filter(pk=self.chat.pk).update(is_active=False)
+
+    def _history(self):
+        """Scroll back from the newest message until the server says there is no more."""
+        self.client.force_login(self.buyer)
+        url = reverse('home:get_buyer_seller_messages', args=[self.chat.id])
+        cursor, seen, has_more = self.message_ids[-1], [], True
+        while has_more:
+            page = self.client.get(url, {'before_id': cursor}).json()
+            self.assertLessEqual(len(page['messages']), 3)
+            seen = [message['id'] for message in page['messages']] + seen
+            cursor, has_more = page['cursor'], page['has_more']
+        return seen
+
+    def test_pages_cover_every_message_once(self):
+        self.assertEqual(self._history(), self.message_ids[:-1])
+
+    def test_pages_continue_into_the_archive(self):
+        totals = chat_archive.archive_messages(batch_size=4)
+        self.assertEqual(totals['chat_messages'], 6)
+        self.assertEqual(ArchivedMessageBatch.objects.count(), 2)
+        self.assertEqual(self._history(), self.message_ids[:-1])
+
+
+class ExplainHotQueriesTests(TestCase):
+    def test_hot_queries_pass_their_own_check(self):
+        out = StringIO()
+        call_command('explain_hot_queries', '--fail-on-scan', stdout=out)
+        self.assertIn('No hot query falls back to a full scan or sort', out.getvalue())
@@ -34,6 +34,9 @@ urlpatterns = [
     path('api/process-card-payment/', views.process_card_payment, name='process_card_payment'),
     path('api/mpesa-callback/', views.mpesa_callback, name='mpesa_callback'),
     path('api/check-payment-status/<str:checkout_request_id>/', views.check_payment_status, name='check_payment_status'),
+    path('api/payment-requests/<int:payment_request_id>/status/', views.payment_request_status, name='payment_request_status'),
+    path('api/payment-requests/<int:payment_request_id>/wait/', views.wait_payment_status, name='wait_payment_status'),
+    path('api/payment-requests/<int:payment_request_id>/events/', views.payment_status_events, name='payment_status_events'),
     path('api/order-requests/<int:order_request_id>/process-mpesa-payment/', views.process_mpesa_payment_for_order_request, name='process_mpesa_payment_for_order_request'),
     path('wishlist/', views.wishlist_list, name='wishlist'),
     path('wishlist/add/', views.add_to_wishlist, name='add_to_wishlist'),
@@ -64,7 +67,9 @@ urlpatterns = [
     # Buyer-Seller Chat API URLs
     path('api/chat/<int:chat_id>/send/', buyer_seller_chat_views.send_message, name='send_message'),
     path('api/chat/<int:chat_id>/messages/', buyer_seller_chat_views.get_messages, name='get_buyer_seller_messages'),
+    path('api/chat/<int:chat_id>/events/', buyer_seller_chat_views.message_events, name='buyer_seller_message_events'),
     path('api/chat/<int:chat_id>/mark-read/', buyer_seller_chat_views.mark_messages_read, name='mark_messages_read'),
+    path('api/chats/search/', buyer_seller_chat_views.search_messages, name='search_messages'),
     
     # Payment Confirmation
     path('confirm-payment/<int:order_id>/', views.confirm_payment, name='confirm_payment'),
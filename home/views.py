@@ -14,11 +14,15 @@ from django.views.generic import ListView
 from django.core.paginator import Paginator
 
 from .models import Agent, ServiceCategory, ProductServicing,OrderAdditionalFees, PaymentRequest
+from core.log import lazy
+from core.payment_jobs import enqueue_stk_push
+from core.mpesa_callbacks import OPEN_PAYMENT_STATUSES, InvalidCallback, apply_payment_callback, ingest_callback
+from core.notifications import current_version, payment_request_channel, wait_for_change
 from .forms import UserRegistrationForm
 from django.contrib import messages
 from django.contrib.auth import login
 from agents.forms import AgentSearchForm
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, Http404, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404, redirect, reverse
 from django.views.generic import CreateView, TemplateView
 from django.urls import reverse_lazy
@@ -782,7 +786,7 @@ def create_order(request):
     except Cart.DoesNotExist:
         return JsonResponse({'error': 'Cart not found'}, status=404)
     except Exception as e:
-        logger.error(f'Error creating order: {str(e)}')
+        logger.error("Error creating order: %s", e)
         return JsonResponse({'error': 'An error occurred while creating your order'}, status=500)
 
 
@@ -861,9 +865,9 @@ def process_mpesa_payment(request):
             phone_number = data.get('phone_number')
             payment_plans = data.get('payment_plans', {})
             order_id = data.get('order_id')
-            logger.info(f"Payment request for phone: {phone_number}")
-            logger.info(f"Payment plans: {payment_plans}")
-            logger.info(f"Order ID: {order_id}")
+            logger.info("Payment request for phone: %s", phone_number)
+            logger.info("Payment plans: %s", payment_plans)
+            logger.info("Order ID: %s", order_id)
         except json.JSONDecodeError:
             logger.error("Invalid JSON data received")
             return JsonResponse({'error': 'Invalid request data. Please try again.'}, status=400)
@@ -878,28 +882,28 @@ def process_mpesa_payment(request):
             # Order-based payment
             try:
                 order = get_object_or_404(Order, id=order_id)
-                logger.info(f"Processing M-Pesa payment for existing order: {order_id}")
+                logger.info("Processing M-Pesa payment for existing order: %s", order_id)
                 
                 # Calculate total amount from order items
                 total_amount = order.total
                 order_ref = f"ORD-{order_id}"
                 
             except Order.DoesNotExist:
-                logger.error(f"Order {order_id} not found")
+                logger.error("Order %s not found", order_id)
                 return JsonResponse({'error': 'Order not found'}, status=404)
         else:
             # Cart-based payment (original functionality)
             try:
                 cart = _get_or_create_cart(request)
                 cart_items = cart.items.select_related('variation__product').all()
-                logger.info(f"Found cart with {cart_items.count()} items")
+                logger.info("Found cart with %s items", lazy(cart_items.count))
                 
                 if not cart_items.exists():
                     logger.error("Cart is empty")
                     return JsonResponse({'error': 'Your cart is empty. Please add items before checking out.'}, status=400)
                     
             except Exception as e:
-                logger.error(f"Error retrieving cart: {str(e)}")
+                logger.error("Error retrieving cart: %s", e)
                 return JsonResponse({'error': 'Unable to retrieve your cart. Please try again.'}, status=400)
             
             if not cart_items:
@@ -913,16 +917,16 @@ def process_mpesa_payment(request):
             if amount_override is not None:
                 try:
                     total_amount = Decimal(str(amount_override))
-                    logger.info(f"Using override amount from request: ${total_amount}")
+                    logger.info("Using override amount from request: $%s", total_amount)
                 except (ValueError, TypeError, decimal.InvalidOperation) as e:
-                    logger.warning(f"Invalid amount override '{amount_override}': {str(e)}")
+                    logger.warning("Invalid amount override '%s': %s", amount_override, e)
                     # Fall back to order total
-                    logger.info(f"Using order total: ${total_amount}")
+                    logger.info("Using order total: $%s", total_amount)
             else:
                 # Check if we should use pay_now amount or calculate from fees
                 if hasattr(order, 'pay_now') and order.pay_now and order.pay_now > 0:
                     total_amount = order.pay_now
-                    logger.info(f"Using pay_now amount from order: ${total_amount}")
+                    logger.info("Using pay_now amount from order: $%s", total_amount)
                 else:
                     # Calculate total from order items and pay_now fees
                     pay_now_fees = Decimal('0')
@@ -930,9 +934,10 @@ def process_mpesa_payment(request):
                         pay_now_fees += fee.amount
                     
                     total_amount = order.total + pay_now_fees
-                    logger.info(f"Calculated amount from order total + pay_now fees: ${total_amount} (order: ${order.total}, fees: ${pay_now_fees})")
+                    logger.info("Calculated amount from order total + pay_now fees: $%s (order: $%s, fees: $%s)", total_amount, order.total, pay_now_fees)
         else:
             # For cart payments, calculate based on payment plans with interest rates
+            total_amount = Decimal('0')
             pay_now_amount = Decimal('0')
             pay_later_amount = Decimal('0')
             total_interest = Decimal('0')
@@ -953,7 +958,7 @@ def process_mpesa_payment(request):
                     for i_rate in i_rates:
                         if i_rate.lower_range <= percentage <= i_rate.upper_range:
                             interest_rate = i_rate.rate
-                            logger.info(f"Item {item_id}: Found interest rate {interest_rate}% for percentage {percentage}%")
+                            logger.info("Item %s: Found interest rate %s%% for percentage %s%%", item_id, interest_rate, percentage)
                             break
                     
                     # Calculate amounts with interest
@@ -969,13 +974,13 @@ def process_mpesa_payment(request):
                     total_interest += interest_amount
                     total_amount += pay_now_item  # Only charge the pay now amount
                     
-                    logger.info(f"Item {item_id}: Base ${item_total}, Pay Now ${pay_now_item} ({percentage}%), Pay Later ${pay_later_item} (Interest: ${interest_amount} at {interest_rate}%)")
+                    logger.info("Item %s: Base $%s, Pay Now $%s (%s%%), Pay Later $%s (Interest: $%s at %s%%)", item_id, item_total, pay_now_item, percentage, pay_later_item, interest_amount, interest_rate)
                 else:
                     # No payment plan, pay full amount now
                     total_amount += item_total
-                    logger.info(f"Item {item_id}: No payment plan, full amount ${item_total}")
+                    logger.info("Item %s: No payment plan, full amount $%s", item_id, item_total)
             
-            logger.info(f"Final amounts - Total: ${total_amount}, Pay Now: ${pay_now_amount}, Pay Later: ${pay_later_amount}, Total Interest: ${total_interest}")
+            logger.info("Final amounts - Total: $%s, Pay Now: $%s, Pay Later: $%s, Total Interest: $%s", total_amount, pay_now_amount, pay_later_amount, total_interest)
         
         # Format phone number to M-Pesa format (254XXXXXXXXX)
         phone = str(phone_number).strip()
@@ -984,7 +989,7 @@ def process_mpesa_payment(request):
         elif not phone.startswith('254'):
             phone = f'254{phone}'
             
-        logger.info(f"Formatted phone number: {phone}")
+        logger.info("Formatted phone number: %s", phone)
         
         # Generate a unique order reference
         timestamp = int(timezone.now().timestamp())
@@ -992,24 +997,7 @@ def process_mpesa_payment(request):
             order_ref = f"ORD-{order_id}-{timestamp}"
         else:
             order_ref = f"ORD-{cart.id}-{timestamp}"
-        logger.info(f"Generated order reference: {order_ref}")
-        
-        # Initialize M-Pesa service
-        try:
-            from core.mpesa_service import MPesaService
-            mpesa = MPesaService()
-            logger.info("Initialized M-Pesa service")
-        except Exception as e:
-            logger.error(f"Failed to initialize M-Pesa service: {str(e)}")
-            return JsonResponse({
-                'error': 'Payment service is currently unavailable. Please try again later.'
-            }, status=503)
-        
-        # For testing, we'll use a public callback URL that M-Pesa can reach
-        # In production, replace this with your actual domain
-        # Let M-Pesa service handle callback URL generation
-        # This ensures ngrok and dynamic URLs work properly
-        callback_url = None  # Let the service determine the URL
+        logger.info("Generated order reference: %s", order_ref)
         
         # Ensure amount is an integer (KSH)
         try:
@@ -1021,13 +1009,14 @@ def process_mpesa_payment(request):
             logger.error(error_msg)
             return JsonResponse({"error": error_msg, "error_code": "INVALID_AMOUNT"}, status=400)
         
-        # Create PaymentRequest record before initiating STK push
+        # Record the payment as queued; the STK push itself is sent by the
+        # payment worker (manage.py run_payment_worker) outside this request.
         payment_request = PaymentRequest.objects.create(
             order_id=order_id,
             amount=total_amount,
             phone_number=phone,
-            status='pending',
-            account_reference=f"ORDER{order_id}",
+            status='queued',
+            account_reference=f"ORDER{order_id}",  # No underscores in reference
             transaction_desc=f"Order {order_id}",
             request_data={
                 'order_id': order_id,
@@ -1035,170 +1024,46 @@ def process_mpesa_payment(request):
                 'amount': str(total_amount)
             }
         )
+        enqueue_stk_push(payment_request, callback_url=_mpesa_callback_url(request))
+        logger.info("Queued STK push for payment request %s, amount: %s", payment_request.id, total_amount)
         
         # Store payment request ID in session for status checking
-        request.session['payment_request_id'] = str(payment_request.id)
+        _remember_payment_request(request, payment_request)
         request.session['payment_phone'] = phone
         request.session['payment_amount'] = str(total_amount)
         request.session['payment_order_id'] = order_id
         
-        # Initiate STK push with proper error handling
-        logger.info(f"Initiating STK push for {phone}, amount: {total_amount}")
-        
-        try:
-            response = mpesa.initiate_stk_push(
-                phone_number=phone,
-                amount=total_amount,
-                account_reference=f"ORDER{order_id}",  # No underscores in reference
-                request=request,
-                order_id=order_id,
-                description=f"Order {order_id}",
-                callback_url=callback_url
-            )
-            
-            # Update PaymentRequest with M-Pesa response
-            payment_request.merchant_request_id = response.get('MerchantRequestID')
-            payment_request.checkout_request_id = response.get('CheckoutRequestID')
-            payment_request.save()
-            
-            # Store checkout ID in session for frontend polling
-            request.session['checkout_request_id'] = response.get('CheckoutRequestID')
-            
-            # Log the raw response for debugging
-            logger.info(f"STK push response: {response}")
-            
-            # Check for errors in the response
-            if 'error' in response:
-                error_code = response.get('error_code', 'UNKNOWN')
-                error_msg = response.get('error', 'Payment request failed')
-                
-                # Log the error with details
-                logger.error(f"STK push failed: {error_msg} (Code: {error_code})")
-                
-                # User-friendly error messages based on error code
-                if error_code in ['400.002.02', '400.001.01']:
-                    error_msg = 'Invalid payment request. Please check the details and try again.'
-                elif error_code == '500.001.1001':
-                    error_msg = 'M-Pesa service is currently unavailable. Please try again later.'
-                
-                return JsonResponse({
-                    'success': False,
-                    'error': error_msg,
-                    'error_code': error_code
-                }, status=400)
-                
-            # If we get here, the STK push was initiated successfully
-            logger.info(f"STK push initiated successfully for order {order_id}")
-            
-            # Double-check the order status was saved correctly
-            order.refresh_from_db()
-            logger.info(f"Order {order_id} final status after save: {order.status}")
-            
-            return JsonResponse({
-                'success': True,
-                'message': 'Payment request sent to your phone. Please complete the payment on your device.',
-                'checkout_request_id': response.get('CheckoutRequestID'),
-                'merchant_request_id': response.get('MerchantRequestID'),
-                'order_id': order_id,
-                'order_status': order.status,  # Include current status in response
-                'redirect_url': f'/orders/{order_id}/'
-            })
-            
-        except Exception as e:
-            logger.exception("STK push failed with exception")
-            return JsonResponse({
-                'success': False,
-                'error': f'Payment request failed: {str(e)}'
-            }, status=500)
-        
-        # Handle M-Pesa response
-        if 'error' in response:
-            error_code = response.get('error_code', 'UNKNOWN')
-            error_msg = response.get('error', 'Payment request failed')
-            
-            # Log the error with details
-            logger.error(f"STK push failed: {error_msg} (Code: {error_code})")
-            
-            # Update order status to failed if we have an order
-            if order_id:
-                try:
-                    order = Order.objects.get(id=order_id)
-                    order.status = 'failed'
-                    order.save()
-                    logger.info(f"Order {order_id} status updated to 'failed' due to payment error")
-                except Order.DoesNotExist:
-                    logger.warning(f"Order {order_id} not found when trying to update status")
-            
-            # User-friendly error messages based on error code
-            if '500.001.1001' in str(error_code) or 'AUTH_ERROR' in str(error_code):
-                user_message = "Payment service is not configured. Please contact support."
-            elif '400.002.02' in str(error_code):
-                user_message = "Invalid phone number. Please check and try again."
-            elif '400.001.02' in str(error_code):
-                user_message = "Invalid amount. Please try again or contact support."
-            else:
-                user_message = f"Payment request failed: {error_msg}"
-                
-            return JsonResponse({
-                'error': user_message,
-                'error_code': error_code,
-                'debug_info': 'Please check server logs for more details.',
-                'order_status': 'failed' if order_id else None
-            }, status=400)
-        
-        # Success - log and return success response
-        logger.info(f"STK push initiated successfully. Response: {json.dumps(response)}")
-        
-        # Store order data in session for confirmation page
+        response_data = {
+            'success': True,
+            'status': 'queued',
+            'message': 'Payment request is being sent to your phone. Please complete the payment on your device.',
+            'payment_request_id': payment_request.id,
+            'status_url': reverse('home:payment_request_status', kwargs={'payment_request_id': payment_request.id}),
+            'wait_url': reverse('home:wait_payment_status', kwargs={'payment_request_id': payment_request.id}),
+            'events_url': reverse('home:payment_status_events', kwargs={'payment_request_id': payment_request.id}),
+            'order_reference': order_ref,
+        }
         if order_id:
-            # For existing orders, create a RawPayment record
-            raw_payment = RawPayment.objects.create(
-                product_id=str(order_id),
-                payment_method='mpesa',
-                amount=total_amount,
-                currency='KES',
-                status='pending',
-                transaction_id=response.get('CheckoutRequestID', ''),
-                phone_number=phone
-            )
-            
-            # Update order with payment info and set status to pending if not already in a terminal state
-            if order.status not in ['paid', 'completed', 'shipped', 'delivered']:
-                order.payment_method = 'mpesa'
-                order.transaction_id = response.get('CheckoutRequestID', '')
-                order.status = 'pending'  # Explicitly set status to pending
-                order.save()
-                logger.info(f"Order {order.id} status set to 'pending' for M-Pesa payment")
-            else:
-                logger.info(f"Order {order.id} already in {order.status} state, not changing to pending")
-            
-            return JsonResponse({
-                'success': True,
-                'message': 'Payment request sent to your phone. Please check your M-Pesa to complete the payment.',
-                'order_reference': order_ref,
+            response_data.update({
                 'order_id': order_id,
+                'order_status': order.status,
                 'redirect_url': f'/orders/{order_id}/',
-                'data': response
             })
         else:
-            # For cart payments, store in session as before
-            session_order_id = int(time.time())  # Generate unique order ID
+            # For cart payments the order is created on the confirmation page
+            session_order_id = int(time.time())
             request.session[f'pending_order_{session_order_id}'] = {
                 'cart_id': cart.id,
                 'total_amount': float(total_amount),
                 'phone': phone,
-                'transaction_id': response.get('CheckoutRequestID', ''),
+                'payment_request_id': payment_request.id,
                 'order_ref': order_ref
             }
-            
-            return JsonResponse({
-                'success': True,
-                'message': 'Payment request sent to your phone. Please check your M-Pesa to complete the payment.',
-                'order_reference': order_ref,
+            response_data.update({
                 'order_id': session_order_id,
                 'redirect_url': f'/confirm-payment/{session_order_id}/',
-                'data': response
             })
+        return JsonResponse(response_data, status=202)
         
     except Exception as e:
         logger.exception("Unexpected error processing M-Pesa payment")
@@ -1208,101 +1073,175 @@ def process_mpesa_payment(request):
         }, status=500)
 
 
+def _ingest_mpesa_callback(request):
+    """Store the raw callback in the inbox and acknowledge straight away."""
+    logger = logging.getLogger(__name__)
+    try:
+        inbox, created = ingest_callback(request.body)
+    except InvalidCallback as e:
+        logger.warning("Rejected M-Pesa callback: %s", e)
+        return JsonResponse({'ResultCode': 1, 'ResultDesc': str(e)}, status=400)
+    if not created:
+        logger.info("Duplicate M-Pesa callback ignored")
+    return JsonResponse({'ResultCode': 0, 'ResultDesc': 'Accepted'})
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def mpesa_callback(request):
-    """Handle M-Pesa payment callback to confirm payment completion."""
-    logger = logging.getLogger(__name__)
-    logger.info("Received M-Pesa callback")
-    
-    if request.method != 'POST':
-        logger.warning(f"Invalid request method: {request.method}")
-        return JsonResponse({'status': 'error', 'message': 'Method not allowed'}, status=405)
-    
-    try:
-        # Parse the callback data
-        body_unicode = request.body.decode('utf-8')
-        logger.info(f"Raw callback data: {body_unicode}")
-        
-        try:
-            data = json.loads(body_unicode)
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse JSON data: {e}")
-            return JsonResponse({'status': 'error', 'message': 'Invalid JSON data'}, status=400)
-        
-        # Extract the important parts of the callback
-        result_code = data.get('Body', {}).get('stkCallback', {}).get('ResultCode')
-        result_desc = data.get('Body', {}).get('stkCallback', {}).get('ResultDesc', '')
-        checkout_request_id = data.get('Body', {}).get('stkCallback', {}).get('CheckoutRequestID')
-        
-        logger.info(f"Callback received - ResultCode: {result_code}, ResultDesc: {result_desc}, CheckoutRequestID: {checkout_request_id}")
-        
-        # Try to find the payment request by checkout_request_id
-        try:
-            payment_request = PaymentRequest.objects.get(checkout_request_id=checkout_request_id)
-            logger.info(f"Found payment request: {payment_request.id} for checkout request: {checkout_request_id}")
-            
-            # Update the payment request with the callback data
-            payment_request.update_from_callback(data)
-            
-            # Get the order if it exists
-            if hasattr(payment_request, 'order'):
-                order = payment_request.order
-                
-                # Handle different payment statuses
-                if payment_request.status == 'completed':
-                    # Successful payment
-                    order.status = 'paid'
-                    order.payment_method = 'M-Pesa'
-                    order.transaction_id = payment_request.mpesa_receipt_number
-                    order.save()
-                    
-                    logger.info(f"Order {order.id} marked as paid with M-Pesa receipt {payment_request.mpesa_receipt_number}")
-                    
-                    # Clear the cart if it exists
-                    if hasattr(request, 'session') and 'cart_id' in request.session:
-                        try:
-                            cart = Cart.objects.get(id=request.session['cart_id'])
-                            cart.delete()
-                            del request.session['cart_id']
-                            logger.info(f"Cart cleared after successful payment for order {order.id}")
-                        except Cart.DoesNotExist:
-                            logger.warning(f"Cart {request.session.get('cart_id')} not found")
-                        except Exception as e:
-                            logger.error(f"Error clearing cart: {str(e)}", exc_info=True)
-                
-                elif payment_request.status == 'cancelled':
-                    # Payment was cancelled by user
-                    order.status = 'cancelled'
-                    order.payment_status = 'cancelled'
-                    order.save()
-                    logger.info(f"Order {order.id} marked as cancelled")
-                
-                elif payment_request.status == 'failed':
-                    # Payment failed
-                    order.status = 'payment_failed'
-                    order.save()
-                    logger.info(f"Order {order.id} marked as payment failed")
-            
-            return JsonResponse({
-                'status': 'success', 
-                'message': 'Callback processed successfully',
-                'payment_status': payment_request.status
-            })
-            
-        except PaymentRequest.DoesNotExist:
-            logger.warning(f"Payment request not found for checkout_request_id: {checkout_request_id}")
-            return JsonResponse(
-                {'status': 'error', 'message': 'Payment request not found'}, 
-                status=404
-            )
-        
-    except Exception as e:
-        logger.error(f"Error processing M-Pesa callback: {str(e)}", exc_info=True)
-        return JsonResponse(
-            {'status': 'error', 'message': 'Internal server error'}, 
-            status=500
+    """
+    Receive an M-Pesa STK callback. The payload is written to the callback
+    inbox and applied by `manage.py process_mpesa_callbacks`.
+    """
+    return _ingest_mpesa_callback(request)
+
+
+def _mpesa_callback_url(request):
+    """Resolve the STK callback URL while the request (and its host) is still available."""
+    from core.mpesa_service import resolve_callback_url
+    return resolve_callback_url(request=request)
+
+
+# PaymentRequest states that will not change again
+FINAL_PAYMENT_STATUSES = ('completed', 'failed', 'cancelled', 'timeout', 'insufficient')
+
+# Upper bound on how long a status request may hold its connection
+PAYMENT_STATUS_MAX_WAIT = 60
+
+
+# Payment requests a session can check the status of
+SESSION_PAYMENT_REQUESTS = 20
+
+
+def _remember_payment_request(request, payment_request):
+    """Let this session poll ``payment_request`` (besides its order's owner)."""
+    request.session['payment_request_id'] = str(payment_request.id)
+    recent = [pk for pk in request.session.get('payment_request_ids', []) if pk != payment_request.id]
+    request.session['payment_request_ids'] = (recent + [payment_request.id])[-SESSION_PAYMENT_REQUESTS:]
+
+
+def _own_payment_request(request, payment_request_id):
+    """
+    The PaymentRequest if this session started it or the signed-in user owns
+    its order or order request; 404 otherwise, so ids cannot be probed.
+    """
+    payment_request = get_object_or_404(
+        PaymentRequest.objects.select_related('order', 'order_request'), id=payment_request_id
+    )
+    if payment_request.id in request.session.get('payment_request_ids', ()):
+        return payment_request
+    if request.session.get('payment_request_id') == str(payment_request.id):
+        return payment_request
+    user = request.user
+    if user.is_authenticated:
+        owners = {
+            payment_request.order.user_id if payment_request.order else None,
+            payment_request.order_request.user_id if payment_request.order_request else None,
+        }
+        if user.pk in owners:
+            return payment_request
+    raise Http404("Payment request not found")
+
+
+def _payment_request_status_data(payment_request):
+    data = {
+        'payment_request_id': payment_request.id,
+        'status': payment_request.status,
+        'checkout_request_id': payment_request.checkout_request_id,
+        'merchant_request_id': payment_request.merchant_request_id,
+        'is_queued': payment_request.status == 'queued',
+        'is_final': payment_request.status in FINAL_PAYMENT_STATUSES,
+        'error': None,
+    }
+    if payment_request.checkout_request_id:
+        data['check_status_url'] = reverse(
+            'home:check_payment_status',
+            kwargs={'checkout_request_id': payment_request.checkout_request_id}
         )
+    if payment_request.status == 'failed':
+        data['error'] = {
+            'code': payment_request.error_code,
+            'description': payment_request.error_message or 'Payment failed',
+        }
+    return data
+
+
+def _wait_timeout(request, default=25):
+    try:
+        timeout = float(request.GET.get('timeout', default))
+    except (TypeError, ValueError):
+        timeout = default
+    return max(0, min(timeout, PAYMENT_STATUS_MAX_WAIT))
+
+
+@require_http_methods(["GET"])
+def payment_request_status(request, payment_request_id):
+    """Report the state of a queued STK push, including its CheckoutRequestID once sent."""
+    payment_request = _own_payment_request(request, payment_request_id)
+    return JsonResponse(_payment_request_status_data(payment_request))
+
+
+@require_http_methods(["GET"])
+def wait_payment_status(request, payment_request_id):
+    """
+    Long-poll variant of payment_request_status.
+
+    Holds the connection until the status differs from ``?status=`` (the
+    caller's last known status) or ``?timeout=`` seconds pass. Waiting is
+    driven by notifications from the payment worker and callback processor,
+    so idle waiters do not query the database.
+    """
+    channel = payment_request_channel(payment_request_id)
+    version = current_version(channel)
+    payment_request = _own_payment_request(request, payment_request_id)
+    known_status = request.GET.get('status')
+
+    changed = known_status is not None and payment_request.status != known_status
+    if not changed and payment_request.status not in FINAL_PAYMENT_STATUSES:
+        notified = wait_for_change(channel, version, _wait_timeout(request)) is not None
+        # Re-read even on timeout, in case a notification was missed
+        payment_request.refresh_from_db()
+        changed = notified or (known_status is not None and payment_request.status != known_status)
+
+    data = _payment_request_status_data(payment_request)
+    data['changed'] = changed
+    return JsonResponse(data)
+
+
+@require_http_methods(["GET"])
+def payment_status_events(request, payment_request_id):
+    """
+    Server-sent events stream of a payment request's status.
+
+    Emits a ``status`` event immediately and after every change, and closes
+    once the payment reaches a final state or ``?timeout=`` seconds pass.
+    """
+    channel = payment_request_channel(payment_request_id)
+    version = current_version(channel)
+    payment_request = _own_payment_request(request, payment_request_id)
+    deadline = time.monotonic() + _wait_timeout(request, default=PAYMENT_STATUS_MAX_WAIT)
+
+    def event_stream(payment_request, version):
+        while True:
+            yield f"event: status\ndata: {json.dumps(_payment_request_status_data(payment_request))}\n\n"
+            if payment_request.status in FINAL_PAYMENT_STATUSES:
+                return
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    yield "event: timeout\ndata: {}\n\n"
+                    return
+                new_version = wait_for_change(channel, version, min(remaining, 15))
+                if new_version is not None:
+                    version = new_version
+                    break
+                yield ": keepalive\n\n"
+            payment_request.refresh_from_db()
+
+    response = StreamingHttpResponse(event_stream(payment_request, version), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 
 @require_http_methods(["GET"])
@@ -1312,14 +1251,14 @@ def check_payment_status(request, checkout_request_id):
     try:
         # Find the payment request by checkout_request_id
         payment_request = get_object_or_404(PaymentRequest, checkout_request_id=checkout_request_id)
-        logger.info(f"Found payment request: {payment_request.id}, status: {payment_request.status}")
+        logger.info("Found payment request: %s, status: %s", payment_request.id, payment_request.status)
         
         # Get the associated order if it exists
         order = payment_request.order if hasattr(payment_request, 'order') else None
         order_id = order.id if order else None
         
         if payment_request:
-            logger.info(f"Found payment request for order {order_id}: {payment_request.id}, status: {payment_request.status}")
+            logger.info("Found payment request for order %s: %s, status: %s", order_id, payment_request.id, payment_request.status)
             
             # Map payment request status to payment info
             if payment_request.status == 'completed':
@@ -1372,7 +1311,7 @@ def check_payment_status(request, checkout_request_id):
                 order = Order.objects.get(id=payment_request.order_id)
                 order_id = order.id
             except Order.DoesNotExist:
-                logger.warning(f"Order {payment_request.order_id} not found for payment request {payment_request.id}")
+                logger.warning("Order %s not found for payment request %s", payment_request.order_id, payment_request.id)
         
         # Prepare the response data
         response_data = {
@@ -1405,14 +1344,14 @@ def check_payment_status(request, checkout_request_id):
         return JsonResponse(response_data)
         
     except PaymentRequest.DoesNotExist:
-        logger.warning(f"Payment request with checkout_request_id {checkout_request_id} not found")
+        logger.warning("Payment request with checkout_request_id %s not found", checkout_request_id)
         return JsonResponse(
             {'status': 'not_found', 'message': 'Payment request not found'}, 
             status=404
         )
         
     except Exception as e:
-        logger.error(f"Error checking payment status: {str(e)}")
+        logger.error("Error checking payment status: %s", e)
         return JsonResponse({
             'error': 'Failed to check payment status'
         }, status=500)
@@ -1464,6 +1403,8 @@ def confirm_payment(request, order_id):
             # Calculate total
             total_amount = sum(item.variation.price * item.quantity for item in cart_items)
             
+            payment_request = PaymentRequest.objects.filter(pk=order_data.get('payment_request_id')).first()
+            
             # Create the order
             order = Order.objects.create(
                 id=order_id,
@@ -1472,7 +1413,7 @@ def confirm_payment(request, order_id):
                 total=total_amount,
                 status='pending',
                 payment_method='mpesa',
-                transaction_id=order_data.get('transaction_id', ''),
+                transaction_id='',
             )
             
             # Create order items
@@ -1484,6 +1425,20 @@ def confirm_payment(request, order_id):
                     price=cart_item.variation.price
                 )
             
+            if payment_request is not None:
+                # Link the payment so callbacks and the reconciler update this
+                # order, then pick up the CheckoutRequestID (the push may still
+                # be queued, in which case the payment worker records it)
+                payment_request.order = order
+                payment_request.save(update_fields=['order', 'updated_at'])
+                payment_request.refresh_from_db()
+                if payment_request.checkout_request_id:
+                    order.transaction_id = payment_request.checkout_request_id
+                    order.save(update_fields=['transaction_id', 'updated_at'])
+                if payment_request.status not in OPEN_PAYMENT_STATUSES and payment_request.callback_data:
+                    # The payment finished before the order existed
+                    apply_payment_callback(payment_request, payment_request.callback_data)
+            
             # Clear the cart and session data
             cart.delete()
             request.session.pop(f'pending_order_{order_id}', None)
@@ -1499,7 +1454,7 @@ def confirm_payment(request, order_id):
         return render(request, 'home/confirm_payment.html', context)
         
     except Exception as e:
-        logger.error(f"Error in confirm_payment: {str(e)}")
+        logger.error("Error in confirm_payment: %s", e)
         messages.error(request, "An error occurred. Please try again.")
         return redirect('home:home')
 
@@ -1608,124 +1563,12 @@ def order_history(request):
 
 @csrf_exempt
 def order_detail(request, order_id):
-    """Display a single Order and its items. Also handles M-Pesa callbacks."""
-    logger = logging.getLogger(__name__)
-    order = get_object_or_404(Order.objects.prefetch_related('items__variation__product'), id=order_id)
-    
-    # Handle M-Pesa callback if this is a POST request
+    """Display a single Order and its items. Also accepts M-Pesa callbacks."""
+    # M-Pesa callbacks posted here go through the same inbox as mpesa_callback
     if request.method == 'POST':
-        logger.info(f"M-Pesa callback POST received for order {order_id}")
-        print(f"DEBUG: M-Pesa callback POST received for order {order_id}")
-        try:
-            # Parse M-Pesa callback data
-            callback_data = json.loads(request.body)
-            logger.info(f"M-Pesa callback received for order {order_id}: {callback_data}")
-            print(f"DEBUG: M-Pesa callback data: {callback_data}")
-            
-            # Extract payment information from callback
-            callback_body = callback_data.get('Body', {})
-            stk_callback = callback_body.get('stkCallback', {})
-            result_code = stk_callback.get('ResultCode', 0)
-            result_desc = stk_callback.get('ResultDesc', '')
-            
-            # Check if this is a user cancellation (ResultCode 1032)
-            is_user_cancellation = (result_code == 1032 or 'cancelled' in result_desc.lower())
-            
-            if result_code == 0:
-                # Payment successful
-                callback_metadata = stk_callback.get('CallbackMetadata', {}).get('Item', [])
-                
-                # Extract payment details
-                payment_data = {}
-                for item in callback_metadata:
-                    if item.get('Name') == 'Amount':
-                        payment_data['amount'] = item.get('Value')
-                    elif item.get('Name') == 'MpesaReceiptNumber':
-                        payment_data['mpesa_receipt'] = item.get('Value')
-                    elif item.get('Name') == 'PhoneNumber':
-                        payment_data['phone_number'] = item.get('Value')
-                    elif item.get('Name') == 'TransactionDate':
-                        payment_data['transaction_date'] = item.get('Value')
-                
-                # Only update order status for successful payments
-                if order.status != 'paid':  # Only update if not already paid
-                    order.status = 'paid'
-                    order.payment_method = 'mpesa'
-                    order.save()
-                
-                # Only create/update RawPayment record for successful payments
-                raw_payment = RawPayment.objects.filter(product_id=str(order_id)).first()
-                if raw_payment:
-                    # Update existing record
-                    raw_payment.status = 'success'
-                    raw_payment.transaction_id = payment_data.get('mpesa_receipt', '')
-                    raw_payment.mpesa_receipt = payment_data.get('mpesa_receipt', '')
-                    raw_payment.phone_number = payment_data.get('phone_number', '')
-                    raw_payment.amount = payment_data.get('amount', 0)
-                    raw_payment.save()
-                else:
-                    # Create new record only for successful payments
-                    RawPayment.objects.create(
-                        product_id=str(order_id),
-                        status='success',
-                        transaction_id=payment_data.get('mpesa_receipt', ''),
-                        mpesa_receipt=payment_data.get('mpesa_receipt', ''),
-                        phone_number=payment_data.get('phone_number', ''),
-                        amount=payment_data.get('amount', 0),
-                    )
-                
-                logger.info(f"Order {order_id} payment processed successfully")
-                
-                # Set session variable to indicate callback was processed successfully
-                request.session[f'callback_processed_{order_id}'] = {
-                    'status': 'success',
-                    'message': 'Payment successful',
-                    'timestamp': timezone.now().isoformat()
-                }
-                
-            else:
-                # Payment failed or was cancelled - determine failure type
-                is_timeout = 'timeout' in result_desc.lower() or result_code in [1037, 2001]
-                is_insufficient_funds = 'insufficient' in result_desc.lower() or result_code in [1, 1001]
-                
-                # Determine failure type
-                if is_user_cancellation:
-                    failure_type = "cancelled"
-                elif is_timeout:
-                    failure_type = "timeout"
-                elif is_insufficient_funds:
-                    failure_type = "insufficient_funds"
-                else:
-                    failure_type = "failed"
-                
-                logger.warning(f"Payment for order {order_id} {failure_type} with code {result_code}: {result_desc}")
-                
-                # Set session variable to indicate callback was processed
-                request.session[f'callback_processed_{order_id}'] = {
-                    'status': 'failed',
-                    'failure_type': failure_type,
-                    'message': result_desc,
-                    'timestamp': timezone.now().isoformat()
-                }
-                
-                # Return failure response with details for frontend processing
-                return JsonResponse({
-                    'ResultCode': 1, 
-                    'ResultDesc': 'Failed',
-                    'failure_type': failure_type,
-                    'is_user_cancelled': is_user_cancellation,
-                    'is_timeout': is_timeout,
-                    'is_insufficient_funds': is_insufficient_funds,
-                    'message': result_desc,
-                    'order_id': order_id
-                })
-            
-            # Return success response to M-Pesa for successful payments
-            return JsonResponse({'ResultCode': 0, 'ResultDesc': 'Success'}) 
-            
-        except Exception as e: 
-            logger.error(f"Error processing M-Pesa callback for order {order_id}: {str(e)}")
-            return JsonResponse({'ResultCode': 1, 'ResultDesc': 'Failed'}, status=500)
+        return _ingest_mpesa_callback(request)
+    
+    order = get_object_or_404(Order.objects.prefetch_related('items__variation__product'), id=order_id)
     
     # Get payment information from Payment and RawPayment
     payment_info = None
@@ -1780,7 +1623,7 @@ def order_detail(request, order_id):
             }
     except Exception as e:
         logger = logging.getLogger(__name__)
-        logger.error(f"Error fetching payment info: {str(e)}")
+        logger.error("Error fetching payment info: %s", e)
         payment_info = {
             'status': 'error',
             'error': str(e),
@@ -1947,7 +1790,6 @@ def process_mpesa_payment_for_order_request(request, order_request_id):
     logger = logging.getLogger(__name__)
     try:
         body = json.loads(request.body or '{}')
-        print(body)
     except json.JSONDecodeError:
         return JsonResponse({'error': 'Invalid request data'}, status=400)
 
@@ -2000,54 +1842,37 @@ def process_mpesa_payment_for_order_request(request, order_request_id):
         if amount_payable_now <= 0:
             return JsonResponse({'error': 'Nothing to pay right now.'}, status=400)
 
-        # Initiate STK push via MPesaService
-        try:
-            from core.mpesa_service import MPesaService
-            mpesa = MPesaService()
-        except Exception as e:
-            logger.error(f'Failed to init MPesaService: {e}')
-            return JsonResponse({'error': 'Payment service unavailable. Try again later.'}, status=503)
+        # Queue the STK push; the payment worker sends it outside this request
+        payment_request = PaymentRequest.objects.create(
+            order_request=order_request,
+            amount=amount_payable_now,
+            phone_number=phone,
+            status='queued',
+            account_reference=f'OR-{order_request_id}',
+            transaction_desc=f'OrderRequest {order_request_id} payment',
+            request_data={
+                'order_request_id': order_request_id,
+                'phone_number': phone,
+                'amount': str(amount_payable_now)
+            }
+        )
+        enqueue_stk_push(payment_request, callback_url=_mpesa_callback_url(request))
+        _remember_payment_request(request, payment_request)
 
-        try:
-            response = mpesa.initiate_stk_push(
-                phone_number=phone,
-                amount=amount_payable_now,
-                account_reference=f'OR-{order_request_id}',
-                request=request,
-                order_id=order_request_id,
-                description=f'OrderRequest {order_request_id} payment'
-            )
-            # Normalize response to dict-like
-            resp_dict = {}
-            if isinstance(response, dict):
-                resp_dict = response
-            else:
-                # Try to map common attributes
-                for attr in ('error', 'error_code', 'MerchantRequestID', 'CheckoutRequestID', 'ResponseCode', 'ResponseDescription'):
-                    if hasattr(response, attr):
-                        resp_dict[attr] = getattr(response, attr)
-                # Fallback: mark success if not explicitly error
-                if not resp_dict:
-                    resp_dict = {'raw': str(response)}
-
-            # If explicit error key -> fail
-            if 'error' in resp_dict and resp_dict.get('error'):
-                err_msg = resp_dict.get('error') or 'Payment initiation failed'
-                err_code = resp_dict.get('error_code') or resp_dict.get('ResponseCode') or 'UNKNOWN'
-                return JsonResponse({'error': f'{err_msg}', 'error_code': err_code}, status=400)
-
-            # Otherwise treat as success (STK prompt delivered)
-            return JsonResponse({
-                'success': True,
-                'message': 'STK push sent. Check your phone.',
-                'checkout_request_id': resp_dict.get('CheckoutRequestID'),
-                'merchant_request_id': resp_dict.get('MerchantRequestID'),
-            })
-        except Exception as e:
-            logger.error(f'STK push failed: {e}', exc_info=True)
-            return JsonResponse({'error': 'Failed to initiate payment. Please try again.'}, status=500)
-    except:
-        pass
+        return JsonResponse({
+            'success': True,
+            'status': 'queued',
+            'message': 'STK push is being sent. Check your phone.',
+            'payment_request_id': payment_request.id,
+            'status_url': reverse('home:payment_request_status', kwargs={'payment_request_id': payment_request.id}),
+            'wait_url': reverse('home:wait_payment_status', kwargs={'payment_request_id': payment_request.id}),
+            'events_url': reverse('home:payment_status_events', kwargs={'payment_request_id': payment_request.id}),
+        }, status=202)
+    except Http404:
+        raise
+    except Exception as e:
+        logger.error("Failed to queue STK push for order request %s: %s", order_request_id, e, exc_info=True)
+        return JsonResponse({'error': 'Failed to initiate payment. Please try again.'}, status=500)
 
 
 @require_http_methods(["POST"])
@@ -2065,7 +1890,7 @@ def process_card_payment(request):
             cvv = data.get('cvv')
             cardholder_name = data.get('cardholder_name')
             order_id = data.get('order_id')
-            logger.info(f"Card payment request for order: {order_id}")
+            logger.info("Card payment request for order: %s", order_id)
         except json.JSONDecodeError:
             logger.error("Invalid JSON data received")
             return JsonResponse({'error': 'Invalid request data. Please try again.'}, status=400)
@@ -2118,7 +1943,7 @@ def process_card_payment(request):
         order.transaction_id = transaction_id
         order.save()
         
-        logger.info(f"Card payment processed successfully for order {order_id}")
+        logger.info("Card payment processed successfully for order %s", order_id)
         
         return JsonResponse({
             'success': True,
@@ -3,6 +3,8 @@ class ProductChat {
         // Required options
         this.productId = options.productId;
         this.variationId = options.variationId;
+        // '/core/api/chat/async/' when served under ASGI
+        this.apiUrl = options.apiUrl || '/core/api/chat/';
         
         // DOM Elements - use the IDs from the template
         this.chatBtn = document.getElementById(options.chatButtonId || 'aiChatButton');
@@ -79,11 +81,12 @@ class ProductChat {
             // Add to chat history
             this.chatHistory.push({ is_user: true, text: message });
             
-            // Send to server
-            const response = await fetch('/core/api/chat/', {
+            // Send to server; ask for a token stream and fall back to JSON
+            const response = await fetch(this.apiUrl, {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
+                    'Accept': 'text/event-stream, application/json',
                     'X-CSRFToken': this.getCSRFToken(),
                 },
                 body: JSON.stringify({
@@ -91,15 +94,26 @@ class ProductChat {
                     product_id: this.productId,
                     variation_id: this.variationId,
                     chat_history: this.chatHistory.slice(-5), // Send last 5 messages for context
+                    stream: true,
                 }),
             });
             
+            const contentType = response.headers.get('Content-Type') || '';
+            if (response.ok && response.body && contentType.includes('text/event-stream')) {
+                const reply = await this.readStream(response);
+                this.chatHistory.push({ is_user: false, text: reply });
+                return;
+            }
+            
             const data = await response.json();
             
             if (response.ok) {
                 // Add bot response to chat
                 this.addMessage('assistant', data.response);
                 this.chatHistory.push({ is_user: false, text: data.response });
+            } else if (response.status === 429) {
+                // Rate limited or the assistant is at capacity: show the server's hint
+                this.addMessage('assistant', data.error);
             } else {
                 throw new Error(data.error || 'Failed to get response');
             }
@@ -134,6 +148,59 @@ class ProductChat {
         // Add to messages container
         this.chatMessages.appendChild(messageDiv);
         this.scrollToBottom();
+        return contentDiv;
+    }
+    
+    async readStream(response) {
+        // Parse server-sent events and grow a single assistant bubble as tokens arrive
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let reply = '';
+        let bubble = null;
+        
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const rawEvent = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+                
+                let event = 'message';
+                let payload = '';
+                rawEvent.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) event = line.slice(6).trim();
+                    else if (line.startsWith('data:')) payload += line.slice(5).trim();
+                });
+                if (!payload) continue;
+                const data = JSON.parse(payload);
+                
+                if (event === 'token') {
+                    if (!bubble) {
+                        if (this.typingIndicator) {
+                            this.typingIndicator.classList.add('hidden');
+                        }
+                        bubble = this.addMessage('assistant', '');
+                    }
+                    reply += data.text;
+                    bubble.textContent = reply;
+                    this.scrollToBottom();
+                } else if (event === 'done') {
+                    reply = data.response || reply;
+                    if (bubble) bubble.textContent = reply;
+                } else if (event === 'error') {
+                    throw new Error(data.error || 'Failed to get response');
+                }
+            }
+        }
+        
+        if (!bubble) {
+            this.addMessage('assistant', reply);
+        }
+        return reply;
     }
     
     scrollToBottom() {